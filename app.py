@@ -3,12 +3,14 @@ from dotenv import load_dotenv
 load_dotenv()
 import json
 import time
+import hashlib
 import sqlite3
-import threading
 import config
 import subprocess
 import sys
-from datetime import datetime
+import threading
+from datetime import datetime, timezone
+from functools import wraps
 from typing import Any, Dict, List, Optional
 from urllib.parse import quote_plus
 
@@ -17,13 +19,25 @@ try:
 except ImportError:
     pytz = None
 
-from flask import Flask, render_template, request, jsonify, abort, redirect, url_for, flash
+from flask import Flask, render_template, request, jsonify, abort, redirect, url_for, flash, make_response, Response, stream_with_context
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from pydantic import BaseModel, Field, ValidationError
 
 import db
+import export
+import feedpoll
+import jobs
+import logutil
+import metrics
+import progress
+import reports
+import sqlprofile
+import workerlock
+from cache import LRUCache
+
+api_logger = logutil.get_logger("api_rel")
 
 # Ensure database schema is up to date on start (runs even under gunicorn)
 db.ensure_schema()
@@ -47,26 +61,34 @@ class HistorySchema(BaseModel):
     days: int = Field(default=7, ge=1)
 
 class SpreadReportSchema(BaseModel):
-    threshold: float = Field(default=20.0, ge=0)
+    threshold: float = Field(default=reports.SPREAD_DEFAULTS["threshold"], ge=0)
     limit: int = Field(default=100, ge=1, le=500)
     page: int = Field(default=1, ge=1)
-    max_price: float = Field(default=2000000.0, ge=0)
-    in_stock_only: int = Field(default=1, ge=0, le=1)
+    max_price: float = Field(default=reports.SPREAD_DEFAULTS["max_price"], ge=0)
+    in_stock_only: int = Field(default=reports.SPREAD_DEFAULTS["in_stock_only"], ge=0, le=1)
     exclude: List[str] = Field(default_factory=list)
 
 class MarkupReportSchema(BaseModel):
-    markup_pct: float = Field(default=10.0, ge=0)
+    markup_pct: float = Field(default=reports.MARKUP_DEFAULTS["markup_pct"], ge=0)
     limit: int = Field(default=100, ge=1, le=500)
     page: int = Field(default=1, ge=1)
-    max_price: float = Field(default=2000000.0, ge=0)
-    in_stock_only: int = Field(default=1, ge=0, le=1)
-    qty_equal: int = Field(default=0, ge=0, le=1)
+    max_price: float = Field(default=reports.MARKUP_DEFAULTS["max_price"], ge=0)
+    in_stock_only: int = Field(default=reports.MARKUP_DEFAULTS["in_stock_only"], ge=0, le=1)
+    qty_equal: int = Field(default=reports.MARKUP_DEFAULTS["qty_equal"], ge=0, le=1)
     exclude: List[str] = Field(default_factory=list)
 
+class BulkSchema(BaseModel):
+    since: int = Field(default=0, ge=0)
+    gzip: int = Field(default=1, ge=0, le=1)
+
+class DeltaSchema(BaseModel):
+    since: int = Field(default=0, ge=0)
+    limit: int = Field(default=1000, ge=1, le=10000)
+
 class ChangesReportSchema(BaseModel):
-    days: int = Field(default=7, ge=1)
-    threshold: float = Field(default=30.0, ge=0)
-    type: str = "all"
+    days: int = Field(default=reports.CHANGES_DEFAULTS["days"], ge=1)
+    threshold: float = Field(default=reports.CHANGES_DEFAULTS["threshold"], ge=0)
+    type: str = reports.CHANGES_DEFAULTS["type"]
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("FLASK_SECRET_KEY")
@@ -87,6 +109,8 @@ def get_rate_limit_key():
     # 3. Fallback for unauthorized/anonymous visitors
     return f"ip:{get_remote_address()}"
 
+app.config["RATELIMIT_ENABLED"] = os.environ.get("RATELIMIT_ENABLED", "1") == "1"
+
 # Initialize rate limiter
 limiter = Limiter(
     get_rate_limit_key,
@@ -101,6 +125,23 @@ APP_VERSION = "1.8.4"  # Health Check & Pydantic Validation
 def inject_version():
     return dict(version=APP_VERSION)
 
+# --- Metrics ---
+@app.before_request
+def _metrics_start():
+    request._metrics_t0 = time.perf_counter()
+
+@app.after_request
+def _metrics_record(response):
+    t0 = getattr(request, "_metrics_t0", None)
+    if t0 is not None:
+        # Route template, not the raw path, to keep label cardinality bounded
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.observe("priceweb_http_request_duration_seconds", time.perf_counter() - t0,
+                        route=route, method=request.method)
+        metrics.inc("priceweb_http_requests_total", route=route, method=request.method, status=response.status_code)
+        metrics.flush()
+    return response
+
 # --- Authentication ---
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -191,6 +232,105 @@ def _parse_filter_value(val):
     except (ValueError, TypeError):
         return '=', val # Fallback to string equality if not a number
 
+# --- HTTP Caching ---
+# Data only changes when the worker commits (meta.last_reload_ts) or items are
+# edited manually, so rendered responses are keyed by that version + query args.
+response_cache = LRUCache(
+    max_entries=int(os.environ.get("RESPONSE_CACHE_SIZE", "64")),
+    max_bytes=int(float(os.environ.get("RESPONSE_CACHE_MB", "32")) * 1024 * 1024),
+)
+_response_cache_version = {"v": None}
+
+def _cache_metrics():
+    for name, stats in (("responses", response_cache.stats()), ("reports", reports.cache_stats())):
+        yield "priceweb_cache_hits_total", {"cache": name}, stats["hits"]
+        yield "priceweb_cache_misses_total", {"cache": name}, stats["misses"]
+
+metrics.register_collector(_cache_metrics)
+
+def _get_data_version():
+    conn = db.get_connection()
+    try:
+        return db.get_data_version(conn), db.get_data_modified_ts(conn)
+    finally:
+        conn.close()
+
+def _normalized_args() -> str:
+    """Query args sorted and stripped so equivalent URLs share a cache key."""
+    pairs = sorted((k, v.strip()) for k, v in request.args.items(multi=True) if v.strip())
+    return "&".join(f"{quote_plus(k)}={quote_plus(v)}" for k, v in pairs)
+
+def cached_view(fn=None, *, windowed=False):
+    """Adds ETag/Last-Modified, 304 handling and a server-side response cache to a GET view.
+
+    windowed=True for views over a clock-relative window ("last N days"): the window step
+    (reports.window_start) joins the cache key, and Last-Modified moves on with it.
+    """
+    if fn is None:
+        return lambda f: cached_view(f, windowed=windowed)
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        version, modified_ts = _get_data_version()
+        if _response_cache_version["v"] != version:
+            # New data committed: every cached body is stale
+            response_cache.clear()
+            _response_cache_version["v"] = version
+
+        user_id = getattr(current_user, "id", "") or ""
+        key_version = version
+        if windowed:
+            key_version = reports.windowed_version(version)
+            modified_ts = max(modified_ts, reports.window_start())
+        key = f"{key_version}|{user_id}|{request.path}?{_normalized_args()}"
+        etag = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        last_modified = datetime.fromtimestamp(modified_ts, tz=timezone.utc) if modified_ts else None
+
+        not_modified = False
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains(etag)
+        elif last_modified and request.if_modified_since:
+            not_modified = request.if_modified_since >= last_modified.replace(microsecond=0)
+
+        if not_modified:
+            resp = make_response("", 304)
+        else:
+            cached = response_cache.get(key)
+            if cached is not None:
+                body, mimetype = cached
+                resp = make_response(body)
+                resp.mimetype = mimetype
+            else:
+                resp = make_response(fn(*args, **kwargs))
+                if resp.status_code != 200:
+                    return resp
+                body = resp.get_data()
+                response_cache.put(key, (body, resp.mimetype), size=len(body))
+
+        resp.set_etag(etag)
+        if last_modified:
+            resp.last_modified = last_modified
+        # Responses are per-user; the browser must revalidate, which is a cheap 304
+        resp.headers["Cache-Control"] = "private, no-cache"
+        return resp
+    return wrapper
+
+def _enqueue_reload(source: str):
+    """Queues a worker run; returns (job id, queued behind other work).
+
+    The run happens in the job consumer (`worker.py --daemon`), not in a gunicorn worker.
+    Without a daemon a one-shot `worker.py --drain` is started to empty the queue.
+    """
+    conn = db.get_connection()
+    try:
+        job_id, coalesced = jobs.enqueue(conn, "reload", source)
+    finally:
+        conn.close()
+    if not workerlock.consumer_running():
+        subprocess.Popen([sys.executable, "worker.py", "--drain"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+    return job_id, coalesced or workerlock.is_running()
+
 @app.route('/api/run-worker-external', methods=['GET', 'POST'])
 @limiter.limit("5 per minute")
 def run_worker_external():
@@ -205,79 +345,84 @@ def run_worker_external():
         return jsonify({"status": "error", "message": "Invalid or missing token"}), 403
     
     try:
-        # Run worker in background
-        subprocess.Popen([sys.executable, "worker.py"])
-        return jsonify({"status": "started"}), 200
+        job_id, queued = _enqueue_reload("api/run-worker-external")
+        return jsonify({"status": "queued" if queued else "started", "job_id": job_id}), 200
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+def _build_search_sql(q: str = "", sort_by: str = "created_at", sort_asc: bool = False, filters: Dict = None):
+    """Returns (where_sql, params, order_sql) for the items_latest search used by the UI, API and export."""
+    # Whitelist sort columns to prevent SQL injection
+    allowed_sorts = {
+        'created_at': 'created_at',
+        'updated_at': 'updated_at',
+        'sku': 'sku',
+        'name': 'name',
+        'our_price': 'our_price',
+        'our_qty': 'our_qty',
+        'my_sklad_price': 'my_sklad_price',
+        'my_sklad_qty': 'my_sklad_qty',
+        'min_sup_price': 'min_sup_price',
+        'min_sup_qty': 'min_sup_qty',
+        'min_sup_supplier': 'min_sup_supplier'
+    }
+    order_col = allowed_sorts.get(sort_by, 'created_at')
+    order_dir = "ASC" if sort_asc else "DESC"
+    
+    where_clauses = []
+    params = []
+    
+    # 1. Text Search (q)
+    q = (q or "").strip()
+    if q:
+        # We use a simple LIKE approach for now to combine with other filters easily
+        # FTS matches are hard to combine with complex WHEREs without joining
+        # For simplicity and robustness with sorting/filtering:
+        tokens = q.split()
+        for t in tokens:
+            where_clauses.append("(lower(sku) LIKE ? OR lower(name) LIKE ?)")
+            params.append(f"%{t}%")
+            params.append(f"%{t}%")
+
+    # 2. Filters
+    if filters:
+        for col, val in filters.items():
+            if not val: continue
+            val = str(val).strip()
+            
+            # Special handling for quantity logic embedded in price fields (from UI convention 'q>10')
+            # But here we expect the caller to separate them if possible. 
+            # If the UI sends 'q>10' as 'our_price', we need to handle it or expect UI to split.
+            # Let's assume UI sends specific keys like 'our_qty' if it wants to filter qty.
+            
+            if col in ['our_price', 'our_qty', 'my_sklad_price', 'my_sklad_qty', 'min_sup_price', 'min_sup_qty']:
+                op, num_val = _parse_filter_value(val)
+                where_clauses.append(f"{col} {op} ?")
+                params.append(num_val)
+            elif col == 'min_sup_supplier':
+                 # Search within JSON for supplier with case-insensitive fallback for Cyrillic
+                 v_lower = val.lower()
+                 v_title = val.title()
+                 v_upper = val.upper()
+                 
+                 clause = f"(lower(suppliers_json) LIKE ? OR suppliers_json LIKE ? OR suppliers_json LIKE ?)"
+                 where_clauses.append(clause)
+                 params.append(f"%{v_lower}%")
+                 params.append(f"%{v_title}%")
+                 params.append(f"%{v_upper}%")
+    
+    where_sql = " AND ".join(where_clauses) if where_clauses else "1=1"
+    order_sql = f"{order_col} {order_dir}, sku ASC"
+    return where_sql, params, order_sql
+
 def _get_items(q: str = "", limit: int = 20, page: int = 1, sort_by: str = "created_at", sort_asc: bool = False, filters: Dict = None):
+    where_sql, params, order_sql = _build_search_sql(q, sort_by, sort_asc, filters)
     conn = db.get_connection()
     try:
-        # Whitelist sort columns to prevent SQL injection
-        allowed_sorts = {
-            'created_at': 'created_at',
-            'updated_at': 'updated_at',
-            'sku': 'sku',
-            'name': 'name',
-            'our_price': 'our_price',
-            'our_qty': 'our_qty',
-            'my_sklad_price': 'my_sklad_price',
-            'my_sklad_qty': 'my_sklad_qty',
-            'min_sup_price': 'min_sup_price',
-            'min_sup_qty': 'min_sup_qty',
-            'min_sup_supplier': 'min_sup_supplier'
-        }
-        order_col = allowed_sorts.get(sort_by, 'created_at')
-        order_dir = "ASC" if sort_asc else "DESC"
-        
-        where_clauses = []
-        params = []
-        
-        # 1. Text Search (q)
-        q = (q or "").strip()
-        if q:
-            # We use a simple LIKE approach for now to combine with other filters easily
-            # FTS matches are hard to combine with complex WHEREs without joining
-            # For simplicity and robustness with sorting/filtering:
-            tokens = q.split()
-            for t in tokens:
-                where_clauses.append("(lower(sku) LIKE ? OR lower(name) LIKE ?)")
-                params.append(f"%{t}%")
-                params.append(f"%{t}%")
-
-        # 2. Filters
-        if filters:
-            for col, val in filters.items():
-                if not val: continue
-                val = str(val).strip()
-                
-                # Special handling for quantity logic embedded in price fields (from UI convention 'q>10')
-                # But here we expect the caller to separate them if possible. 
-                # If the UI sends 'q>10' as 'our_price', we need to handle it or expect UI to split.
-                # Let's assume UI sends specific keys like 'our_qty' if it wants to filter qty.
-                
-                if col in ['our_price', 'our_qty', 'my_sklad_price', 'my_sklad_qty', 'min_sup_price', 'min_sup_qty']:
-                    op, num_val = _parse_filter_value(val)
-                    where_clauses.append(f"{col} {op} ?")
-                    params.append(num_val)
-                elif col == 'min_sup_supplier':
-                     # Search within JSON for supplier with case-insensitive fallback for Cyrillic
-                     v_lower = val.lower()
-                     v_title = val.title()
-                     v_upper = val.upper()
-                     
-                     clause = f"(lower(suppliers_json) LIKE ? OR suppliers_json LIKE ? OR suppliers_json LIKE ?)"
-                     where_clauses.append(clause)
-                     params.append(f"%{v_lower}%")
-                     params.append(f"%{v_title}%")
-                     params.append(f"%{v_upper}%")
-        
-        where_sql = " AND ".join(where_clauses) if where_clauses else "1=1"
-        
         # Count total matches first
         count_query = f"SELECT COUNT(*) FROM items_latest WHERE {where_sql}"
-        total_count = conn.execute(count_query, params).fetchone()[0]
+        with metrics.timer("priceweb_db_query_duration_seconds", query="search_count"):
+            total_count = conn.execute(count_query, params).fetchone()[0]
         
         # Pagination
         limit = max(1, min(limit, 500)) # Cap limit
@@ -288,13 +433,14 @@ def _get_items(q: str = "", limit: int = 20, page: int = 1, sort_by: str = "crea
         query = f"""
             SELECT * FROM items_latest
             WHERE {where_sql}
-            ORDER BY {order_col} {order_dir}, sku ASC
+            ORDER BY {order_sql}
             LIMIT ? OFFSET ?
         """
         params.append(limit)
         params.append(offset)
         
-        rows = conn.execute(query, params).fetchall()
+        with metrics.timer("priceweb_db_query_duration_seconds", query="search_page"):
+            rows = conn.execute(query, params).fetchall()
         
         result_items = [_augment_item_with_stats(dict(r)) for r in rows]
         
@@ -331,13 +477,19 @@ def _augment_item_with_stats(item_dict):
 
 @app.route('/api/search')
 @limiter.limit("30 per minute")
+@cached_view
 def api_search():
     try:
         args = SearchSchema(**request.args.to_dict())
     except ValidationError as e:
         return jsonify({"ok": False, "error": "Invalid parameters", "details": e.errors()}), 400
         
-    filters = {
+    filters = _search_filters(args)
+    results = _get_items(args.q.strip(), args.limit, args.page, args.sort_by, args.sort_asc, filters)
+    return jsonify(results)
+
+def _search_filters(args: SearchSchema) -> Dict[str, Optional[str]]:
+    return {
         'our_price': args.our_price,
         'our_qty': args.our_qty,
         'my_sklad_price': args.my_sklad_price,
@@ -345,9 +497,50 @@ def api_search():
         'min_sup_price': args.min_sup_price,
         'min_sup_supplier': args.min_sup_supplier
     }
-    
-    results = _get_items(args.q.strip(), args.limit, args.page, args.sort_by, args.sort_asc, filters)
-    return jsonify(results)
+
+# --- Export ---
+
+SEARCH_EXPORT_COLUMNS = [
+    'sku', 'name', 'our_price', 'our_qty', 'my_sklad_price', 'my_sklad_qty',
+    'min_sup_price', 'min_sup_qty', 'min_sup_supplier', 'updated_at', 'created_at'
+]
+
+def _export_format() -> str:
+    fmt = request.args.get('format', 'csv').lower()
+    return fmt if fmt in ('csv', 'xlsx') else 'csv'
+
+def _export_response(name: str, columns: List[str], rows) -> Response:
+    """Streams rows as CSV/XLSX; nothing but the current chunk is held in memory."""
+    fmt = _export_format()
+    filename = f"{name}_{time.strftime('%Y%m%d_%H%M')}.{fmt}"
+    resp = Response(stream_with_context(export.iter_export(fmt, columns, rows)), mimetype=export.mimetype_for(fmt))
+    resp.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    resp.headers['Cache-Control'] = 'no-store'
+    return resp
+
+@app.route('/api/search/export')
+@limiter.limit("10 per minute")
+def api_search_export():
+    # Export is not paginated: limit/page of the UI are ignored instead of hitting the 500-row cap
+    req_args = {k: v for k, v in request.args.to_dict().items() if k not in ('limit', 'page', 'format')}
+    try:
+        args = SearchSchema(**req_args)
+    except ValidationError as e:
+        return jsonify({"ok": False, "error": "Invalid parameters", "details": e.errors()}), 400
+
+    where_sql, params, order_sql = _build_search_sql(args.q.strip(), args.sort_by, args.sort_asc, _search_filters(args))
+    query = f"SELECT {', '.join(SEARCH_EXPORT_COLUMNS)} FROM items_latest WHERE {where_sql} ORDER BY {order_sql}"
+
+    def rows():
+        conn = db.get_connection()
+        try:
+            # Iterate the cursor directly: rows are fetched from SQLite as the client reads
+            for r in conn.execute(query, params):
+                yield tuple(r)
+        finally:
+            conn.close()
+
+    return _export_response('search', SEARCH_EXPORT_COLUMNS, rows())
 
 @app.route('/')
 @login_required
@@ -382,6 +575,7 @@ def index():
 
 @app.route('/ui/history')
 @login_required
+@cached_view(windowed=True)
 def ui_history():
     try:
         args = HistorySchema(**request.args.to_dict())
@@ -393,27 +587,28 @@ def ui_history():
         
     conn = db.get_connection()
     try:
-        cutoff = int(time.time()) - days * 86400
+        cutoff = reports.window_start() - days * 86400
         # Aggregation logic similar to priceweb: min price per day
-        rows = conn.execute("""
-            SELECT 
-                day_date,
-                our_price,
-                min_sup_price,
-                min_sup_supplier
-            FROM (
+        with metrics.timer("priceweb_db_query_duration_seconds", query="history"):
+            rows = conn.execute("""
                 SELECT 
-                    date(ts, 'unixepoch', 'localtime') as day_date,
+                    day_date,
                     our_price,
                     min_sup_price,
-                    min_sup_supplier,
-                    ROW_NUMBER() OVER(PARTITION BY date(ts, 'unixepoch', 'localtime') ORDER BY min_sup_price ASC, ts DESC) as rn
-                FROM item_snapshots
-                WHERE sku = ? AND ts >= ?
-            )
-            WHERE rn = 1
-            ORDER BY day_date ASC
-        """, (sku, cutoff)).fetchall()
+                    min_sup_supplier
+                FROM (
+                    SELECT 
+                        date(ts, 'unixepoch', 'localtime') as day_date,
+                        our_price,
+                        min_sup_price,
+                        min_sup_supplier,
+                        ROW_NUMBER() OVER(PARTITION BY date(ts, 'unixepoch', 'localtime') ORDER BY min_sup_price ASC, ts DESC) as rn
+                    FROM item_snapshots
+                    WHERE sku = ? AND ts >= ?
+                )
+                WHERE rn = 1
+                ORDER BY day_date ASC
+            """, (sku, cutoff)).fetchall()
         
         data = [dict(r) for r in rows]
         return render_template('partials/history.html', sku=sku, items=data, days=days)
@@ -431,7 +626,11 @@ def health_check():
         return {
             "status": "ok", 
             "db": "ok", 
-            "version": APP_VERSION
+            "version": APP_VERSION,
+            "cache": {
+                "responses": response_cache.stats(),
+                "reports": reports.cache_stats()
+            }
         }, 200
     except Exception as e:
         return {
@@ -440,10 +639,55 @@ def health_check():
             "version": APP_VERSION
         }, 500
 
+# --- Metrics (Prometheus text format) ---
+WORKER_RUN_GAUGES = (
+    ("duration", "priceweb_worker_last_run_duration_seconds", "Wall time of the last worker run"),
+    ("cpu", "priceweb_worker_last_run_cpu_seconds", "CPU time of the last worker run"),
+    ("rss_mb", "priceweb_worker_last_run_rss_mb", "RSS at the end of the last worker run (MB)"),
+    ("total", "priceweb_worker_last_run_items", "Items processed by the last worker run"),
+    ("inserted", "priceweb_worker_last_run_inserted", "Items inserted by the last worker run"),
+    ("changed", "priceweb_worker_last_run_changed", "Items changed by the last worker run"),
+    ("snapshots_added", "priceweb_worker_last_run_snapshots", "Snapshots added by the last worker run"),
+)
+
+def _worker_gauges():
+    """Worker stats come from worker_runs, so they are shared by all gunicorn workers as-is."""
+    conn = db.get_connection()
+    try:
+        runs = db.get_worker_runs(conn, 1)
+    finally:
+        conn.close()
+    if not runs:
+        return []
+    run = runs[0]
+    out = [
+        ("priceweb_worker_last_run_timestamp_seconds", "Finish time of the last worker run", {}, run.get("finished_at") or 0),
+        ("priceweb_worker_last_run_success", "1 if the last worker run did not fail", {}, 0 if run.get("status") == "failed" else 1),
+    ]
+    for field, name, help_text in WORKER_RUN_GAUGES:
+        out.append((name, help_text, {}, run.get(field) or 0))
+    for stage, st in run.get("stages", {}).items():
+        out.append(("priceweb_worker_stage_seconds", "Wall time per stage of the last worker run", {"stage": stage}, st.get("wall", 0)))
+    return out
+
+@app.route('/metrics')
+@limiter.exempt
+def metrics_endpoint():
+    # Optional bearer token; without METRICS_TOKEN the endpoint is open like /health
+    secret = os.environ.get("METRICS_TOKEN")
+    if secret and request.headers.get('Authorization') != f"Bearer {secret}":
+        return "Forbidden", 403
+    try:
+        gauges = _worker_gauges()
+    except sqlite3.Error:
+        gauges = []
+    return Response(metrics.render(gauges), mimetype="text/plain; version=0.0.4")
+
 # --- Reports ---
 
 @app.route('/reports/spread')
 @login_required
+@cached_view
 def report_spread():
     try:
         req_args = request.args.to_dict()
@@ -464,74 +708,9 @@ def report_spread():
     
     conn = db.get_connection()
     try:
-        # Get all distinct supplier names for the filter UI
-        all_sups_rows = conn.execute("SELECT suppliers_json FROM items_latest").fetchall()
-        suppliers_all = set()
-        for r in all_sups_rows:
-            try:
-                sups = json.loads(r['suppliers_json'])
-                for s in sups:
-                    name = s.get('supplier', '').strip()
-                    if name and name.lower() != 'мой склад':
-                        suppliers_all.add(name)
-            except (json.JSONDecodeError, TypeError): continue
-        
-        query = f"SELECT sku, name, our_price, suppliers_json FROM items_latest WHERE min_sup_price > 0"
-        rows = conn.execute(query).fetchall()
-        
-        results = []
-        for r in rows:
-            try:
-                sups = json.loads(r['suppliers_json'])
-            except (json.JSONDecodeError, TypeError): continue
-                
-            valid_sups = []
-            for s in sups:
-                name = s.get('supplier', '').strip()
-                if name.lower() == 'мой склад' or name.lower() in exclude_set:
-                    continue
-                    
-                p = float(s.get('price', 0))
-                q = float(s.get('qty', 0))
-                if p <= 0: continue
-                if in_stock_only and q <= 0: continue
-                # Issue 5: Filter garbage prices early in calculation
-                if p > max_price: continue
-                
-                valid_sups.append(s)
-            
-            if len(valid_sups) < 2:
-                continue
-                
-            prices = [float(s['price']) for s in valid_sups]
-            min_p = min(prices)
-            max_p = max(prices)
-            
-            # Re-check max_price on the final spread max to be sure
-            if max_p > max_price:
-                 continue
-            
-            spread = (max_p - min_p) * 100.0 / min_p
-            if spread < threshold:
-                continue
-            
-            min_s_names = [s['supplier'] for s in valid_sups if float(s['price']) == min_p]
-            max_s_names = [s['supplier'] for s in valid_sups if float(s['price']) == max_p]
-            
-            results.append({
-                'sku': r['sku'],
-                'name': r['name'],
-                'our_price': r['our_price'],
-                'min_price': min_p,
-                'min_suppliers': ", ".join(min_s_names),
-                'max_price': max_p,
-                'max_suppliers': ", ".join(max_s_names),
-                'spread_pct': round(spread, 2),
-                'suppliers_cnt': len(valid_sups),
-                'suppliers_json': r['suppliers_json']
-            })
-            
-        results.sort(key=lambda x: x['spread_pct'], reverse=True)
+        version = db.get_data_version(conn)
+        suppliers_all = reports.get_suppliers(conn, version)
+        results = reports.get_spread(conn, version, threshold, max_price, in_stock_only, exclude_set)
         
         total_count = len(results)
         total_pages = (total_count + per_page - 1) // per_page if per_page > 0 else 1
@@ -549,7 +728,7 @@ def report_spread():
                                total_count=total_count,
                                max_price=max_price,
                                in_stock_only=in_stock_only,
-                               suppliers_all=sorted(list(suppliers_all)),
+                               suppliers_all=suppliers_all,
                                exclude_set=exclude_set,
                                exclude_list=exclude_list)
     finally:
@@ -557,6 +736,7 @@ def report_spread():
 
 @app.route('/reports/markup')
 @login_required
+@cached_view
 def report_markup():
     try:
         req_args = request.args.to_dict()
@@ -577,83 +757,17 @@ def report_markup():
     
     conn = db.get_connection()
     try:
-        # Get all distinct supplier names
-        all_sups_rows = conn.execute("SELECT suppliers_json FROM items_latest").fetchall()
-        suppliers_all = set()
-        for r in all_sups_rows:
-            try:
-                sups = json.loads(r['suppliers_json'])
-                for s in sups:
-                    name = s.get('supplier', '').strip()
-                    if name and name.lower() != 'мой склад':
-                        suppliers_all.add(name)
-            except (json.JSONDecodeError, TypeError): continue
-
-        query = "SELECT * FROM items_latest WHERE our_price > 0"
-        rows = conn.execute(query).fetchall()
-        
-        results = []
-        for r in rows:
-            our = r['our_price']
-            our_qty = r['our_qty']
-            
-            try:
-                sups = json.loads(r['suppliers_json'])
-            except (json.JSONDecodeError, TypeError): continue
-                
-            filtered_prices = []
-            filtered_sups = []
-            for s in sups:
-                name = s.get('supplier', '').strip()
-                if name.lower() == 'мой склад' or name.lower() in exclude_set:
-                    continue
-                
-                p = float(s.get('price', 0))
-                q = float(s.get('qty', 0))
-                
-                if p <= 0 or p > max_price: continue
-                if in_stock_only and q <= 0: continue
-                if qty_equal and q != our_qty: continue
-                
-                filtered_prices.append(p)
-                filtered_sups.append(name)
-                
-            if not filtered_prices: continue
-            
-            min_sup = min(filtered_prices)
-            min_s_names = [filtered_sups[i] for i, p in enumerate(filtered_prices) if p == min_sup]
-            
-            our_with_markup = our * (1.0 + markup_pct / 100.0)
-            
-            if our_with_markup < min_sup:
-                delta_abs = min_sup - our_with_markup
-                delta_pct = (min_sup / our_with_markup - 1.0) * 100.0 if our_with_markup > 0 else 0
-                
-                results.append({
-                    'sku': r['sku'],
-                    'name': r['name'],
-                    'our_price': our,
-                    'our_qty': our_qty,
-                    'min_sup_price': min_sup,
-                    'min_suppliers': ", ".join(min_s_names),
-                    'our_price_with_markup': round(our_with_markup, 2),
-                    'delta_abs': round(delta_abs, 2),
-                    'delta_pct': round(delta_pct, 2),
-                    'suppliers_json': r['suppliers_json']
-                })
-            
-        results.sort(key=lambda x: x['delta_abs'], reverse=True)
+        version = db.get_data_version(conn)
+        suppliers_all = reports.get_suppliers(conn, version)
+        results = reports.get_markup(conn, version, markup_pct, max_price, in_stock_only, qty_equal, exclude_set)
         
         total_count = len(results)
         total_pages = (total_count + per_page - 1) // per_page if per_page > 0 else 1
         page = max(1, min(page, total_pages))
         
         start = (page - 1) * per_page
-        items_slice = results[start:start+per_page]
-        
-        # Augment ONLY the visible slice with stats
-        for item in items_slice:
-            _augment_item_with_stats(item)
+        # Augment ONLY the visible slice with stats; rows are copied, `results` is the shared cache entry
+        items_slice = [_augment_item_with_stats(dict(item)) for item in results[start:start+per_page]]
         
         return render_template('report_markup.html',
                                items=items_slice,
@@ -665,7 +779,7 @@ def report_markup():
                                max_price=max_price,
                                in_stock_only=in_stock_only,
                                qty_equal=qty_equal,
-                               suppliers_all=sorted(list(suppliers_all)),
+                               suppliers_all=suppliers_all,
                                exclude_set=exclude_set,
                                exclude_list=exclude_list)
     finally:
@@ -673,6 +787,7 @@ def report_markup():
 
 @app.route('/reports/changes')
 @login_required
+@cached_view(windowed=True)
 def report_changes():
     try:
         args = ChangesReportSchema(**request.args.to_dict())
@@ -685,98 +800,8 @@ def report_changes():
     
     conn = db.get_connection()
     try:
-        cutoff = int(time.time()) - days * 86400
-        
-        # Optimize: Fetch only necessary snapshot data first without joining heavy items_latest
-        query = """
-            SELECT sku, ts, min_sup_price, our_price, min_sup_supplier
-            FROM item_snapshots
-            WHERE ts >= ?
-            ORDER BY sku, ts ASC
-        """
-        rows = conn.execute(query, (cutoff,)).fetchall()
-        
-        changes = []
-        affected_skus = set()
-        
-        # Group by SKU
-        from itertools import groupby
-        from operator import itemgetter
-        
-        for sku, group in groupby(rows, key=itemgetter('sku')):
-            snaps = list(group)
-            if len(snaps) < 2:
-                continue
-            
-            # Iterate through snapshots to find changes
-            for i in range(1, len(snaps)):
-                prev = snaps[i-1]
-                curr = snaps[i]
-                
-                # Check min_sup_price
-                if type_filter in ['all', 'min_price']:
-                    p_prev = prev['min_sup_price'] or 0
-                    p_curr = curr['min_sup_price'] or 0
-                    
-                    if p_prev > 0 and p_curr > 0:
-                        diff_pct = (p_curr - p_prev) / p_prev * 100.0
-                        if abs(diff_pct) >= threshold:
-                            changes.append({
-                                'sku': sku,
-                                'ts': curr['ts'],
-                                'date': datetime.fromtimestamp(curr['ts']).strftime('%Y-%m-%d %H:%M'),
-                                'old_price': p_prev,
-                                'new_price': p_curr,
-                                'old_supplier': prev['min_sup_supplier'],
-                                'new_supplier': curr['min_sup_supplier'],
-                                'diff_pct': round(diff_pct, 1),
-                                'type': 'min_price', # Market Price
-                            })
-                            affected_skus.add(sku)
-
-                # Check our_price
-                if type_filter in ['all', 'our_price']:
-                    p_prev_our = prev['our_price'] or 0
-                    p_curr_our = curr['our_price'] or 0
-                    
-                    if p_prev_our > 0 and p_curr_our > 0:
-                        diff_pct = (p_curr_our - p_prev_our) / p_prev_our * 100.0
-                        if abs(diff_pct) >= threshold:
-                            changes.append({
-                                'sku': sku,
-                                'ts': curr['ts'],
-                                'date': datetime.fromtimestamp(curr['ts']).strftime('%Y-%m-%d %H:%M'),
-                                'old_price': p_prev_our,
-                                'new_price': p_curr_our,
-                                'old_supplier': "Наш магазин",
-                                'new_supplier': "Наш магазин",
-                                'diff_pct': round(diff_pct, 1),
-                                'type': 'our_price', # Our Price
-                            })
-                            affected_skus.add(sku)
-        
-        # Batch fetch details for affected SKUs
-        if affected_skus:
-            placeholders = ','.join(['?'] * len(affected_skus))
-            details_query = f"SELECT sku, name, suppliers_json, our_price FROM items_latest WHERE sku IN ({placeholders})"
-            details_rows = conn.execute(details_query, list(affected_skus)).fetchall()
-            details_map = {r['sku']: r for r in details_rows}
-            
-            # Enrich changes with details
-            valid_changes = []
-            for c in changes:
-                if c['sku'] in details_map:
-                    item = details_map[c['sku']]
-                    c['name'] = item['name']
-                    c['suppliers_json'] = item['suppliers_json']
-                    c['current_our_price'] = item['our_price']
-                    valid_changes.append(c)
-            changes = valid_changes
-        else:
-            changes = []
-
-        # Sort by latest change first, then largest change
-        changes.sort(key=lambda x: (x['ts'], abs(x['diff_pct'])), reverse=True)
+        version = db.get_data_version(conn)
+        changes = reports.get_changes(conn, version, days, threshold, type_filter)
         
         return render_template('report_changes.html',
                                items=changes,
@@ -786,6 +811,173 @@ def report_changes():
     finally:
         conn.close()
 
+BULK_COLUMNS = [
+    'sku', 'name', 'our_price', 'our_qty', 'my_sklad_price', 'my_sklad_qty',
+    'min_sup_price', 'min_sup_qty', 'min_sup_supplier', 'updated_at', 'created_at', 'suppliers_json'
+]
+
+@app.route('/api/bulk')
+@limiter.limit("6 per minute")
+def api_bulk():
+    """Whole items_latest (or rows with updated_at > since) as one NDJSON stream, gzip by default.
+
+    Clients keep max(updated_at) from the stream (or the X-Last-Reload-Ts header) and pass it
+    as `since` next time. Deleted items are not reported here.
+    """
+    try:
+        args = BulkSchema(**request.args.to_dict())
+    except ValidationError as e:
+        return jsonify({"ok": False, "error": "Invalid parameters", "details": e.errors()}), 400
+
+    if args.since:
+        query = f"SELECT {', '.join(BULK_COLUMNS)} FROM items_latest WHERE updated_at > ? ORDER BY updated_at, sku"
+        params = (args.since,)
+    else:
+        query = f"SELECT {', '.join(BULK_COLUMNS)} FROM items_latest"
+        params = ()
+
+    # Headers and rows are read in one transaction on one connection: a worker commit during
+    # the stream cannot pair old X-Data-Version/X-Last-Reload-Ts with newer rows
+    conn = db.get_connection()
+    try:
+        conn.execute("BEGIN")
+        version = db.get_data_version(conn)
+        last_reload_ts = db.get_meta_value(conn, 'last_reload_ts') or "0"
+        rows = conn.execute(query, params)
+    except Exception:
+        conn.close()
+        raise
+
+    def lines():
+        for r in rows:
+            yield export.ndjson_item_line(dict(r))
+
+    use_gzip = args.gzip and request.accept_encodings["gzip"] > 0
+    body = export.iter_ndjson(lines())
+    if use_gzip:
+        body = export.iter_gzip(body)
+
+    resp = Response(stream_with_context(body), mimetype=export.NDJSON_MIMETYPE)
+    # Runs whether or not the body was consumed, ending the read transaction
+    resp.call_on_close(conn.close)
+    if use_gzip:
+        resp.headers['Content-Encoding'] = 'gzip'
+    resp.headers['Vary'] = 'Accept-Encoding'
+    resp.headers['X-Data-Version'] = version
+    resp.headers['X-Last-Reload-Ts'] = last_reload_ts
+    resp.headers['Cache-Control'] = 'no-store'
+    return resp
+
+@app.route('/api/changes')
+@limiter.limit("30 per minute")
+def api_changes():
+    """Delta feed: items inserted/updated and SKUs deleted after change sequence `since`.
+
+    Pass `next_since` from the response as `since` of the next call until `has_more` is false.
+    """
+    try:
+        args = DeltaSchema(**request.args.to_dict())
+    except ValidationError as e:
+        return jsonify({"ok": False, "error": "Invalid parameters", "details": e.errors()}), 400
+
+    conn = db.get_connection()
+    try:
+        current_seq = db.get_change_seq(conn)
+        rows = conn.execute(f"""
+            SELECT {', '.join(BULK_COLUMNS)}, change_seq FROM items_latest
+            WHERE change_seq > ?
+            ORDER BY change_seq
+            LIMIT ?
+        """, (args.since, args.limit)).fetchall()
+
+        has_more = len(rows) == args.limit
+        # Tombstones are returned for the same sequence window as the items
+        upper = rows[-1]['change_seq'] if has_more else current_seq
+        deleted = conn.execute("""
+            SELECT sku, change_seq, deleted_at FROM item_tombstones
+            WHERE change_seq > ? AND change_seq <= ?
+            ORDER BY change_seq
+        """, (args.since, upper)).fetchall()
+
+        items = []
+        for r in rows:
+            item = dict(r)
+            try:
+                item['suppliers'] = json.loads(item.pop('suppliers_json') or '[]')
+            except (json.JSONDecodeError, TypeError):
+                item['suppliers'] = []
+            items.append(item)
+
+        return jsonify({
+            "ok": True,
+            "since": args.since,
+            "next_since": max(upper, args.since),
+            "current_seq": current_seq,
+            "has_more": has_more,
+            "items": items,
+            "deleted": [dict(d) for d in deleted]
+        })
+    finally:
+        conn.close()
+
+SPREAD_EXPORT_COLUMNS = ['sku', 'name', 'our_price', 'min_price', 'min_suppliers', 'max_price', 'max_suppliers',
+                         'spread_pct', 'suppliers_cnt']
+MARKUP_EXPORT_COLUMNS = ['sku', 'name', 'our_price', 'our_qty', 'min_sup_price', 'min_suppliers',
+                         'our_price_with_markup', 'delta_abs', 'delta_pct']
+CHANGES_EXPORT_COLUMNS = ['date', 'sku', 'name', 'type', 'old_price', 'new_price', 'diff_pct',
+                          'old_supplier', 'new_supplier', 'current_our_price']
+
+def _report_args(schema):
+    req_args = {k: v for k, v in request.args.to_dict().items() if k != 'format'}
+    if 'exclude' in request.args:
+        req_args['exclude'] = request.args.getlist('exclude')
+    try:
+        return schema(**req_args)
+    except ValidationError:
+        return schema()
+
+def _iter_report_rows(items, columns):
+    for item in items:
+        yield tuple(item.get(c) for c in columns)
+
+@app.route('/reports/spread/export')
+@login_required
+def report_spread_export():
+    args = _report_args(SpreadReportSchema)
+    conn = db.get_connection()
+    try:
+        # Same memoized (sorted) list the report page uses; export covers all pages
+        version = db.get_data_version(conn)
+        items = reports.get_spread(conn, version, args.threshold, args.max_price, args.in_stock_only, args.exclude)
+    finally:
+        conn.close()
+    return _export_response('spread', SPREAD_EXPORT_COLUMNS, _iter_report_rows(items, SPREAD_EXPORT_COLUMNS))
+
+@app.route('/reports/markup/export')
+@login_required
+def report_markup_export():
+    args = _report_args(MarkupReportSchema)
+    conn = db.get_connection()
+    try:
+        version = db.get_data_version(conn)
+        items = reports.get_markup(conn, version, args.markup_pct, args.max_price, args.in_stock_only,
+                                   args.qty_equal, args.exclude)
+    finally:
+        conn.close()
+    return _export_response('markup', MARKUP_EXPORT_COLUMNS, _iter_report_rows(items, MARKUP_EXPORT_COLUMNS))
+
+@app.route('/reports/changes/export')
+@login_required
+def report_changes_export():
+    args = _report_args(ChangesReportSchema)
+    conn = db.get_connection()
+    try:
+        version = db.get_data_version(conn)
+        items = reports.get_changes(conn, version, args.days, args.threshold, args.type)
+    finally:
+        conn.close()
+    return _export_response('changes', CHANGES_EXPORT_COLUMNS, _iter_report_rows(items, CHANGES_EXPORT_COLUMNS))
+
 @app.route('/api/reload')
 def api_reload():
     auth_header = request.headers.get('Authorization')
@@ -802,43 +994,84 @@ def api_reload():
         if not expected_token:
             return jsonify({"ok": False, "error": "RELOAD_TOKEN not set in /etc/priceweb_new.env"}), 403
         return jsonify({"ok": False, "error": f"Unauthorized (received len {token_len}, expected len {len(expected_token)})"}), 403
-    
-    def run_worker():
-        log_path = config.get_log_path()
-        def _log_api(msg):
-            with open(log_path, "a", encoding="utf-8") as f:
-                f.write(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [API_REL] {msg}\n")
-
-        try:
-            _log_api("Starting background worker subprocess...")
-            import sys
-            import subprocess
-            
-            # Explicitly pass environment and set CWD
-            cwd = os.path.dirname(os.path.abspath(__file__))
-            res = subprocess.run(
-                [sys.executable, "worker.py"], 
-                capture_output=True, 
-                text=True, 
-                env=os.environ.copy(),
-                cwd=cwd
-            )
-            if res.returncode == 0:
-                _log_api("Background worker finished successfully.")
-            else:
-                _log_api(f"Background worker FAILED with code {res.returncode}.")
-                if res.stderr:
-                    _log_api(f"Worker Stderr: {res.stderr}")
-        except Exception as e:
-            _log_api(f"Unexpected error in background worker thread: {e}")
 
     try:
-        thread = threading.Thread(target=run_worker)
-        thread.daemon = True
-        thread.start()
-        return jsonify({"ok": True, "message": "Воркер запущен в фоновом режиме. Следите за логами."})
+        job_id, queued = _enqueue_reload("api/reload")
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)})
+    if queued:
+        message = f"Воркер уже работает. Запуск #{job_id} поставлен в очередь и начнётся после завершения."
+    else:
+        message = f"Воркер запущен (задача #{job_id}). Следите за логами."
+    return jsonify({"ok": True, "job_id": job_id, "queued": queued, "message": message})
+
+@app.route('/api/worker/runs')
+@login_required
+def api_worker_runs():
+    """History of worker runs with per-stage wall/CPU/RSS timings."""
+    try:
+        limit = max(1, min(int(request.args.get('limit', 20)), 500))
+    except ValueError:
+        limit = 20
+    conn = db.get_connection()
+    try:
+        return jsonify({"ok": True, "runs": db.get_worker_runs(conn, limit)})
+    finally:
+        conn.close()
+
+@app.route('/api/worker/status')
+@login_required
+def api_worker_status():
+    """Whether the worker lock is held, a follow-up run is queued, the last heartbeat and the feed cadence."""
+    conn = db.get_connection()
+    try:
+        return jsonify(dict(workerlock.status(conn), feed=feedpoll.describe(conn), ok=True))
+    finally:
+        conn.close()
+
+@app.route('/api/jobs')
+@login_required
+def api_jobs():
+    """Recent worker jobs (queued/running/done/failed), newest first."""
+    try:
+        limit = max(1, min(int(request.args.get('limit', 20)), 200))
+    except ValueError:
+        limit = 20
+    conn = db.get_connection()
+    try:
+        return jsonify({"ok": True, "jobs": jobs.recent(conn, limit)})
+    finally:
+        conn.close()
+
+@app.route('/api/jobs/<int:job_id>')
+@login_required
+def api_job(job_id: int):
+    """One job; a running job carries the live worker progress."""
+    conn = db.get_connection()
+    try:
+        job = jobs.get(conn, job_id)
+    finally:
+        conn.close()
+    if job is None:
+        return jsonify({"ok": False, "error": "Job not found"}), 404
+    if job["status"] == jobs.RUNNING:
+        job["progress"] = progress.read_status()
+    return jsonify({"ok": True, "job": job})
+
+@app.route('/api/admin/slow-queries')
+@login_required
+def api_slow_queries():
+    """Top-N slowest normalized SQL statements (PRICE_DB_PROFILE=1), all processes merged."""
+    try:
+        limit = max(1, min(int(request.args.get('limit', sqlprofile.TOP_N)), 200))
+    except ValueError:
+        limit = sqlprofile.TOP_N
+    return jsonify({
+        "ok": True,
+        "enabled": sqlprofile.ENABLED,
+        "slow_ms": sqlprofile.SLOW_MS,
+        "queries": sqlprofile.top_statements(limit),
+    })
 
 @app.route('/api/debug_env')
 @login_required # Security: only for logged in users
@@ -856,6 +1089,72 @@ def api_debug_env():
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)})
 
+# --- Live Events (SSE) ---
+# gunicorn runs gthread workers (priceweb-web.service), so an open stream holds a thread, not
+# a worker process. Streams per process are capped below the thread count to leave threads
+# for normal requests; a stream ends after SSE_MAX_SECONDS and the browser's EventSource
+# reconnects on its own (see `retry:`).
+SSE_MAX_SECONDS = int(os.environ.get("SSE_MAX_SECONDS", "55"))
+SSE_MAX_STREAMS = int(os.environ.get("SSE_MAX_STREAMS", "6"))
+_sse_slots = threading.BoundedSemaphore(SSE_MAX_STREAMS)
+
+def _sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.route('/api/events')
+@login_required
+@limiter.exempt
+def api_events():
+    """Streams worker progress (`progress`) and data version changes (`version`).
+
+    Both are watched by file stat once a second: the status file's mtime, and the database and
+    WAL files for commits. The DB is only opened when those changed, to read the version.
+    """
+    if not _sse_slots.acquire(blocking=False):
+        # All stream slots of this process are taken: ask the browser to come back later
+        resp = Response("retry: 30000\n\n", mimetype="text/event-stream")
+        resp.headers["Cache-Control"] = "no-cache"
+        return resp
+    status_path = config.get_status_path()
+
+    def stream():
+        yield "retry: 3000\n\n"
+        last_mtime = None
+        last_stamp = None
+        last_version = None
+        last_ping = time.time()
+        deadline = time.time() + SSE_MAX_SECONDS
+        while time.time() < deadline:
+            try:
+                mtime = os.path.getmtime(status_path)
+            except OSError:
+                mtime = None
+            if mtime != last_mtime:
+                last_mtime = mtime
+                st = progress.read_status(status_path)
+                if st:
+                    yield _sse("progress", st)
+
+            stamp = db.data_files_stamp()
+            if stamp != last_stamp:
+                last_stamp = stamp
+                version, _ = _get_data_version()
+                if version != last_version:
+                    last_version = version
+                    yield _sse("version", {"version": version})
+
+            if time.time() - last_ping > 15:
+                last_ping = time.time()
+                yield ": ping\n\n"
+            time.sleep(1)
+
+    resp = Response(stream_with_context(stream()), mimetype="text/event-stream")
+    # Runs when the stream ends or the client goes away, even before the first chunk
+    resp.call_on_close(_sse_slots.release)
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
+
 @app.route('/api/logs')
 @login_required
 def api_logs():
@@ -866,11 +1165,7 @@ def api_logs():
             return jsonify({"ok": True, "logs": "Лог-файл пока не создан. Нажмите 'Reload Data', чтобы запустить воркер и создать логи."})
 
         
-        with open(log_path, 'r') as f:
-            # Get last 100 lines
-            lines = f.readlines()
-            last_lines = lines[-100:]
-            return jsonify({"ok": True, "logs": "".join(last_lines)})
+        return jsonify({"ok": True, "logs": logutil.tail_text(log_path, 100)})
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)})
 
@@ -31,3 +31,21 @@ def get_log_path():
         db_dir = os.path.dirname(db_path) or "."
         path = os.path.join(db_dir, "cron_log.log")
     return path
+
+def get_status_path():
+    """Small JSON file with live worker progress (read by the web app, see /api/jobs/<id>)."""
+    path = os.environ.get("PRICE_STATUS_PATH")
+    if not path:
+        db_path = os.environ.get("PRICE_DB_PATH", "data/priceweb.db")
+        db_dir = os.path.dirname(db_path) or "."
+        path = os.path.join(db_dir, "worker_status.json")
+    return path
+
+def get_metrics_dir():
+    """Directory where every web/worker process dumps its metrics (merged by /metrics)."""
+    path = os.environ.get("PRICE_METRICS_DIR")
+    if not path:
+        db_path = os.environ.get("PRICE_DB_PATH", "data/priceweb.db")
+        db_dir = os.path.dirname(db_path) or "."
+        path = os.path.join(db_dir, "metrics")
+    return path
@@ -1,6 +1,7 @@
 import os
 import config
 import sqlite3
+import sqlprofile
 import time
 import json
 from typing import Dict, Any, List, Optional, Tuple
@@ -13,7 +14,11 @@ def get_connection(timeout: int = 30) -> sqlite3.Connection:
     if db_dir and not os.path.exists(db_dir):
         os.makedirs(db_dir, exist_ok=True)
         
-    conn = sqlite3.connect(DB_PATH, timeout=timeout)
+    if sqlprofile.ENABLED:
+        # Opt-in statement timing (PRICE_DB_PROFILE=1), see sqlprofile.py
+        conn = sqlite3.connect(DB_PATH, timeout=timeout, factory=sqlprofile.ProfiledConnection)
+    else:
+        conn = sqlite3.connect(DB_PATH, timeout=timeout)
     conn.row_factory = sqlite3.Row
     
     # Apply performance pragmas to every connection
@@ -25,12 +30,91 @@ def get_connection(timeout: int = 30) -> sqlite3.Connection:
         
     return conn
 
+FTS_VERSION = "2"
+FTS_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS items_latest_ai AFTER INSERT ON items_latest BEGIN
+        INSERT INTO items_search(rowid, sku, name) VALUES (new.rowid, new.sku, COALESCE(new.name, ''));
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS items_latest_ad AFTER DELETE ON items_latest BEGIN
+        DELETE FROM items_search WHERE rowid = old.rowid;
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS items_latest_au AFTER UPDATE OF name ON items_latest
+    WHEN old.name IS NOT new.name BEGIN
+        DELETE FROM items_search WHERE rowid = old.rowid;
+        INSERT INTO items_search(rowid, sku, name) VALUES (new.rowid, new.sku, COALESCE(new.name, ''));
+    END;
+    """,
+)
+
+# Secondary indexes of the bulk-loaded tables (the PRIMARY KEY indexes always stay)
+SECONDARY_INDEXES = {
+    "idx_items_name": "items_latest(name)",
+    "idx_items_created_at": "items_latest(created_at)",
+    "idx_items_updated_at": "items_latest(updated_at)",
+    "idx_items_change_seq": "items_latest(change_seq)",
+    "idx_snap_sku_ts": "item_snapshots(sku, ts)",
+    "idx_snap_ts": "item_snapshots(ts)",
+    "idx_supplier_prices_currency": "item_supplier_prices(currency)",
+    "idx_price_alerts_ts": "price_alerts(ts)",
+}
+
+def create_secondary_indexes(conn: sqlite3.Connection) -> None:
+    for name, target in SECONDARY_INDEXES.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target};")
+
+def drop_secondary_indexes(conn: sqlite3.Connection) -> None:
+    for name in SECONDARY_INDEXES:
+        conn.execute(f"DROP INDEX IF EXISTS {name};")
+
+def create_search_triggers(conn: sqlite3.Connection) -> None:
+    for ddl in FTS_TRIGGERS:
+        conn.execute(ddl)
+
+def drop_search_triggers(conn: sqlite3.Connection) -> None:
+    for trigger in ('items_latest_ai', 'items_latest_ad', 'items_latest_au'):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+
+def rebuild_search_index(conn: sqlite3.Connection) -> int:
+    """Offline bulk rebuild of items_search from items_latest (one sorted insert + optimize).
+
+    Also the fix when search_index_in_sync() fails after VACUUM: items_latest has no
+    INTEGER PRIMARY KEY, so VACUUM is allowed to renumber the rowids the index is keyed by.
+    """
+    conn.execute("DELETE FROM items_search")
+    conn.execute("""
+        INSERT INTO items_search(rowid, sku, name)
+        SELECT rowid, sku, COALESCE(name, '') FROM items_latest ORDER BY rowid
+    """)
+    conn.execute("INSERT INTO items_search(items_search) VALUES ('optimize')")
+    return conn.execute("SELECT COUNT(*) FROM items_search").fetchone()[0]
+
+def search_index_in_sync(conn: sqlite3.Connection) -> bool:
+    """True if every items_latest row has its items_search row under the same rowid."""
+    total = conn.execute("SELECT COUNT(*) FROM items_latest").fetchone()[0]
+    matched = conn.execute("""
+        SELECT COUNT(*) FROM items_latest i JOIN items_search s ON s.rowid = i.rowid AND s.sku = i.sku
+    """).fetchone()[0]
+    indexed = conn.execute("SELECT COUNT(*) FROM items_search").fetchone()[0]
+    return total == matched == indexed
+
 def ensure_schema() -> None:
     conn = get_connection()
     try:
         conn.execute("PRAGMA journal_mode=WAL;")
         conn.execute("PRAGMA synchronous=NORMAL;")
         
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS meta (
+                k TEXT PRIMARY KEY,
+                v TEXT
+            );
+        """)
+
         # items_latest: Current state of items
         conn.execute("""
             CREATE TABLE IF NOT EXISTS items_latest (
@@ -51,8 +135,6 @@ def ensure_schema() -> None:
                 created_at INTEGER
             )
         """)
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_items_name ON items_latest(name);")
-
         # Migration: Add created_at if missing
         try:
             conn.execute("ALTER TABLE items_latest ADD COLUMN created_at INTEGER;")
@@ -61,8 +143,29 @@ def ensure_schema() -> None:
         except sqlite3.OperationalError:
             # Column already exists
             pass
-        
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_items_created_at ON items_latest(created_at);")
+
+        # Migration: monotonically increasing change sequence for the delta feed
+        try:
+            conn.execute("ALTER TABLE items_latest ADD COLUMN change_seq INTEGER;")
+            # Existing rows get distinct initial sequence numbers
+            conn.execute("UPDATE items_latest SET change_seq = rowid WHERE change_seq IS NULL;")
+            conn.execute("""
+                INSERT INTO meta(k, v) SELECT 'change_seq', COALESCE(MAX(change_seq), 0) FROM items_latest
+                ON CONFLICT(k) DO UPDATE SET v=excluded.v
+            """)
+        except sqlite3.OperationalError:
+            # Column already exists
+            pass
+
+        # item_tombstones: deleted SKUs, so delta consumers can drop them too
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS item_tombstones (
+                sku TEXT PRIMARY KEY,
+                change_seq INTEGER NOT NULL,
+                deleted_at INTEGER
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tombstones_seq ON item_tombstones(change_seq);")
         
         # item_snapshots: Daily history
         conn.execute("""
@@ -82,8 +185,34 @@ def ensure_schema() -> None:
                 min_sup_supplier TEXT
             )
         """)
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_snap_sku_ts ON item_snapshots(sku, ts);")
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_snap_ts ON item_snapshots(ts);")
+        # item_supplier_prices: each supplier offer in its original currency (queryable form of
+        # suppliers_json), so prices can be re-converted in SQL when exchange rates move
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS item_supplier_prices (
+                sku TEXT NOT NULL,
+                pos INTEGER NOT NULL,
+                supplier TEXT,
+                currency TEXT,
+                original_price REAL,
+                qty REAL,
+                is_own INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (sku, pos)
+            ) WITHOUT ROWID
+        """)
+        # price_alerts: sharp price changes found by a worker run (Telegram digest, CSV attachment)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS price_alerts (
+                ts INTEGER NOT NULL,
+                sku TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                old_price REAL,
+                new_price REAL,
+                diff_pct REAL
+            )
+        """)
+
+        # Indexes of the bulk-loaded tables in one place (after the migrations that add their columns)
+        create_secondary_indexes(conn)
 
         # FTS5 Search Index
         conn.execute("""
@@ -93,49 +222,287 @@ def ensure_schema() -> None:
             );
         """)
 
-        # Triggers to keep FTS index in sync (idempotent creation)
-        existing_triggers = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='trigger'")}
+        # Triggers to keep FTS index in sync. v2 keys rows by items_latest.rowid and only
+        # touches the index when the name actually changes (price updates are the common case)
+        if get_meta_value(conn, 'fts_version') != FTS_VERSION:
+            drop_search_triggers(conn)
+            create_search_triggers(conn)
+            if conn.execute("SELECT 1 FROM items_latest LIMIT 1").fetchone():
+                print("Rebuilding items_search for name-aware FTS triggers...")
+                rebuild_search_index(conn)
+            set_meta_value(conn, 'fts_version', FTS_VERSION)
 
-        if 'items_latest_ai' not in existing_triggers:
-            conn.execute("""
-                CREATE TRIGGER items_latest_ai AFTER INSERT ON items_latest BEGIN
-                    INSERT INTO items_search(sku, name) VALUES (new.sku, COALESCE(new.name, ''));
-                END;
-            """)
-        
-        if 'items_latest_ad' not in existing_triggers:
-            conn.execute("""
-                CREATE TRIGGER items_latest_ad AFTER DELETE ON items_latest BEGIN
-                    DELETE FROM items_search WHERE sku = old.sku;
-                END;
-            """)
-        
-        if 'items_latest_au' not in existing_triggers:
-            conn.execute("""
-                CREATE TRIGGER items_latest_au AFTER UPDATE ON items_latest BEGIN
-                    DELETE FROM items_search WHERE sku = old.sku;
-                    INSERT INTO items_search(sku, name) VALUES (new.sku, COALESCE(new.name, ''));
-                END;
-            """)
+        # worker_runs: history of worker runs with per-stage timings
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS worker_runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                started_at INTEGER NOT NULL,
+                finished_at INTEGER,
+                status TEXT,
+                host TEXT,
+                pid INTEGER,
+                duration REAL,
+                cpu REAL,
+                rss_mb REAL,
+                total INTEGER,
+                inserted INTEGER,
+                changed INTEGER,
+                snapshots_added INTEGER,
+                stages_json TEXT,
+                error TEXT
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_worker_runs_started ON worker_runs(started_at);")
 
+        # Migration: exchange rates each run converted with (so its prices can be reproduced)
+        try:
+            conn.execute("ALTER TABLE worker_runs ADD COLUMN rates_json TEXT;")
+        except sqlite3.OperationalError:
+            # Column already exists
+            pass
+
+        # jobs: worker runs requested by the web app / bot, consumed by `worker.py --daemon` (see jobs.py)
         conn.execute("""
-            CREATE TABLE IF NOT EXISTS meta (
-                k TEXT PRIMARY KEY,
-                v TEXT
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                source TEXT,
+                status TEXT NOT NULL,
+                requests INTEGER NOT NULL DEFAULT 1,
+                created_at INTEGER NOT NULL,
+                started_at INTEGER,
+                finished_at INTEGER,
+                duration REAL,
+                result_json TEXT,
+                error TEXT
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id);")
+
+        # report_cache: default-parameter report results precomputed by the worker
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS report_cache (
+                name TEXT PRIMARY KEY,
+                version TEXT,
+                payload TEXT,
+                created_at INTEGER
             );
         """)
 
+        # Migration: fill item_supplier_prices from suppliers_json once
+        if (conn.execute("SELECT 1 FROM items_latest LIMIT 1").fetchone()
+                and not conn.execute("SELECT 1 FROM item_supplier_prices LIMIT 1").fetchone()):
+            print("Populating item_supplier_prices from suppliers_json...")
+            backfill_supplier_prices(conn)
+
         # Population (only if empty to avoid duplicates on every run)
         search_count = conn.execute("SELECT COUNT(*) FROM items_search").fetchone()[0]
         if search_count == 0:
             log_msg = "Populating items_search from items_latest..."
             print(log_msg)
-            conn.execute("INSERT INTO items_search(sku, name) SELECT sku, name FROM items_latest;")
+            conn.execute("INSERT INTO items_search(rowid, sku, name) SELECT rowid, sku, COALESCE(name, '') FROM items_latest;")
         
         conn.commit()
     finally:
         conn.close()
 
+# --- Staged ingest (worker builds the diff in a side file, then applies it in one short transaction) ---
+
+ITEM_COLUMNS = ("sku", "name", "our_price", "our_qty", "my_sklad_price", "my_sklad_qty",
+                "min_sup_price", "min_sup_qty", "min_sup_supplier", "suppliers_json",
+                "updated_at", "created_at", "change_seq")
+SNAPSHOT_COLUMNS = ("sku", "ts", "our_price", "our_qty", "my_sklad_price", "my_sklad_qty",
+                    "min_sup_price", "min_sup_qty", "min_sup_supplier")
+SUPPLIER_PRICE_COLUMNS = ("sku", "pos", "supplier", "currency", "original_price", "qty", "is_own")
+PRICE_ALERT_COLUMNS = ("ts", "sku", "kind", "old_price", "new_price", "diff_pct")
+
+def get_staging_path() -> str:
+    return f"{DB_PATH}.staging"
+
+def open_staging(path: str) -> sqlite3.Connection:
+    """Fresh scratch DB with the tables the worker writes to (same names/columns as the main DB)."""
+    for suffix in ("", "-journal", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    conn = sqlite3.connect(path)
+    # Scratch data: a crash just means the next run starts over
+    conn.execute("PRAGMA journal_mode=OFF;")
+    conn.execute("PRAGMA synchronous=OFF;")
+    conn.execute("""
+        CREATE TABLE items_latest (
+            sku TEXT PRIMARY KEY, name TEXT, our_price REAL, our_qty REAL,
+            my_sklad_price REAL, my_sklad_qty REAL,
+            min_sup_price REAL, min_sup_qty REAL, min_sup_supplier TEXT,
+            suppliers_json TEXT, updated_at INTEGER, created_at INTEGER, change_seq INTEGER
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE item_snapshots (
+            sku TEXT NOT NULL, ts INTEGER NOT NULL, our_price REAL, our_qty REAL,
+            my_sklad_price REAL, my_sklad_qty REAL,
+            min_sup_price REAL, min_sup_qty REAL, min_sup_supplier TEXT
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE item_supplier_prices (
+            sku TEXT NOT NULL, pos INTEGER NOT NULL, supplier TEXT, currency TEXT,
+            original_price REAL, qty REAL, is_own INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (sku, pos)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE TABLE item_tombstones (sku TEXT PRIMARY KEY)")
+    conn.execute("""
+        CREATE TABLE price_alerts (
+            ts INTEGER NOT NULL, sku TEXT NOT NULL, kind TEXT NOT NULL,
+            old_price REAL, new_price REAL, diff_pct REAL
+        )
+    """)
+    return conn
+
+def apply_staged_changes(conn: sqlite3.Connection, seq_offset: int = 0, schema: str = "staging") -> int:
+    """Copies staged upserts/snapshots into the main tables; runs inside the caller's transaction.
+
+    The staging DB must be ATTACHed as `schema`. Upserts use ON CONFLICT DO UPDATE so the
+    items_latest UPDATE/INSERT triggers (FTS) fire as for a direct write. seq_offset shifts the
+    staged change_seq values if someone else handed out sequence numbers in the meantime.
+    """
+    cols = ", ".join(ITEM_COLUMNS)
+    select_cols = ", ".join("change_seq + ?" if c == "change_seq" else c for c in ITEM_COLUMNS)
+    updates = ", ".join(f"{c}=excluded.{c}" for c in ITEM_COLUMNS if c not in ("sku", "created_at"))
+    cur = conn.execute(f"""
+        INSERT INTO main.items_latest ({cols})
+        SELECT {select_cols} FROM {schema}.items_latest WHERE true
+        ON CONFLICT(sku) DO UPDATE SET {updates}
+    """, (seq_offset,))
+    upserted = cur.rowcount
+    # A SKU that was deleted earlier and came back is no longer a tombstone
+    conn.execute(f"DELETE FROM main.item_tombstones WHERE sku IN (SELECT sku FROM {schema}.items_latest)")
+    snap_cols = ", ".join(SNAPSHOT_COLUMNS)
+    conn.execute(f"INSERT INTO main.item_snapshots ({snap_cols}) SELECT {snap_cols} FROM {schema}.item_snapshots")
+    conn.execute(f"DELETE FROM main.item_supplier_prices WHERE sku IN (SELECT sku FROM {schema}.items_latest)")
+    sup_cols = ", ".join(SUPPLIER_PRICE_COLUMNS)
+    conn.execute(f"""
+        INSERT INTO main.item_supplier_prices ({sup_cols})
+        SELECT {sup_cols} FROM {schema}.item_supplier_prices
+    """)
+    alert_cols = ", ".join(PRICE_ALERT_COLUMNS)
+    conn.execute(f"INSERT INTO main.price_alerts ({alert_cols}) SELECT {alert_cols} FROM {schema}.price_alerts")
+    return upserted
+
+def get_free_page_ratio(conn: sqlite3.Connection) -> float:
+    """Share of the DB file that is free pages (what VACUUM would reclaim)."""
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return freelist / page_count if page_count else 0.0
+
+# --- Supplier prices in original currency and SQL re-pricing ---
+
+OWN_SUPPLIER = "мой склад"
+
+def is_own_supplier(name: str) -> bool:
+    # Python lower(): SQLite's lower() only folds ASCII
+    return (name or "").strip().lower() == OWN_SUPPLIER
+
+def supplier_price_rows(sku: str, suppliers: List[Dict[str, Any]]) -> List[Tuple]:
+    """item_supplier_prices rows for one item's suppliers list (as stored in suppliers_json)."""
+    return [(sku, pos, s.get("supplier"), s.get("currency", "RUB"), s.get("original_price"), s.get("qty"),
+             int(is_own_supplier(s.get("supplier"))))
+            for pos, s in enumerate(suppliers)]
+
+def backfill_supplier_prices(conn: sqlite3.Connection) -> int:
+    placeholders = ", ".join("?" * len(SUPPLIER_PRICE_COLUMNS))
+    sql = f"INSERT OR REPLACE INTO item_supplier_prices ({', '.join(SUPPLIER_PRICE_COLUMNS)}) VALUES ({placeholders})"
+    count = 0
+    for sku, suppliers_json in conn.execute("SELECT sku, suppliers_json FROM items_latest").fetchall():
+        try:
+            rows = supplier_price_rows(sku, json.loads(suppliers_json or "[]"))
+        except (json.JSONDecodeError, TypeError, AttributeError):
+            continue
+        conn.executemany(sql, rows)
+        count += len(rows)
+    return count
+
+def reprice_items(conn: sqlite3.Connection, rates: Dict[str, float], currencies: List[str],
+                  ts: int) -> int:
+    """Re-converts stored prices of items with a supplier in `currencies` at `rates`; runs inside
+    the caller's transaction and returns the number of repriced items.
+
+    min_sup_* / my_sklad_* are recomputed set-based from item_supplier_prices with the same
+    rules as worker.process_single_product (cheapest own-stock-excluded offer with qty > 0, first
+    one on ties; last own-stock offer). suppliers_json is rewritten by a Python function so it
+    stays byte-identical to what the worker would store, otherwise the next ingest would see
+    every repriced item as changed. Items whose min/own prices moved get a snapshot.
+    """
+    def reprice_json(suppliers_json):
+        sups = json.loads(suppliers_json or "[]")
+        for s in sups:
+            if s.get("original_price") is not None:
+                s["price"] = round(s["original_price"] * rates.get(s.get("currency", "RUB"), 1.0), 2)
+        return json.dumps(sups, ensure_ascii=False)
+
+    conn.create_function("reprice_suppliers_json", 1, reprice_json, deterministic=True)
+    conn.execute("DROP TABLE IF EXISTS temp.fx")
+    conn.execute("CREATE TEMP TABLE fx (currency TEXT PRIMARY KEY, rate REAL)")
+    conn.executemany("INSERT INTO temp.fx VALUES (?, ?)", list(rates.items()))
+
+    placeholders = ", ".join("?" * len(currencies))
+    conn.execute("DROP TABLE IF EXISTS temp.repriced")
+    conn.execute(f"""
+        CREATE TEMP TABLE repriced AS
+        WITH skus AS (
+            SELECT sku, ROW_NUMBER() OVER (ORDER BY sku) AS n
+            FROM (SELECT DISTINCT sku FROM item_supplier_prices WHERE currency IN ({placeholders}))
+        ),
+        conv AS (
+            SELECT skus.sku, skus.n, p.pos, p.supplier, p.qty, p.is_own,
+                   p.original_price * COALESCE(fx.rate, 1.0) AS price_rub,
+                   (NOT p.is_own AND p.original_price * COALESCE(fx.rate, 1.0) > 0 AND p.qty > 0) AS cand
+            FROM skus JOIN item_supplier_prices p ON p.sku = skus.sku
+            LEFT JOIN temp.fx fx ON fx.currency = p.currency
+        ),
+        ranked AS (
+            SELECT *,
+                   ROW_NUMBER() OVER (PARTITION BY sku, is_own ORDER BY pos DESC) AS own_rn,
+                   ROW_NUMBER() OVER (PARTITION BY sku, cand ORDER BY price_rub, pos) AS best_rn
+            FROM conv
+        )
+        -- One pass + GROUP BY: joining the windowed CTEs back by sku would rescan them per row
+        SELECT sku, n,
+               round(COALESCE(MAX(CASE WHEN is_own AND own_rn = 1 THEN price_rub END), 0.0), 2) AS my_sklad_price,
+               COALESCE(MAX(CASE WHEN is_own AND own_rn = 1 THEN qty END), 0.0) AS my_sklad_qty,
+               round(MAX(CASE WHEN cand AND best_rn = 1 THEN price_rub END), 2) AS min_sup_price,
+               MAX(CASE WHEN cand AND best_rn = 1 THEN qty END) AS min_sup_qty,
+               MAX(CASE WHEN cand AND best_rn = 1 THEN supplier END) AS min_sup_supplier
+        FROM ranked GROUP BY sku
+    """, currencies)
+
+    seq = get_change_seq(conn)
+    snap_cols = ", ".join(SNAPSHOT_COLUMNS)
+    conn.execute(f"""
+        INSERT INTO item_snapshots ({snap_cols})
+        SELECT i.sku, ?, i.our_price, i.our_qty, r.my_sklad_price, r.my_sklad_qty,
+               r.min_sup_price, r.min_sup_qty, r.min_sup_supplier
+        FROM temp.repriced r JOIN items_latest i ON i.sku = r.sku
+        WHERE i.my_sklad_price IS NOT r.my_sklad_price OR i.my_sklad_qty IS NOT r.my_sklad_qty
+           OR i.min_sup_price IS NOT r.min_sup_price OR i.min_sup_qty IS NOT r.min_sup_qty
+           OR i.min_sup_supplier IS NOT r.min_sup_supplier
+    """, (ts,))
+    cur = conn.execute("""
+        UPDATE items_latest SET
+            my_sklad_price = r.my_sklad_price, my_sklad_qty = r.my_sklad_qty,
+            min_sup_price = r.min_sup_price, min_sup_qty = r.min_sup_qty, min_sup_supplier = r.min_sup_supplier,
+            suppliers_json = reprice_suppliers_json(items_latest.suppliers_json),
+            updated_at = ?, change_seq = ? + r.n
+        FROM temp.repriced r WHERE r.sku = items_latest.sku
+    """, (ts, seq))
+    repriced = cur.rowcount
+    if repriced:
+        set_meta_value(conn, 'change_seq', str(seq + conn.execute("SELECT COUNT(*) FROM temp.repriced").fetchone()[0]))
+        mark_data_edited(conn)
+    conn.execute("DROP TABLE temp.repriced")
+    conn.execute("DROP TABLE temp.fx")
+    return repriced
+
 def load_existing_latest(conn: sqlite3.Connection) -> Dict[str, Tuple]:
     try:
         cur = conn.execute("""
@@ -186,3 +553,115 @@ def get_meta_value(conn: sqlite3.Connection, key: str) -> Optional[str]:
 
 def set_meta_value(conn: sqlite3.Connection, key: str, value: str) -> None:
     conn.execute("INSERT INTO meta(k,v) VALUES(?, ?) ON CONFLICT(k) DO UPDATE SET v=excluded.v", (key, value))
+
+def get_data_version(conn: sqlite3.Connection) -> str:
+    """Token that changes whenever the worker commits or items are edited out-of-band."""
+    rows = dict(conn.execute(
+        "SELECT k, v FROM meta WHERE k IN ('last_reload_ts', 'last_edit_ts')"
+    ).fetchall())
+    return f"{rows.get('last_reload_ts') or 0}-{rows.get('last_edit_ts') or 0}"
+
+def data_files_stamp() -> tuple:
+    """(mtime, size) of the database and its WAL: changes on every commit, read without a connection."""
+    stamp = []
+    for path in (DB_PATH, DB_PATH + "-wal"):
+        try:
+            st = os.stat(path)
+            stamp += [st.st_mtime_ns, st.st_size]
+        except OSError:
+            stamp += [None, None]
+    return tuple(stamp)
+
+def get_data_modified_ts(conn: sqlite3.Connection) -> int:
+    """Unix time of the latest committed data change (worker run or manual edit)."""
+    row = conn.execute(
+        "SELECT MAX(CAST(v AS INTEGER)) FROM meta WHERE k IN ('last_reload_ts', 'last_edit_ts')"
+    ).fetchone()
+    return int(row[0] or 0)
+
+def mark_data_edited(conn: sqlite3.Connection) -> None:
+    """Bumps the data version after manual edits (e.g. deletions from the bot)."""
+    set_meta_value(conn, 'last_edit_ts', str(int(time.time())))
+
+def get_change_seq(conn: sqlite3.Connection) -> int:
+    """Last change sequence number handed out (see items_latest.change_seq)."""
+    return int(get_meta_value(conn, 'change_seq') or 0)
+
+def delete_items(conn: sqlite3.Connection, skus: List[str]) -> int:
+    """Deletes items with their history and records tombstones for the delta feed.
+
+    Commits unless the caller already has a transaction open (then the caller commits).
+    """
+    own_transaction = not conn.in_transaction
+    if own_transaction:
+        # The write lock must be held from reading change_seq to writing it back, or a worker
+        # commit in between would be overwritten with a smaller value
+        conn.execute("BEGIN IMMEDIATE")
+    try:
+        seq = get_change_seq(conn)
+        now = int(time.time())
+        count = 0
+        for sku in skus:
+            seq += 1
+            conn.execute("DELETE FROM items_latest WHERE sku = ?", (sku,))
+            conn.execute("DELETE FROM item_snapshots WHERE sku = ?", (sku,))
+            conn.execute("DELETE FROM item_supplier_prices WHERE sku = ?", (sku,))
+            conn.execute("DELETE FROM price_alerts WHERE sku = ?", (sku,))
+            conn.execute("""
+                INSERT INTO item_tombstones(sku, change_seq, deleted_at) VALUES (?, ?, ?)
+                ON CONFLICT(sku) DO UPDATE SET change_seq=excluded.change_seq, deleted_at=excluded.deleted_at
+            """, (sku, seq, now))
+            count += 1
+        set_meta_value(conn, 'change_seq', str(seq))
+        mark_data_edited(conn)
+        if own_transaction:
+            conn.commit()
+    except Exception:
+        if own_transaction:
+            conn.rollback()
+        raise
+    return count
+
+def count_price_alerts(conn: sqlite3.Connection, ts: int) -> Dict[str, int]:
+    """Sharp changes of one worker run by kind (our_price / min_price)."""
+    return dict(conn.execute("SELECT kind, COUNT(*) FROM price_alerts WHERE ts = ? GROUP BY kind", (ts,)).fetchall())
+
+def iter_price_alerts(conn: sqlite3.Connection, ts: int, kind: Optional[str] = None) -> sqlite3.Cursor:
+    """Sharp changes of one run with item names, largest relative change first; rows are fetched lazily."""
+    return conn.execute(f"""
+        SELECT a.sku, i.name, a.kind, a.old_price, a.new_price, a.diff_pct
+        FROM price_alerts a LEFT JOIN items_latest i ON i.sku = a.sku
+        WHERE a.ts = ? {"AND a.kind = ?" if kind else ""}
+        ORDER BY ABS(a.diff_pct) DESC, ABS(a.new_price - a.old_price) DESC
+    """, (ts, kind) if kind else (ts,))
+
+def record_worker_run(conn: sqlite3.Connection, run: Dict[str, Any]) -> None:
+    """Stores one worker run (see progress.ProgressReporter.status) in worker_runs."""
+    conn.execute("""
+        INSERT INTO worker_runs
+        (started_at, finished_at, status, host, pid, duration, cpu, rss_mb,
+         total, inserted, changed, snapshots_added, stages_json, error, rates_json)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (
+        run.get("started_at"), int(time.time()), run.get("state"), run.get("host"), run.get("pid"),
+        run.get("duration"), run.get("cpu"), run.get("rss_mb"),
+        run.get("processed", 0), run.get("inserted", 0), run.get("changed", 0), run.get("snapshots_added", 0),
+        json.dumps(run.get("stages", {})), run.get("error"),
+        json.dumps(run["rates"]) if run.get("rates") else None
+    ))
+
+def get_worker_runs(conn: sqlite3.Connection, limit: int = 20) -> List[Dict[str, Any]]:
+    rows = conn.execute("SELECT * FROM worker_runs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+    out = []
+    for r in rows:
+        run = dict(r)
+        try:
+            run["stages"] = json.loads(run.pop("stages_json") or "{}")
+        except (json.JSONDecodeError, TypeError):
+            run["stages"] = {}
+        try:
+            run["rates"] = json.loads(run.pop("rates_json") or "null")
+        except (json.JSONDecodeError, TypeError):
+            run["rates"] = None
+        out.append(run)
+    return out
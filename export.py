@@ -0,0 +1,167 @@
+import io
+import re
+import csv
+import json
+import zlib
+import zipfile
+from typing import Any, Iterable, Iterator, Sequence
+from xml.sax.saxutils import escape
+
+# Rows are buffered only up to this many before a chunk is flushed to the client
+FLUSH_EVERY = 500
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+CSV_MIMETYPE = "text/csv; charset=utf-8"
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+def _csv_cell(v: Any) -> Any:
+    if v is None:
+        return ""
+    if isinstance(v, float):
+        return str(v).replace(".", ",")  # Decimal comma, or ru-RU Excel reads 1234.5 as text/a date
+    return v
+
+def iter_csv(columns: Sequence[str], rows: Iterable[Sequence[Any]]) -> Iterator[bytes]:
+    """Streams rows as CSV for Excel with a Russian locale: ';' separator, decimal comma, UTF-8 BOM."""
+    buf = io.StringIO()
+    writer = csv.writer(buf, delimiter=';')
+    buf.write("\ufeff")
+    writer.writerow(columns)
+    for i, row in enumerate(rows, 1):
+        writer.writerow([_csv_cell(v) for v in row])
+        if i % FLUSH_EVERY == 0:
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue().encode("utf-8")
+
+# --- Minimal streaming XLSX (single sheet, inline strings, no styles) ---
+
+_XLSX_STATIC_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Export" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+# Characters not allowed in XML 1.0 (control chars that sometimes appear in supplier names)
+_XML_ILLEGAL = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+class _ChunkSink(io.RawIOBase):
+    """Unseekable write target for ZipFile; collected bytes are drained into the HTTP response."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def _xlsx_cell(value: Any) -> str:
+    if value is None or value == "":
+        return "<c/>"
+    if isinstance(value, bool):
+        value = int(value)
+    if isinstance(value, (int, float)):
+        return f"<c><v>{value}</v></c>"
+    text = _XML_ILLEGAL.sub("", str(value))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{escape(text)}</t></is></c>'
+
+def _xlsx_row(values: Iterable[Any]) -> bytes:
+    return ("<row>" + "".join(_xlsx_cell(v) for v in values) + "</row>").encode("utf-8")
+
+def iter_xlsx(columns: Sequence[str], rows: Iterable[Sequence[Any]]) -> Iterator[bytes]:
+    """Streams rows as a single-sheet XLSX without building the workbook in memory."""
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, content in _XLSX_STATIC_PARTS.items():
+            zf.writestr(name, content)
+        yield sink.drain()
+
+        with zf.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            sheet.write(_xlsx_row(columns))
+            for i, row in enumerate(rows, 1):
+                sheet.write(_xlsx_row(row))
+                if i % FLUSH_EVERY == 0:
+                    data = sink.drain()
+                    if data:
+                        yield data
+            sheet.write(b"</sheetData></worksheet>")
+    yield sink.drain()
+
+def iter_export(fmt: str, columns: Sequence[str], rows: Iterable[Sequence[Any]]) -> Iterator[bytes]:
+    if fmt == "xlsx":
+        return iter_xlsx(columns, rows)
+    return iter_csv(columns, rows)
+
+def mimetype_for(fmt: str) -> str:
+    return XLSX_MIMETYPE if fmt == "xlsx" else CSV_MIMETYPE
+
+# --- NDJSON bulk feed ---
+
+def ndjson_item_line(row: dict, raw_json_field: str = "suppliers_json", out_field: str = "suppliers") -> str:
+    """One NDJSON line; the stored JSON column is spliced in as-is instead of being decoded and re-encoded."""
+    raw = row.pop(raw_json_field, None) or "[]"
+    head = json.dumps(row, ensure_ascii=False, separators=(",", ":"))
+    return f'{head[:-1]},"{out_field}":{raw}}}\n'
+
+def iter_ndjson(lines: Iterable[str]) -> Iterator[bytes]:
+    buf = []
+    for i, line in enumerate(lines, 1):
+        buf.append(line)
+        if i % FLUSH_EVERY == 0:
+            yield "".join(buf).encode("utf-8")
+            buf.clear()
+    if buf:
+        yield "".join(buf).encode("utf-8")
+
+def iter_gzip(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """Gzip-compresses a byte stream on the fly (Content-Encoding: gzip)."""
+    comp = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits=31 -> gzip container
+    for chunk in chunks:
+        data = comp.compress(chunk)
+        if data:
+            yield data
+    yield comp.flush()
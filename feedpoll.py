@@ -0,0 +1,84 @@
+import os
+import json
+import statistics
+from email.utils import parsedate_to_datetime
+from typing import List, Optional, Tuple
+
+import db
+
+# Adaptive feed polling for `worker.py --daemon`. Every time the feed really changed, its
+# publish time (Last-Modified, else the time we noticed) is appended to meta. Once the gaps
+# between publications are regular, the next one is expected one median gap after the last:
+# the daemon sleeps until a window around that moment, polls every POLL_MIN inside it, and
+# backs off towards the fixed interval when the upstream is late. Irregular or short history
+# keeps the fixed interval.
+
+HISTORY_KEY = 'feed_change_history'
+NEXT_POLL_KEY = 'feed_next_poll'
+HISTORY_SIZE = 30
+MIN_HISTORY = 4  # Publications needed before the cadence is trusted
+# Gaps may deviate from their median by this share of it and still count as a cadence
+MAX_JITTER = 0.25
+POLL_MIN = int(os.environ.get("WORKER_POLL_MIN_SECONDS", "300"))
+POLL_MAX = int(os.environ.get("WORKER_POLL_MAX_SECONDS", "21600"))
+
+def change_time(last_modified: Optional[str], now: int) -> int:
+    """Publish time from a Last-Modified header; `now` if missing, unparsable or in the future."""
+    if last_modified:
+        try:
+            return min(int(parsedate_to_datetime(last_modified).timestamp()), now)
+        except (TypeError, ValueError, IndexError):
+            pass
+    return now
+
+def load_history(conn) -> List[int]:
+    try:
+        return [int(t) for t in json.loads(db.get_meta_value(conn, HISTORY_KEY) or "[]")]
+    except (ValueError, TypeError):
+        return []
+
+def record_change(conn, ts: int) -> None:
+    history = load_history(conn)
+    if history and ts <= history[-1]:
+        return
+    history.append(ts)
+    db.set_meta_value(conn, HISTORY_KEY, json.dumps(history[-HISTORY_SIZE:]))
+
+def cadence(history: List[int]) -> Optional[Tuple[float, float]]:
+    """(median gap, median deviation from it) in seconds, or None if there is no regular cadence."""
+    if len(history) < MIN_HISTORY:
+        return None
+    gaps = [b - a for a, b in zip(history, history[1:])]
+    period = statistics.median(gaps)
+    spread = statistics.median(abs(g - period) for g in gaps)
+    if period <= 0 or spread > period * MAX_JITTER:
+        return None
+    return period, spread
+
+def next_delay(history: List[int], now: float, default: int) -> int:
+    """Seconds until the next poll; `default` (the fixed interval) without a usable cadence."""
+    c = cadence(history)
+    if c is None:
+        return default
+    period, spread = c
+    window = min(max(2 * spread, POLL_MIN), period / 2)
+    expected = history[-1] + period
+    if now < expected - window:
+        return int(min(max(expected - window - now, POLL_MIN), POLL_MAX))
+    if now <= expected + window:
+        return POLL_MIN
+    # Late: the longer it has been overdue, the less often we look, up to the fixed interval
+    return int(min(max(now - expected - window, POLL_MIN), max(default, POLL_MIN)))
+
+def describe(conn) -> dict:
+    """Cadence summary and the daemon's next planned poll, for the status API."""
+    history = load_history(conn)
+    c = cadence(history)
+    next_poll = db.get_meta_value(conn, NEXT_POLL_KEY)
+    return {
+        "changes": len(history),
+        "last_change": history[-1] if history else None,
+        "period": c[0] if c else None,
+        "expected_next": history[-1] + c[0] if c else None,
+        "next_poll": int(next_poll) if next_poll else None,
+    }
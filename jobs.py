@@ -0,0 +1,85 @@
+import json
+import time
+import sqlite3
+from typing import Any, Dict, List, Optional, Tuple
+
+# SQLite-backed queue of worker jobs. The web app and the bot enqueue; one long-lived
+# `worker.py --daemon` (or a one-shot `worker.py --drain` when no daemon runs) consumes.
+# A queued job of the same kind absorbs new requests (its `requests` counter grows), so a
+# burst of triggers becomes a single run; a request during a running job queues one more.
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+KEEP_FINISHED = 1000
+
+def enqueue(conn: sqlite3.Connection, kind: str = "reload", source: str = "") -> Tuple[int, bool]:
+    """Returns (job id, coalesced); coalesced means an already queued job took the request."""
+    if not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")  # Two enqueuers must not both miss the queued job
+    try:
+        row = conn.execute("SELECT id FROM jobs WHERE kind = ? AND status = ? ORDER BY id LIMIT 1",
+                           (kind, QUEUED)).fetchone()
+        if row:
+            conn.execute("UPDATE jobs SET requests = requests + 1 WHERE id = ?", (row[0],))
+            job_id, coalesced = row[0], True
+        else:
+            cur = conn.execute("INSERT INTO jobs(kind, source, status, created_at) VALUES (?, ?, ?, ?)",
+                               (kind, source, QUEUED, int(time.time())))
+            job_id, coalesced = cur.lastrowid, False
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return job_id, coalesced
+
+def claim_next(conn: sqlite3.Connection) -> Optional[Dict[str, Any]]:
+    """Marks the oldest queued job as running and returns it (single consumer, see workerlock)."""
+    row = conn.execute("SELECT id FROM jobs WHERE status = ? ORDER BY id LIMIT 1", (QUEUED,)).fetchone()
+    if not row:
+        return None
+    cur = conn.execute("UPDATE jobs SET status = ?, started_at = ? WHERE id = ? AND status = ?",
+                       (RUNNING, int(time.time()), row[0], QUEUED))
+    conn.commit()
+    return get(conn, row[0]) if cur.rowcount else None
+
+def pending(conn: sqlite3.Connection) -> bool:
+    return conn.execute("SELECT 1 FROM jobs WHERE status = ? LIMIT 1", (QUEUED,)).fetchone() is not None
+
+def finish(conn: sqlite3.Connection, job_id: int, status: str,
+           result: Optional[Dict[str, Any]] = None, error: Optional[str] = None) -> None:
+    now = time.time()
+    conn.execute("""
+        UPDATE jobs SET status = ?, finished_at = ?, duration = ? - COALESCE(started_at, created_at),
+                        result_json = ?, error = ?
+        WHERE id = ?
+    """, (status, int(now), now, json.dumps(result, ensure_ascii=False) if result else None, error, job_id))
+    conn.commit()
+
+def prune(conn: sqlite3.Connection, keep: int = KEEP_FINISHED) -> None:
+    """Drops finished jobs beyond the newest `keep` (the daemon adds one per scheduled poll)."""
+    conn.execute("""
+        DELETE FROM jobs WHERE status IN (?, ?)
+          AND id <= (SELECT id FROM jobs ORDER BY id DESC LIMIT 1 OFFSET ?)
+    """, (DONE, FAILED, keep))
+    conn.commit()
+
+def fail_orphaned(conn: sqlite3.Connection) -> int:
+    """Jobs left running by a consumer that died; called when a consumer starts."""
+    cur = conn.execute("UPDATE jobs SET status = ?, finished_at = ?, error = ? WHERE status = ?",
+                       (FAILED, int(time.time()), "Consumer exited during the run", RUNNING))
+    conn.commit()
+    return cur.rowcount
+
+def _row(r: sqlite3.Row) -> Dict[str, Any]:
+    job = dict(r)
+    try:
+        job["result"] = json.loads(job.pop("result_json") or "null")
+    except (json.JSONDecodeError, TypeError):
+        job["result"] = None
+    return job
+
+def get(conn: sqlite3.Connection, job_id: int) -> Optional[Dict[str, Any]]:
+    r = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return _row(r) if r else None
+
+def recent(conn: sqlite3.Connection, limit: int = 20) -> List[Dict[str, Any]]:
+    return [_row(r) for r in conn.execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()]
@@ -0,0 +1,204 @@
+import os
+import sys
+import json
+import gzip
+import time
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+try:
+    import pytz
+except ImportError:
+    pytz = None
+
+import config
+
+# Size-based rotation of the shared cron log (see rotate_log)
+LOG_MAX_BYTES = int(os.environ.get("PRICE_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUPS = int(os.environ.get("PRICE_LOG_BACKUPS", "5"))
+
+def tail_lines(path: str, n: int = 100, block_size: int = 8192) -> List[str]:
+    """Last `n` lines of a file, reading backwards from EOF in blocks (O(lines), not O(file))."""
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        data = b""
+        # n + 1 newlines guarantee n complete lines (the file usually ends with '\n')
+        while pos > 0 and data.count(b"\n") <= n:
+            step = min(block_size, pos)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + data
+    lines = data.splitlines(keepends=True)[-n:] if n > 0 else []
+    return [line.decode("utf-8", errors="replace") for line in lines]
+
+def _compress_prefix(src, dst_path: str, size: int) -> None:
+    """Gzips the first `size` bytes of the open file `src` into dst_path (atomically)."""
+    tmp = f"{dst_path}.tmp"
+    src.seek(0)
+    with gzip.open(tmp, "wb") as dst:
+        left = size
+        while left > 0:
+            chunk = src.read(min(1024 * 1024, left))
+            if not chunk:
+                break
+            dst.write(chunk)
+            left -= len(chunk)
+    os.replace(tmp, dst_path)
+
+def rotate_log(path: str = None, max_bytes: int = None, backups: int = None) -> bool:
+    """Compresses the log into `<path>.1.gz` (shifting older ones) once it exceeds max_bytes.
+
+    Uses copy + truncate instead of rename: the worker service appends to the log via
+    systemd (StandardOutput=append:...) and keeps its file descriptor open. Only the bytes
+    present when rotation started are archived; lines that the web app, the bot or systemd
+    append meanwhile are carried over into the emptied log. With backups <= 0 the old
+    content is dropped without keeping a compressed copy.
+    """
+    path = path or config.get_log_path()
+    max_bytes = LOG_MAX_BYTES if max_bytes is None else max_bytes
+    backups = LOG_BACKUPS if backups is None else backups
+    try:
+        if max_bytes <= 0 or os.path.getsize(path) < max_bytes:
+            return False
+    except OSError:
+        return False
+
+    with open(path, "rb") as src:
+        size = os.fstat(src.fileno()).st_size
+        if backups > 0:
+            for i in range(backups - 1, 0, -1):
+                old = f"{path}.{i}.gz"
+                if os.path.exists(old):
+                    os.replace(old, f"{path}.{i + 1}.gz")
+            _compress_prefix(src, f"{path}.1.gz", size)
+        # Everything after `size` was written during compression: keep it. The read and the
+        # truncate are back to back, so only a line landing between them can be lost.
+        src.seek(size)
+        tail = src.read()
+        with open(path, "r+b") as f:
+            f.truncate(0)
+    if tail:
+        # O_APPEND like the other writers: concurrent lines go after it, nothing is overwritten
+        with open(path, "ab") as f:
+            f.write(tail)
+    return True
+
+# --- Structured logging ---
+# Every process (worker, gunicorn workers, bot) logs through a QueueHandler; a single
+# QueueListener thread does the file I/O, so log calls never block on disk.
+# Lines in the log file are JSON objects: {"ts", "level", "src", "msg", ...fields}.
+
+_ROOT_LOGGER = "priceweb"
+_listener: Optional[logging.handlers.QueueListener] = None
+_setup_lock = threading.Lock()
+
+def _get_tz():
+    if pytz:
+        try:
+            return pytz.timezone(os.environ.get("TZ", "Europe/Moscow"))
+        except Exception:
+            pass
+    return None
+
+_TZ = _get_tz()
+
+def format_ts(created: float) -> str:
+    if _TZ is not None:
+        return datetime.fromtimestamp(created, _TZ).strftime('%Y-%m-%d %H:%M:%S')
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(created))
+
+def _source(record: logging.LogRecord) -> str:
+    return record.name[len(_ROOT_LOGGER) + 1:] if record.name.startswith(_ROOT_LOGGER + ".") else record.name
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": format_ts(record.created),
+            "level": record.levelname,
+            "src": _source(record),
+            "msg": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class ConsoleFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        line = f"[{format_ts(record.created)}] {record.getMessage()}"
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+def _setup() -> None:
+    global _listener
+    with _setup_lock:
+        if _listener is None:
+            _listener = _start_listener()
+
+class _ConfigFileHandler(logging.FileHandler):
+    """FileHandler that resolves config.get_log_path() when the file is opened (first record),
+    not when the handler is created: loggers are set up at import, before PRICE_LOG_PATH /
+    PRICE_DB_PATH may be set (tests, tools)."""
+
+    def __init__(self):
+        super().__init__(config.get_log_path(), encoding="utf-8", delay=True)
+
+    def _open(self):
+        self.baseFilename = os.path.abspath(config.get_log_path())
+        return super()._open()
+
+def _start_listener() -> logging.handlers.QueueListener:
+    root = logging.getLogger(_ROOT_LOGGER)
+    file_handler = _ConfigFileHandler()
+    file_handler.setFormatter(JsonFormatter())
+    handlers = [file_handler]
+    # Under systemd stdout is appended to the same log file; only echo to a real terminal
+    if sys.stdout.isatty():
+        console = logging.StreamHandler(sys.stdout)
+        console.setFormatter(ConsoleFormatter())
+        handlers.append(console)
+
+    q: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(q, *handlers, respect_handler_level=False)
+    listener.start()
+    atexit.register(listener.stop)  # flush pending records on exit
+
+    root.addHandler(logging.handlers.QueueHandler(q))
+    root.setLevel(logging.INFO)
+    root.propagate = False
+    return listener
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger writing JSON lines to the shared log (src=name)."""
+    _setup()
+    return logging.getLogger(f"{_ROOT_LOGGER}.{name}")
+
+def log_event(logger: logging.Logger, message: str, level: int = logging.INFO, **fields: Any) -> None:
+    """Logs a message with structured fields (stage, elapsed, counters...)."""
+    logger.log(level, message, extra={"fields": fields})
+
+def format_line(line: str) -> str:
+    """Renders a JSON log line as '[ts] [src] msg' for the UI/bot; plain lines pass through."""
+    if not line.startswith("{"):
+        return line
+    try:
+        entry = json.loads(line)
+    except ValueError:
+        return line
+    src = entry.get("src")
+    prefix = f"[{entry.get('ts', '')}]" + (f" [{src.upper()}]" if src and src != "worker" else "")
+    text = f"{prefix} {entry.get('msg', '')}\n"
+    if entry.get("exc"):
+        text += entry["exc"] + "\n"
+    return text
+
+def tail_text(path: str, n: int = 100) -> str:
+    """Last `n` log lines, human-readable."""
+    return "".join(format_line(line) for line in tail_lines(path, n))
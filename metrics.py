@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+
+import config
+
+# Prometheus-style metrics without extra dependencies.
+# Every process keeps its own counters/histograms in memory and periodically dumps them
+# to <metrics dir>/metrics_<pid>.json; /metrics merges the files of all gunicorn workers.
+# Files of exited processes are kept (counters stay monotonic) and pruned after MAX_AGE.
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_SECONDS", "5"))
+MAX_AGE = int(os.environ.get("METRICS_MAX_AGE_DAYS", "7")) * 86400
+
+HELP = {
+    "priceweb_http_request_duration_seconds": "HTTP request latency by route",
+    "priceweb_http_requests_total": "HTTP requests by route and status",
+    "priceweb_db_query_duration_seconds": "SQLite query time (execute + fetch) by query",
+    "priceweb_report_rows_scanned_total": "items_latest/item_snapshots rows scanned by report computations",
+    "priceweb_cache_hits_total": "In-process cache hits",
+    "priceweb_cache_misses_total": "In-process cache misses",
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+_lock = threading.Lock()
+_counters: Dict[str, Dict[LabelKey, float]] = {}
+_histograms: Dict[str, Dict[LabelKey, List[float]]] = {}  # buckets..., sum, count
+# Callables returning {(name, labels): value} that are sampled on flush (e.g. cache stats)
+_collectors = []
+_last_flush = 0.0
+
+def _key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def inc(name: str, value: float = 1.0, **labels: str) -> None:
+    with _lock:
+        series = _counters.setdefault(name, {})
+        k = _key(labels)
+        series[k] = series.get(k, 0.0) + value
+
+def observe(name: str, value: float, **labels: str) -> None:
+    with _lock:
+        series = _histograms.setdefault(name, {})
+        k = _key(labels)
+        h = series.get(k)
+        if h is None:
+            h = series[k] = [0.0] * (len(BUCKETS) + 2)
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                h[i] += 1
+        h[-2] += value
+        h[-1] += 1
+
+@contextmanager
+def timer(name: str, **labels: str) -> Iterator[None]:
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - t0, **labels)
+
+def register_collector(fn) -> None:
+    """fn() -> iterable of (counter_name, labels_dict, value); values are absolute per process."""
+    _collectors.append(fn)
+
+# --- Multiprocess files ---
+
+def _snapshot() -> Dict:
+    counters = {name: {json.dumps(k): v for k, v in series.items()} for name, series in _counters.items()}
+    for fn in _collectors:
+        try:
+            for name, labels, value in fn():
+                counters.setdefault(name, {})[json.dumps(_key(labels))] = value
+        except Exception:
+            pass
+    histograms = {name: {json.dumps(k): v for k, v in series.items()} for name, series in _histograms.items()}
+    return {"pid": os.getpid(), "ts": time.time(), "counters": counters, "histograms": histograms}
+
+def write_dump(prefix: str, payload: Dict) -> None:
+    """Atomically writes this process' <prefix><pid>.json into the shared metrics dir."""
+    directory = config.get_metrics_dir()
+    try:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{prefix}{os.getpid()}.json")
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(payload, f)
+        os.replace(tmp, path)
+    except OSError:
+        pass  # Metrics are best effort
+
+def load_dumps(prefix: str) -> List[Dict]:
+    """Dumps of all processes (alive or exited) for the given prefix; stale files are pruned."""
+    directory = config.get_metrics_dir()
+    out = []
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return out
+    now = time.time()
+    for name in names:
+        if not (name.startswith(prefix) and name.endswith(".json")):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            if now - os.path.getmtime(path) > MAX_AGE:
+                os.remove(path)
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                out.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return out
+
+def flush(force: bool = False) -> None:
+    """Writes this process' metrics file (throttled to FLUSH_INTERVAL unless forced)."""
+    global _last_flush
+    now = time.time()
+    if not force and now - _last_flush < FLUSH_INTERVAL:
+        return
+    _last_flush = now
+    with _lock:
+        snap = _snapshot()
+    write_dump("metrics_", snap)
+
+def _fmt_labels(labels: LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    escaped = [(k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in items]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+def _fmt_value(v: float) -> str:
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+def render(extra_gauges: List[Tuple[str, str, Dict[str, str], float]] = ()) -> str:
+    """Prometheus text exposition of the merged metrics of all processes.
+
+    extra_gauges: (name, help, labels, value) computed at scrape time (e.g. worker stats from DB).
+    """
+    flush(force=True)
+    counters: Dict[str, Dict[LabelKey, float]] = {}
+    histograms: Dict[str, Dict[LabelKey, List[float]]] = {}
+    for snap in load_dumps("metrics_"):
+        for name, series in snap.get("counters", {}).items():
+            dst = counters.setdefault(name, {})
+            for k, v in series.items():
+                key = tuple(tuple(p) for p in json.loads(k))
+                dst[key] = dst.get(key, 0.0) + v
+        for name, series in snap.get("histograms", {}).items():
+            dst = histograms.setdefault(name, {})
+            for k, v in series.items():
+                key = tuple(tuple(p) for p in json.loads(k))
+                if key not in dst:
+                    dst[key] = [0.0] * len(v)
+                dst[key] = [a + b for a, b in zip(dst[key], v)]
+
+    lines = []
+    for name in sorted(counters):
+        lines.append(f"# HELP {name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} counter")
+        for k, v in sorted(counters[name].items()):
+            lines.append(f"{name}{_fmt_labels(k)} {_fmt_value(v)}")
+    for name in sorted(histograms):
+        lines.append(f"# HELP {name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} histogram")
+        for k, h in sorted(histograms[name].items()):
+            # observe() already counts cumulatively (value <= bound), matching Prometheus "le"
+            for bound, count in zip(BUCKETS, h):
+                lines.append(f"{name}_bucket{_fmt_labels(k, (('le', repr(bound)),))} {_fmt_value(count)}")
+            lines.append(f"{name}_bucket{_fmt_labels(k, (('le', '+Inf'),))} {_fmt_value(h[-1])}")
+            lines.append(f"{name}_sum{_fmt_labels(k)} {_fmt_value(h[-2])}")
+            lines.append(f"{name}_count{_fmt_labels(k)} {_fmt_value(h[-1])}")
+
+    seen = set()
+    for name, help_text, labels, value in extra_gauges:
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name}{_fmt_labels(_key(labels))} {_fmt_value(value)}")
+    return "\n".join(lines) + "\n"
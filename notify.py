@@ -1,17 +1,44 @@
 import os
+import html
+import queue
+import atexit
 import requests
+import threading
 import time
 from datetime import datetime
-from typing import Optional
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 try:
     import pytz
 except ImportError:
     pytz = None
 
 import config
+import logutil
+
+logger = logutil.get_logger("tg")
 
 TIMEZONE = os.environ.get("TZ", "Europe/Moscow")
 
+# Outbound messages go through a queue drained by one background thread, so the worker never
+# waits on Telegram. The thread paces sends (Telegram allows about one message a second per
+# chat, 20 a minute in groups), waits out 429 retry_after, retries network/5xx errors with
+# backoff, and merges adjacent plain messages into one while they fit in MAX_MESSAGE_LEN.
+# At exit whatever is still queued gets up to FLUSH_TIMEOUT seconds.
+API_TIMEOUT = 10
+MAX_ATTEMPTS = int(os.environ.get("TG_MAX_ATTEMPTS", "5"))
+MIN_INTERVAL = float(os.environ.get("TG_MIN_INTERVAL_SECONDS", "1"))
+MAX_MESSAGE_LEN = 4096
+FLUSH_TIMEOUT = float(os.environ.get("TG_FLUSH_TIMEOUT_SECONDS", "30"))
+# Digests (sharp changes, missing items) are paginated over at most this many messages;
+# the full list of sharp changes goes along as a CSV document
+DIGEST_MAX_MESSAGES = int(os.environ.get("TG_DIGEST_MAX_MESSAGES", "5"))
+
+_session = requests.Session()  # Keep-alive: one TLS handshake per process, not per message
+# Items: (token, method, payload, (document path, filename, remove after sending) or None)
+_queue: "queue.Queue[tuple]" = queue.Queue()
+_sender: Optional[threading.Thread] = None
+_sender_lock = threading.Lock()
+
 def get_now_str() -> str:
     """Returns current time string in configured timezone."""
     if pytz:
@@ -22,34 +49,151 @@ def get_now_str() -> str:
             pass  # Fallback
     return time.strftime('%Y-%m-%d %H:%M:%S')
 
-def send(text: str, alert_key: Optional[str] = None, reply_markup: Optional[dict] = None) -> None:
-    """
-    Sends a message to Telegram.
-    Respects TG_SILENT environment variable.
+def api_call(token: str, method: str, payload: Dict[str, Any], timeout: float = API_TIMEOUT,
+             attempts: int = MAX_ATTEMPTS, document: Optional[Tuple[str, str]] = None) -> Dict[str, Any]:
+    """Calls a Bot API method; 429, 5xx and connection errors are retried, anything else is returned as is.
+
+    A read timeout is not retried: the request may have been processed, and sending it again
+    would duplicate the message.
+
+    document: (path, filename) uploaded as the `document` field (sendDocument), reopened per attempt.
     """
+    url = f"https://api.telegram.org/bot{token}/{method}"
+    backoff = 1.0
+    for attempt in range(1, attempts + 1):
+        try:
+            if document:
+                with open(document[0], "rb") as f:
+                    resp = _session.post(url, data=payload, files={"document": (document[1], f)}, timeout=timeout)
+            else:
+                resp = _session.post(url, json=payload, timeout=timeout)
+        except requests.ConnectionError as e:
+            data = {"ok": False, "description": str(e)}  # Never reached Telegram: safe to resend
+        except requests.RequestException as e:
+            return {"ok": False, "description": str(e)}
+        else:
+            try:
+                data = resp.json()
+            except ValueError:
+                data = {"ok": False, "error_code": resp.status_code, "description": f"HTTP {resp.status_code}"}
+        if data.get("ok") or attempt == attempts:
+            return data
+        code = data.get("error_code")
+        if code == 429:
+            wait = float((data.get("parameters") or {}).get("retry_after", backoff))
+        elif not code or code >= 500:
+            wait, backoff = backoff, backoff * 2
+        else:
+            return data  # Bad request/forbidden: retrying would fail the same way
+        logger.info(f"Telegram {method} failed ({code or data.get('description')}), retrying in {wait:.0f}s")
+        time.sleep(wait)
+    return data
+
+_Item = Tuple[str, str, Dict[str, Any], Optional[Tuple[str, str, bool]]]
+
+def _coalesce(batch: List[_Item]) -> List[_Item]:
+    """Merges adjacent plain messages to the same chat; keyboards and documents are sent on their own."""
+    out: List[_Item] = []
+    for item in batch:
+        token, method, payload, document = item
+        if out and method == "sendMessage":
+            prev_token, prev_method, prev, _ = out[-1]
+            text = prev.get("text", "") + "\n\n" + payload["text"]
+            if (prev_method == method and prev_token == token and prev["chat_id"] == payload["chat_id"]
+                    and "reply_markup" not in prev and "reply_markup" not in payload
+                    and len(text) <= MAX_MESSAGE_LEN):
+                out[-1] = (token, method, dict(prev, text=text), None)
+                continue
+        out.append(item)
+    return out
+
+def _send_loop() -> None:
+    last_sent = 0.0
+    while True:
+        batch = [_queue.get()]
+        while True:
+            try:
+                batch.append(_queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            for token, method, payload, document in _coalesce(batch):
+                wait = MIN_INTERVAL - (time.monotonic() - last_sent)
+                if wait > 0:
+                    time.sleep(wait)
+                try:
+                    data = api_call(token, method, payload, timeout=API_TIMEOUT * 6 if document else API_TIMEOUT,
+                                    document=document[:2] if document else None)
+                finally:
+                    if document and document[2]:
+                        _remove_quietly(document[0])
+                last_sent = time.monotonic()
+                if data.get("ok"):
+                    logger.info("Successfully sent message to Telegram.")
+                else:
+                    err = f"Telegram API Error: {data.get('error_code')} - {data.get('description')}"
+                    print(f"[TG_NOTIFY] {err}")
+                    logger.info(err)
+        except Exception as e:
+            logger.info(f"Failed to send message: {e}")
+        finally:
+            for _ in batch:
+                _queue.task_done()
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def _ensure_sender() -> None:
+    global _sender
+    with _sender_lock:
+        if _sender is None or not _sender.is_alive():
+            _sender = threading.Thread(target=_send_loop, name="tg-notify", daemon=True)
+            _sender.start()
+
+def flush(timeout: float = FLUSH_TIMEOUT) -> bool:
+    """Waits until the queue is sent; False if `timeout` ran out first."""
+    deadline = time.monotonic() + timeout
+    with _queue.all_tasks_done:
+        while _queue.unfinished_tasks:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logger.info(f"{_queue.unfinished_tasks} Telegram message(s) not sent within {timeout:.0f}s")
+                return False
+            _queue.all_tasks_done.wait(remaining)
+    return True
+
+atexit.register(flush)
+
+def _target() -> Optional[Tuple[str, str]]:
+    """(bot token, chat id), or None when TG_SILENT is on or they are not configured."""
     # Read settings on demand to ensure they are loaded by config.py
     token = os.environ.get("TG_BOT_TOKEN", "").strip()
     chat_id = os.environ.get("TG_CHAT_ID", "").strip()
     silent = os.environ.get("TG_SILENT", "0") == "1"
 
-    # Write to log file if possible
-    log_path = config.get_log_path()
-
-    def _log_tg(msg):
-        with open(log_path, "a", encoding="utf-8") as f:
-            f.write(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [TG] {msg}\n")
-
     if silent:
-        _log_tg("Silent mode is ON, skipping.")
-        return
+        logger.info("Silent mode is ON, skipping.")
+        return None
 
     if not token or not chat_id:
         error_msg = f"Token or Chat ID missing. Token: {'set' if token else 'NOT SET'}, ChatID: {'set' if chat_id else 'NOT SET'}"
         print(f"[TG_NOTIFY] {error_msg}")
-        _log_tg(error_msg)
-        return
+        logger.info(error_msg)
+        return None
+    return token, chat_id
 
-    url = f"https://api.telegram.org/bot{token}/sendMessage"
+def send(text: str, alert_key: Optional[str] = None, reply_markup: Optional[dict] = None) -> None:
+    """
+    Queues a message to Telegram; returns immediately.
+    Respects TG_SILENT environment variable.
+    """
+    target = _target()
+    if not target:
+        return
+    token, chat_id = target
     payload = {
         "chat_id": chat_id,
         "text": text,
@@ -58,19 +202,79 @@ def send(text: str, alert_key: Optional[str] = None, reply_markup: Optional[dict
     }
     if reply_markup:
         payload["reply_markup"] = reply_markup
-    
-    try:
-        resp = requests.post(url, json=payload, timeout=10)
-        if not resp.ok:
-            err = f"Telegram API Error: {resp.status_code} - {resp.text}"
-            print(f"[TG_NOTIFY] {err}")
-            _log_tg(err)
-        else:
-            _log_tg("Successfully sent message to Telegram.")
-    except Exception as e:
-        err = f"Failed to send message: {e}"
-        print(f"[TG_NOTIFY] {err}")
-        _log_tg(err)
+    _queue.put((token, "sendMessage", payload, None))
+    _ensure_sender()
+
+def send_document(path: str, filename: str, caption: str = "", remove: bool = False) -> None:
+    """Queues a file upload (sendDocument); with remove=True the file is deleted once it is sent or skipped."""
+    target = _target()
+    if not target:
+        if remove:
+            _remove_quietly(path)
+        return
+    token, chat_id = target
+    payload = {"chat_id": chat_id, "caption": caption[:1024], "parse_mode": "HTML"}
+    _queue.put((token, "sendDocument", payload, (path, filename, remove)))
+    _ensure_sender()
+
+def split_message(text: str, limit: int = MAX_MESSAGE_LEN) -> List[str]:
+    """Splits text at line breaks into parts of at most `limit` chars.
+
+    A <pre> block cut in two is closed and reopened so each part stays valid HTML; a single
+    line longer than a part is cut hard.
+    """
+    if len(text) <= limit:
+        return [text]
+    budget = limit - len("</pre>")
+    pieces = []
+    for line in text.split("\n"):
+        while len(line) > budget - len("<pre>"):
+            cut = budget - len("<pre>")
+            pieces.append(line[:cut])
+            line = line[cut:]
+        pieces.append(line)
+    parts: List[str] = []
+    cur = ""
+    for piece in pieces:
+        candidate = f"{cur}\n{piece}" if cur else piece
+        if len(candidate) <= budget:
+            cur = candidate
+            continue
+        in_pre = cur.count("<pre>") > cur.count("</pre>")
+        parts.append(cur + "</pre>" if in_pre else cur)
+        cur = ("<pre>" if in_pre else "") + piece
+    parts.append(cur)
+    return parts
+
+def build_digest(header: str, lines: Iterable[str], total: int, more: str = "", footer: str = "",
+                 max_messages: int = DIGEST_MAX_MESSAGES, limit: int = MAX_MESSAGE_LEN) -> List[str]:
+    """Paginates already ranked lines into at most `max_messages` messages of at most `limit` chars.
+
+    Every page starts with the header (numbered when there are several). `lines` is consumed only
+    as far as the pages reach, so it can be a DB cursor; `more` is formatted with {n} = lines left
+    out and, like `footer`, goes on the last page.
+    """
+    page_size = limit - len(header) - len(more) - len(footer) - 32
+    pages: List[List[str]] = []
+    cur: List[str] = []
+    size = shown = 0
+    for line in lines:
+        line = line[:page_size]
+        if cur and size + len(line) + 1 > page_size:
+            if len(pages) + 1 >= max_messages:
+                break
+            pages.append(cur)
+            cur, size = [], 0
+        cur.append(line)
+        size += len(line) + 1
+        shown += 1
+    pages.append(cur)
+    if shown < total and more:
+        pages[-1].append("\n" + more.format(n=total - shown))
+    if footer:
+        pages[-1].append("\n" + footer)
+    n = len(pages)
+    return [header + (f" ({i}/{n})" if n > 1 else "") + "\n\n" + "\n".join(page) for i, page in enumerate(pages, 1)]
 
 def notify_start(host: str) -> None:
     send(f"🚀 <b>PriceWeb New Worker</b>\nHost: <code>{host}</code>\nStarted: <code>{get_now_str()}</code>")
@@ -86,6 +290,15 @@ def notify_success(stats: dict) -> None:
         f"Snapshots: <b>{stats.get('snapshots_added', 0)}</b>\n"
         f"Time: <b>{stats.get('duration', 0):.2f}s</b>"
     )
+
+    stages = stats.get('stages') or {}
+    if stages:
+        msg += "\n\n⏱ <b>Stages:</b>\n"
+        for name, rec in stages.items():
+            line = f"• {name}: {rec.get('wall', 0):.1f}s (CPU {rec.get('cpu', 0):.1f}s, RSS {rec.get('rss_mb', 0):.0f} MB)"
+            if rec.get('items_per_sec'):
+                line += f", {rec['items_per_sec']:.0f} it/s"
+            msg += line + "\n"
     
     new_items = stats.get('new_items', [])
     if new_items:
@@ -100,30 +313,35 @@ def notify_success(stats: dict) -> None:
 def notify_fail(error: str) -> None:
     send(f"❌ <b>PriceWeb New Worker FAILED</b>\nError: <code>{error}</code>")
 
-def notify_price_changes(changes: list) -> None:
+def _price_change_line(item) -> str:
+    emoji = "📈" if item['new_price'] > item['old_price'] else "📉"
+    return (
+        f"{emoji} <b>{html.escape(item['name'] or '')}</b> ({html.escape(item['sku'])})\n"
+        f"   {item['old_price']} ➡️ <b>{item['new_price']}</b> ({item['diff_pct']:+.1f}%)"
+    )
+
+def notify_price_changes(changes: Iterable, total: int, document: Optional[str] = None,
+                         filename: str = "price_changes.csv.gz", document_total: Optional[int] = None) -> None:
     """
-    Sends a report of sharp price changes to Telegram.
-    changes: List of dicts with keys: name, sku, old_price, new_price, diff_pct
+    Sends a digest of sharp price changes to Telegram, largest first, over several messages.
+    changes: ranked rows/dicts with keys: name, sku, old_price, new_price, diff_pct (read lazily)
+    document: optional .csv.gz with the full list, attached after the digest and then deleted
+    document_total: rows in the document, if it holds more than `changes` (supplier min prices too)
     """
-    if not changes:
+    if not total:
         return
-
-    msg = f"⚠️ <b>Резкое изменение цен ({len(changes)} шт):</b>\n\n"
-    
-    # Send in chunks if too long, but for now just clamp to first 20 items to avoid hitting limits
-    MAX_ITEMS = 20
-    
-    for item in changes[:MAX_ITEMS]:
-        emoji = "📈" if item['new_price'] > item['old_price'] else "📉"
-        msg += (
-            f"{emoji} <b>{item['name']}</b> ({item['sku']})\n"
-            f"   {item['old_price']} ➡️ <b>{item['new_price']}</b> ({item['diff_pct']:+.1f}%)\n"
-        )
-        
-    if len(changes) > MAX_ITEMS:
-        msg += f"\n<i>...и еще {len(changes) - MAX_ITEMS} товаров.</i>"
-        
-    send(msg)
+    document_total = total if document_total is None else document_total
+    with_min = document_total > total
+    listed = "полный список" + (" (и изменения мин. цен поставщиков)" if with_min else "")
+    more = "<i>...и еще {n} товаров" + (f" — {listed} в CSV." if document else ".") + "</i>"
+    for msg in build_digest(f"⚠️ <b>Резкое изменение цен ({total} шт):</b>",
+                            (_price_change_line(item) for item in changes), total, more=more):
+        send(msg)
+    if document:
+        caption = f"Резкие изменения цен: {document_total} шт."
+        if with_min:
+            caption += f" (наша цена: {total}, мин. цена поставщиков: {document_total - total})"
+        send_document(document, filename, caption=caption, remove=True)
 
 def notify_missing_items(missing_items: list) -> None:
     """
@@ -132,16 +350,6 @@ def notify_missing_items(missing_items: list) -> None:
     if not missing_items:
         return
 
-    msg = f"🗑️ <b>Обнаружено {len(missing_items)} удаленных товаров:</b>\n"
-    
-    for item in missing_items[:10]:
-        msg += f"• {item['name']} ({item['sku']})\n"
-        
-    if len(missing_items) > 10:
-        msg += f"<i>...и еще {len(missing_items) - 10} шт.</i>\n"
-        
-    msg += "\n<b>Удалить их из базы данных?</b>"
-    
     keyboard = {
         "inline_keyboard": [
             [
@@ -150,5 +358,10 @@ def notify_missing_items(missing_items: list) -> None:
             ]
         ]
     }
-    
-    send(msg, reply_markup=keyboard)
+    pages = build_digest(f"🗑️ <b>Обнаружено {len(missing_items)} удаленных товаров:</b>",
+                         (f"• {html.escape(item['name'] or '')} ({html.escape(item['sku'])})" for item in missing_items),
+                         len(missing_items), more="<i>...и еще {n} шт.</i>",
+                         footer="<b>Удалить их из базы данных?</b>")
+    for i, msg in enumerate(pages, 1):
+        # The buttons go with the last part, right under the question
+        send(msg, reply_markup=keyboard if i == len(pages) else None)
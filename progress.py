@@ -0,0 +1,120 @@
+import os
+import json
+import time
+from typing import Any, Dict, Optional
+
+import config
+
+
+def rss_mb() -> float:
+    """Current resident set size of this process in MB (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return round(pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024), 1)
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)  # KB on Linux
+    except (ImportError, OSError):
+        return 0.0
+
+
+class ProgressReporter:
+    """Publishes worker progress (stage, counters, stage timings) to a JSON status file.
+
+    The file is replaced atomically, so readers (/api/jobs/<id> in app.py) never see
+    a partial write. Writes are cheap enough to do every 1000 items.
+
+    Each finished stage is recorded in status["stages"] as
+    {"wall", "cpu", "rss_mb"[, "items", "items_per_sec"]}.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or config.get_status_path()
+        self.started_at = time.time()
+        self._stage_started = self.started_at
+        self._cpu_started = time.process_time()
+        self._stage_cpu = self._cpu_started
+        self._stage_processed = 0
+        self.status: Dict[str, Any] = {
+            "pid": os.getpid(),
+            "state": "running",
+            "stage": "start",
+            "message": "",
+            "processed": 0,
+            "started_at": int(self.started_at),
+            "stages": {},
+        }
+
+    def stage(self, name: str, message: str = "") -> None:
+        """Closes the current stage (recording wall/CPU time and RSS) and starts `name`."""
+        now = time.time()
+        cpu = time.process_time()
+        prev = self.status["stage"]
+        if prev != "start":
+            wall = now - self._stage_started
+            record = {
+                "wall": round(wall, 3),
+                "cpu": round(cpu - self._stage_cpu, 3),
+                "rss_mb": rss_mb(),
+            }
+            items = self.status.get("processed", 0) - self._stage_processed
+            if items > 0:
+                record["items"] = items
+                record["items_per_sec"] = round(items / wall, 1) if wall > 0 else 0.0
+            self.status["stages"][prev] = record
+        self._stage_started = now
+        self._stage_cpu = cpu
+        self._stage_processed = self.status.get("processed", 0)
+        self.status["stage"] = name
+        self.status["message"] = message
+        self._write()
+
+    def update(self, **fields: Any) -> None:
+        self.status.update(fields)
+        self._write()
+
+    def finish(self, state: str, **fields: Any) -> None:
+        """Marks the run as done/skipped/failed and closes the last stage.
+
+        CPU time is the run's own (the daemon runs many times in one process); RSS is the
+        current one at the end of the run.
+        """
+        self.stage("end")
+        self.status["state"] = state
+        self.status["duration"] = round(time.time() - self.started_at, 3)
+        self.status["cpu"] = round(time.process_time() - self._cpu_started, 3)
+        self.status["rss_mb"] = rss_mb()
+        self.update(**fields)
+
+    def stage_summary(self) -> str:
+        """One-line summary like 'download 1.2s · process 40.1s (2500 it/s)'."""
+        parts = []
+        for name, rec in self.status["stages"].items():
+            part = f"{name} {rec['wall']:.1f}s"
+            if rec.get("items_per_sec"):
+                part += f" ({rec['items_per_sec']:.0f} it/s)"
+            parts.append(part)
+        return " · ".join(parts)
+
+    def _write(self) -> None:
+        self.status["updated_at"] = time.time()
+        tmp = f"{self.path}.tmp.{os.getpid()}"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.status, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+        except OSError:
+            # Progress is best effort, never fail the worker because of it
+            pass
+
+
+def read_status(path: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    path = path or config.get_status_path()
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,351 @@
+import os
+import json
+import sqlite3
+import time
+from datetime import datetime
+from itertools import groupby
+from operator import itemgetter
+from typing import Any, Dict, List, Iterable, Optional
+
+import metrics
+from cache import LRUCache
+
+# Default parameter sets of the report pages (used by the request schemas in app.py).
+# The worker precomputes these right after each commit, see warm_reports().
+SPREAD_DEFAULTS = {"threshold": 20.0, "max_price": 2000000.0, "in_stock_only": 1}
+MARKUP_DEFAULTS = {"markup_pct": 10.0, "max_price": 2000000.0, "in_stock_only": 1, "qty_equal": 0}
+CHANGES_DEFAULTS = {"days": 7, "threshold": 30.0, "type": "all"}
+
+# Computed (filtered + sorted) report lists, keyed by report parameters and data version.
+# Paging and re-rendering only slice the cached list instead of rescanning items_latest.
+result_cache = LRUCache(
+    max_entries=int(os.environ.get("REPORT_CACHE_ENTRIES", "32")),
+    max_bytes=int(float(os.environ.get("REPORT_CACHE_MB", "64")) * 1024 * 1024),
+)
+
+# Time-windowed results ("last N days") move with the clock, not only with the data version:
+# their cutoff is rounded down to a WINDOW_SECONDS step and the step is part of every cache key
+WINDOW_SECONDS = int(os.environ.get("REPORT_WINDOW_SECONDS", "3600"))
+
+def window_start(now: Optional[float] = None) -> int:
+    """Start of the current window step; 'last N days' cutoffs count back from it."""
+    now = int(time.time() if now is None else now)
+    return now - now % WINDOW_SECONDS
+
+def windowed_version(version: str, now: Optional[float] = None) -> str:
+    """Data version + window step: the cache/precompute key of a time-windowed result."""
+    return f"{version}@{window_start(now)}"
+
+def _exclude_key(exclude_set: Iterable[str]) -> tuple:
+    return tuple(sorted(s.lower() for s in exclude_set))
+
+def get_all_suppliers(conn: sqlite3.Connection) -> List[str]:
+    """Sorted distinct supplier names (without 'мой склад') for the filter UI."""
+    suppliers_all = set()
+    for r in conn.execute("SELECT suppliers_json FROM items_latest"):
+        try:
+            sups = json.loads(r[0])
+            for s in sups:
+                name = s.get('supplier', '').strip()
+                if name and name.lower() != 'мой склад':
+                    suppliers_all.add(name)
+        except (json.JSONDecodeError, TypeError): continue
+    return sorted(suppliers_all)
+
+def compute_spread(conn: sqlite3.Connection, threshold: float, max_price: float,
+                   in_stock_only: int, exclude_set: Iterable[str]) -> List[Dict[str, Any]]:
+    """Items whose supplier price spread is >= threshold %, sorted by spread desc."""
+    exclude_set = {s.lower() for s in exclude_set}
+    rows = conn.execute("SELECT sku, name, our_price, suppliers_json FROM items_latest WHERE min_sup_price > 0")
+
+    results = []
+    scanned = 0
+    for r in rows:
+        scanned += 1
+        try:
+            sups = json.loads(r['suppliers_json'])
+        except (json.JSONDecodeError, TypeError): continue
+
+        valid_sups = []
+        for s in sups:
+            name = s.get('supplier', '').strip()
+            if name.lower() == 'мой склад' or name.lower() in exclude_set:
+                continue
+
+            p = float(s.get('price', 0))
+            q = float(s.get('qty', 0))
+            if p <= 0: continue
+            if in_stock_only and q <= 0: continue
+            # Issue 5: Filter garbage prices early in calculation
+            if p > max_price: continue
+
+            valid_sups.append(s)
+
+        if len(valid_sups) < 2:
+            continue
+
+        prices = [float(s['price']) for s in valid_sups]
+        min_p = min(prices)
+        max_p = max(prices)
+
+        # Re-check max_price on the final spread max to be sure
+        if max_p > max_price:
+             continue
+
+        spread = (max_p - min_p) * 100.0 / min_p
+        if spread < threshold:
+            continue
+
+        min_s_names = [s['supplier'] for s in valid_sups if float(s['price']) == min_p]
+        max_s_names = [s['supplier'] for s in valid_sups if float(s['price']) == max_p]
+
+        results.append({
+            'sku': r['sku'],
+            'name': r['name'],
+            'our_price': r['our_price'],
+            'min_price': min_p,
+            'min_suppliers': ", ".join(min_s_names),
+            'max_price': max_p,
+            'max_suppliers': ", ".join(max_s_names),
+            'spread_pct': round(spread, 2),
+            'suppliers_cnt': len(valid_sups),
+            'suppliers_json': r['suppliers_json']
+        })
+
+    metrics.inc("priceweb_report_rows_scanned_total", scanned, report="spread")
+    results.sort(key=lambda x: x['spread_pct'], reverse=True)
+    return results
+
+def compute_markup(conn: sqlite3.Connection, markup_pct: float, max_price: float,
+                   in_stock_only: int, qty_equal: int, exclude_set: Iterable[str]) -> List[Dict[str, Any]]:
+    """Items where our price + markup is still below the cheapest supplier, sorted by delta desc."""
+    exclude_set = {s.lower() for s in exclude_set}
+    rows = conn.execute("SELECT sku, name, our_price, our_qty, suppliers_json FROM items_latest WHERE our_price > 0")
+
+    results = []
+    scanned = 0
+    for r in rows:
+        scanned += 1
+        our = r['our_price']
+        our_qty = r['our_qty']
+
+        try:
+            sups = json.loads(r['suppliers_json'])
+        except (json.JSONDecodeError, TypeError): continue
+
+        filtered_prices = []
+        filtered_sups = []
+        for s in sups:
+            name = s.get('supplier', '').strip()
+            if name.lower() == 'мой склад' or name.lower() in exclude_set:
+                continue
+
+            p = float(s.get('price', 0))
+            q = float(s.get('qty', 0))
+
+            if p <= 0 or p > max_price: continue
+            if in_stock_only and q <= 0: continue
+            if qty_equal and q != our_qty: continue
+
+            filtered_prices.append(p)
+            filtered_sups.append(name)
+
+        if not filtered_prices: continue
+
+        min_sup = min(filtered_prices)
+        min_s_names = [filtered_sups[i] for i, p in enumerate(filtered_prices) if p == min_sup]
+
+        our_with_markup = our * (1.0 + markup_pct / 100.0)
+
+        if our_with_markup < min_sup:
+            delta_abs = min_sup - our_with_markup
+            delta_pct = (min_sup / our_with_markup - 1.0) * 100.0 if our_with_markup > 0 else 0
+
+            results.append({
+                'sku': r['sku'],
+                'name': r['name'],
+                'our_price': our,
+                'our_qty': our_qty,
+                'min_sup_price': min_sup,
+                'min_suppliers': ", ".join(min_s_names),
+                'our_price_with_markup': round(our_with_markup, 2),
+                'delta_abs': round(delta_abs, 2),
+                'delta_pct': round(delta_pct, 2),
+                'suppliers_json': r['suppliers_json']
+            })
+
+    metrics.inc("priceweb_report_rows_scanned_total", scanned, report="markup")
+    results.sort(key=lambda x: x['delta_abs'], reverse=True)
+    return results
+
+def compute_changes(conn: sqlite3.Connection, days: int, threshold: float, type_filter: str) -> List[Dict[str, Any]]:
+    """Sharp min/our price changes between consecutive snapshots, latest and largest first."""
+    cutoff = window_start() - days * 86400
+    
+    # Optimize: Fetch only necessary snapshot data first without joining heavy items_latest
+    query = """
+        SELECT sku, ts, min_sup_price, our_price, min_sup_supplier
+        FROM item_snapshots
+        WHERE ts >= ?
+        ORDER BY sku, ts ASC
+    """
+    rows = conn.execute(query, (cutoff,)).fetchall()
+    metrics.inc("priceweb_report_rows_scanned_total", len(rows), report="changes")
+    
+    changes = []
+    affected_skus = set()
+    
+    # Group by SKU
+    for sku, group in groupby(rows, key=itemgetter('sku')):
+        snaps = list(group)
+        if len(snaps) < 2:
+            continue
+        
+        # Iterate through snapshots to find changes
+        for i in range(1, len(snaps)):
+            prev = snaps[i-1]
+            curr = snaps[i]
+            
+            # Check min_sup_price
+            if type_filter in ['all', 'min_price']:
+                p_prev = prev['min_sup_price'] or 0
+                p_curr = curr['min_sup_price'] or 0
+                
+                if p_prev > 0 and p_curr > 0:
+                    diff_pct = (p_curr - p_prev) / p_prev * 100.0
+                    if abs(diff_pct) >= threshold:
+                        changes.append({
+                            'sku': sku,
+                            'ts': curr['ts'],
+                            'date': datetime.fromtimestamp(curr['ts']).strftime('%Y-%m-%d %H:%M'),
+                            'old_price': p_prev,
+                            'new_price': p_curr,
+                            'old_supplier': prev['min_sup_supplier'],
+                            'new_supplier': curr['min_sup_supplier'],
+                            'diff_pct': round(diff_pct, 1),
+                            'type': 'min_price', # Market Price
+                        })
+                        affected_skus.add(sku)
+
+            # Check our_price
+            if type_filter in ['all', 'our_price']:
+                p_prev_our = prev['our_price'] or 0
+                p_curr_our = curr['our_price'] or 0
+                
+                if p_prev_our > 0 and p_curr_our > 0:
+                    diff_pct = (p_curr_our - p_prev_our) / p_prev_our * 100.0
+                    if abs(diff_pct) >= threshold:
+                        changes.append({
+                            'sku': sku,
+                            'ts': curr['ts'],
+                            'date': datetime.fromtimestamp(curr['ts']).strftime('%Y-%m-%d %H:%M'),
+                            'old_price': p_prev_our,
+                            'new_price': p_curr_our,
+                            'old_supplier': "Наш магазин",
+                            'new_supplier': "Наш магазин",
+                            'diff_pct': round(diff_pct, 1),
+                            'type': 'our_price', # Our Price
+                        })
+                        affected_skus.add(sku)
+    
+    # Batch fetch details for affected SKUs
+    if affected_skus:
+        placeholders = ','.join(['?'] * len(affected_skus))
+        details_query = f"SELECT sku, name, suppliers_json, our_price FROM items_latest WHERE sku IN ({placeholders})"
+        details_rows = conn.execute(details_query, list(affected_skus)).fetchall()
+        details_map = {r['sku']: r for r in details_rows}
+        
+        # Enrich changes with details
+        valid_changes = []
+        for c in changes:
+            if c['sku'] in details_map:
+                item = details_map[c['sku']]
+                c['name'] = item['name']
+                c['suppliers_json'] = item['suppliers_json']
+                c['current_our_price'] = item['our_price']
+                valid_changes.append(c)
+        changes = valid_changes
+    else:
+        changes = []
+
+    # Sort by latest change first, then largest change
+    changes.sort(key=lambda x: (x['ts'], abs(x['diff_pct'])), reverse=True)
+    return changes
+
+# --- Precomputed results (stored by the worker) ---
+
+def store_precomputed(conn: sqlite3.Connection, name: str, version: str, payload: Any) -> None:
+    conn.execute("""
+        INSERT INTO report_cache(name, version, payload, created_at) VALUES (?, ?, ?, ?)
+        ON CONFLICT(name) DO UPDATE SET version=excluded.version, payload=excluded.payload, created_at=excluded.created_at
+    """, (name, version, json.dumps(payload, ensure_ascii=False), int(time.time())))
+
+def load_precomputed(conn: sqlite3.Connection, name: str, version: str) -> Optional[Any]:
+    """Returns the stored result only if it was built for the current data version."""
+    try:
+        r = conn.execute("SELECT payload FROM report_cache WHERE name = ? AND version = ?", (name, version)).fetchone()
+    except sqlite3.OperationalError:
+        return None  # Table not created yet (old schema)
+    if not r:
+        return None
+    try:
+        return json.loads(r[0])
+    except (json.JSONDecodeError, TypeError):
+        return None
+
+def warm_reports(conn: sqlite3.Connection, version: str) -> Dict[str, int]:
+    """Computes the default-parameter reports and the supplier list and stores them for the web tier."""
+    built = {
+        "suppliers": get_all_suppliers(conn),
+        "spread": compute_spread(conn, exclude_set=(), **SPREAD_DEFAULTS),
+        "markup": compute_markup(conn, exclude_set=(), **MARKUP_DEFAULTS),
+        "changes": compute_changes(conn, CHANGES_DEFAULTS["days"], CHANGES_DEFAULTS["threshold"], CHANGES_DEFAULTS["type"]),
+    }
+    for name, payload in built.items():
+        store_precomputed(conn, name, windowed_version(version) if name == "changes" else version, payload)
+    return {name: len(payload) for name, payload in built.items()}
+
+# --- Memoized accessors (used by the web app) ---
+
+def _memoized(conn: sqlite3.Connection, key: tuple, compute, precomputed: Optional[str] = None):
+    cached = result_cache.get(key)
+    if cached is None:
+        if precomputed:
+            # key[-1] is always the data version
+            with metrics.timer("priceweb_db_query_duration_seconds", query=f"{key[0]}_precomputed"):
+                cached = load_precomputed(conn, precomputed, key[-1])
+        if cached is None:
+            with metrics.timer("priceweb_db_query_duration_seconds", query=key[0]):
+                cached = compute()
+        result_cache.put(key, cached)
+    return cached
+
+def get_suppliers(conn: sqlite3.Connection, version: str) -> List[str]:
+    return _memoized(conn, ("suppliers", version), lambda: get_all_suppliers(conn), "suppliers")
+
+def get_spread(conn: sqlite3.Connection, version: str, threshold: float, max_price: float,
+               in_stock_only: int, exclude_set: Iterable[str]) -> List[Dict[str, Any]]:
+    params = (float(threshold), float(max_price), int(in_stock_only))
+    is_default = params == tuple(SPREAD_DEFAULTS.values()) and not exclude_set
+    key = ("spread",) + params + (_exclude_key(exclude_set), version)
+    return _memoized(conn, key, lambda: compute_spread(conn, threshold, max_price, in_stock_only, exclude_set),
+                     "spread" if is_default else None)
+
+def get_markup(conn: sqlite3.Connection, version: str, markup_pct: float, max_price: float,
+               in_stock_only: int, qty_equal: int, exclude_set: Iterable[str]) -> List[Dict[str, Any]]:
+    params = (float(markup_pct), float(max_price), int(in_stock_only), int(qty_equal))
+    is_default = params == tuple(MARKUP_DEFAULTS.values()) and not exclude_set
+    key = ("markup",) + params + (_exclude_key(exclude_set), version)
+    return _memoized(conn, key, lambda: compute_markup(conn, markup_pct, max_price, in_stock_only, qty_equal, exclude_set),
+                     "markup" if is_default else None)
+
+def get_changes(conn: sqlite3.Connection, version: str, days: int, threshold: float, type_filter: str) -> List[Dict[str, Any]]:
+    params = (int(days), float(threshold), type_filter)
+    is_default = params == tuple(CHANGES_DEFAULTS.values())
+    # Served from cache/precompute only within the window step it was computed in
+    key = ("changes",) + params + (windowed_version(version),)
+    return _memoized(conn, key, lambda: compute_changes(conn, days, threshold, type_filter),
+                     "changes" if is_default else None)
+
+def cache_stats() -> Dict[str, Any]:
+    return result_cache.stats()
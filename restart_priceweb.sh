@@ -4,7 +4,18 @@
 echo "🔄 Restarting PriceWeb services..."
 
 echo "🔄 1. Stopping all services..."
-sudo systemctl stop priceweb-web.service priceweb-bot.service priceweb-worker.service
+sudo systemctl stop priceweb-web.service priceweb-bot.service priceweb-jobs.service
+
+# The hourly priceweb-worker.timer is replaced by the priceweb-jobs.service daemon (README.md).
+# On hosts that still have the old units, turn them off so they do not run next to the daemon.
+if systemctl list-unit-files priceweb-worker.timer priceweb-worker.service --no-legend | grep -q .; then
+    echo "🔄 Migrating: disabling priceweb-worker.timer/.service, enabling priceweb-jobs.service..."
+    sudo systemctl disable --now priceweb-worker.timer priceweb-worker.service || true
+    sudo rm -f /etc/systemd/system/priceweb-worker.timer /etc/systemd/system/priceweb-worker.service
+    sudo cp -n /opt/priceweb_new/priceweb-jobs.service /etc/systemd/system/ || true
+    sudo systemctl daemon-reload
+    sudo systemctl enable priceweb-jobs.service
+fi
 
 echo "🔄 2. Killing any stray Python processes (just in case)..."
 sudo pkill -f "app:app" || true
@@ -22,14 +33,14 @@ sudo systemctl start priceweb-web.service
 echo "🔄 5. Starting Telegram Bot..."
 sudo systemctl start priceweb-bot.service
 
-# Worker
-echo "🔄 6. Starting Worker Service..."
-sudo systemctl start priceweb-worker.service
+# Worker daemon (scheduled polls and queued reloads)
+echo "🔄 6. Starting Worker Daemon..."
+sudo systemctl start priceweb-jobs.service
 
 echo "--------------------------------------------------"
 echo "✅ Restart complete. Checking status..."
 sleep 2
-systemctl status priceweb-web priceweb-bot --no-pager
+systemctl status priceweb-web priceweb-bot priceweb-jobs --no-pager
 echo "--------------------------------------------------"
 echo "💡 If status above is 'active', you're good to go!"
 echo "💡 Use '/menu' in bot and then '🔍 Диагностика' to verify."
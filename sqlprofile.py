@@ -0,0 +1,161 @@
+import os
+import re
+import time
+import sqlite3
+import logging
+import threading
+from typing import Any, Dict, List
+
+import logutil
+import metrics
+
+# Opt-in statement profiler for db.get_connection (PRICE_DB_PROFILE=1).
+# The trace callback marks the start of every statement and the progress handler
+# keeps bumping "last seen running", so a statement's time includes its fetch steps.
+ENABLED = os.environ.get("PRICE_DB_PROFILE", "0") == "1"
+SLOW_MS = float(os.environ.get("PRICE_DB_SLOW_MS", "100"))
+TOP_N = int(os.environ.get("PRICE_DB_PROFILE_TOP", "20"))
+PROGRESS_OPS = 1000       # VM instructions between progress callbacks
+MAX_STATEMENTS = 500      # Distinct normalized statements kept per process
+MAX_PENDING_SLOW = 50     # Slow statements waiting for EXPLAIN on a long-lived connection
+
+logger = logutil.get_logger("db")
+
+_lock = threading.Lock()
+_stats: Dict[str, Dict[str, Any]] = {}
+_last_flush = 0.0
+
+_STR = re.compile(r"'(?:[^']|'')*'")
+_NUM = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WS = re.compile(r"\s+")
+
+def normalize(sql: str) -> str:
+    """Literals -> '?', IN lists collapsed, whitespace squeezed: one key per statement shape."""
+    s = _STR.sub("?", sql)
+    s = _NUM.sub("?", s)
+    s = _IN_LIST.sub("(?, ...)", s)
+    return _WS.sub(" ", s).strip()
+
+def _record(key: str, elapsed_ms: float, sql: str) -> None:
+    with _lock:
+        st = _stats.get(key)
+        if st is None:
+            if len(_stats) >= MAX_STATEMENTS:
+                # Forget the cheapest statement to keep memory bounded
+                del _stats[min(_stats, key=lambda k: _stats[k]["total_ms"])]
+            st = _stats[key] = {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "sample": "", "plan": None}
+        st["count"] += 1
+        st["total_ms"] += elapsed_ms
+        if elapsed_ms >= st["max_ms"]:
+            st["max_ms"] = elapsed_ms
+            st["sample"] = sql[:2000]
+
+def explain(db_path: str, sql: str) -> List[str]:
+    """EXPLAIN QUERY PLAN on a separate read-only connection (never inside a trace callback)."""
+    if not sql.lstrip().upper().startswith(("SELECT", "WITH", "UPDATE", "DELETE", "INSERT")):
+        return []
+    try:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=5)
+    except sqlite3.Error:
+        return []
+    try:
+        return [r[3] for r in conn.execute("EXPLAIN QUERY PLAN " + sql).fetchall()]
+    except sqlite3.Error:
+        return []  # Temp tables of the worker, parameters not expanded, etc.
+    finally:
+        conn.close()
+
+def _flush(force: bool = False) -> None:
+    global _last_flush
+    now = time.time()
+    if not force and now - _last_flush < metrics.FLUSH_INTERVAL:
+        return
+    _last_flush = now
+    with _lock:
+        payload = {"pid": os.getpid(), "ts": now, "statements": {k: dict(v) for k, v in _stats.items()}}
+    metrics.write_dump("slowq_", payload)
+
+class ProfiledConnection(sqlite3.Connection):
+    """sqlite3.Connection factory that times every statement it runs."""
+
+    def __init__(self, database, *args, **kwargs):
+        super().__init__(database, *args, **kwargs)
+        self._db_path = database
+        self._current = None  # [sql, started, last_seen]
+        self._slow = []
+        self.set_trace_callback(self._on_statement)
+        self.set_progress_handler(self._on_progress, PROGRESS_OPS)
+
+    def _on_statement(self, sql: str) -> None:
+        cur = self._current
+        if sql.startswith("--") or (cur is not None and sql == cur[0]):
+            return  # Trigger sub-programs re-report the outer statement
+        self._finish()
+        now = time.perf_counter()
+        self._current = [sql, now, now]
+
+    def _on_progress(self) -> int:
+        if self._current is not None:
+            self._current[2] = time.perf_counter()
+        return 0  # Non-zero would abort the statement
+
+    def _finish(self) -> None:
+        cur, self._current = self._current, None
+        if cur is None:
+            return
+        elapsed_ms = (cur[2] - cur[1]) * 1000
+        key = normalize(cur[0])
+        _record(key, elapsed_ms, cur[0])
+        if elapsed_ms >= SLOW_MS:
+            if len(self._slow) < MAX_PENDING_SLOW:
+                self._slow.append((key, cur[0], elapsed_ms))
+            else:
+                # Keep the slowest ones
+                i = min(range(len(self._slow)), key=lambda j: self._slow[j][2])
+                if elapsed_ms > self._slow[i][2]:
+                    self._slow[i] = (key, cur[0], elapsed_ms)
+
+    def close(self) -> None:
+        self._finish()
+        slow, self._slow = self._slow, []
+        super().close()
+        for key, sql, elapsed_ms in slow:
+            with _lock:
+                plan = _stats.get(key, {}).get("plan")
+            if plan is None:
+                plan = explain(self._db_path, sql)
+                with _lock:
+                    if key in _stats:
+                        _stats[key]["plan"] = plan
+            logutil.log_event(logger, f"Slow query {elapsed_ms:.0f} ms: {key[:300]}", level=logging.WARNING,
+                              ms=round(elapsed_ms, 1), sql=sql[:2000], plan=plan)
+        _flush(force=bool(slow))
+
+def top_statements(limit: int = TOP_N) -> List[Dict[str, Any]]:
+    """Slowest normalized statements by total time, merged across all processes."""
+    _flush(force=True)
+    merged: Dict[str, Dict[str, Any]] = {}
+    for dump in metrics.load_dumps("slowq_"):
+        for key, st in dump.get("statements", {}).items():
+            m = merged.get(key)
+            if m is None:
+                merged[key] = dict(st)
+                continue
+            m["count"] += st["count"]
+            m["total_ms"] += st["total_ms"]
+            if st["max_ms"] > m["max_ms"]:
+                m["max_ms"], m["sample"] = st["max_ms"], st["sample"]
+            m["plan"] = m.get("plan") or st.get("plan")
+    out = []
+    for key, st in sorted(merged.items(), key=lambda kv: kv[1]["total_ms"], reverse=True)[:limit]:
+        out.append({
+            "statement": key,
+            "count": st["count"],
+            "total_ms": round(st["total_ms"], 1),
+            "avg_ms": round(st["total_ms"] / st["count"], 2) if st["count"] else 0.0,
+            "max_ms": round(st["max_ms"], 1),
+            "sample": st["sample"],
+            "plan": st.get("plan") or [],
+        })
+    return out
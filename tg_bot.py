@@ -10,6 +10,8 @@ from datetime import datetime
 from dotenv import load_dotenv
 
 import config
+import logutil
+import notify
 
 # Load environment variables from .env file FIRST
 load_dotenv()
@@ -29,24 +31,27 @@ if not TG_BOT_TOKEN or not TG_CHAT_ID:
     sys.exit(1)
 
 def tg_call(method: str, payload: Dict[str, Any]) -> Dict[str, Any]:
-    url = f"https://api.telegram.org/bot{TG_BOT_TOKEN}/{method}"
-    try:
-        resp = requests.post(url, json=payload, timeout=30)
-        return resp.json()
-    except Exception as e:
-        print(f"TG API Error: {e}")
-        return {"ok": False, "error": str(e)}
+    # Shared keep-alive session with 429 retry_after handling (see notify.api_call).
+    # A long poll holds the request for payload["timeout"] seconds: wait a bit longer than that.
+    timeout = payload.get("timeout", 0) + 10 if method == "getUpdates" else 30
+    resp = notify.api_call(TG_BOT_TOKEN, method, payload, timeout=timeout)
+    if not resp.get("ok"):
+        print(f"TG API Error: {resp.get('description')}")
+    return resp
 
 def tg_send(chat_id: str, text: str, reply_markup: Optional[Dict[str, Any]] = None) -> None:
-    payload = {
-        "chat_id": chat_id,
-        "text": text[:4000],
-        "parse_mode": "HTML",
-        "disable_web_page_preview": True
-    }
-    if reply_markup:
-        payload["reply_markup"] = reply_markup
-    tg_call("sendMessage", payload)
+    # Long texts go out in several messages; the keyboard stays under the last one
+    parts = notify.split_message(text)
+    for i, part in enumerate(parts, 1):
+        payload = {
+            "chat_id": chat_id,
+            "text": part,
+            "parse_mode": "HTML",
+            "disable_web_page_preview": True
+        }
+        if reply_markup and i == len(parts):
+            payload["reply_markup"] = reply_markup
+        tg_call("sendMessage", payload)
 
 def tg_answer_cb(callback_query_id: str, text: str = "") -> None:
     tg_call("answerCallbackQuery", {
@@ -92,10 +97,8 @@ def get_logs_text(lines: int = 50) -> str:
         return "❌ Файл логов не найден."
     
     try:
-        with open(PRICE_LOG_PATH, 'r') as f:
-            content = f.readlines()
-            tail = "".join(content[-lines:])
-            return f"📄 <b>Последние {lines} строк лога:</b>\n<pre>{html.escape(tail)}</pre>"
+        tail = logutil.tail_text(PRICE_LOG_PATH, lines)
+        return f"📄 <b>Последние {lines} строк лога:</b>\n<pre>{html.escape(tail)}</pre>"
     except Exception as e:
         return f"❌ Ошибка чтения логов: {e}"
 
@@ -123,10 +126,13 @@ def trigger_worker() -> str:
         except Exception:
             return f"❌ <b>Ошибка:</b> Сервер вернул некорректный ответ (Код: {resp.status_code}, Длина: {len(resp.text)})."
 
+        job = f" (задача #{data['job_id']})" if data.get('job_id') else ""
+        if data.get('ok') and data.get('queued'):
+            return f"⏳ <b>Воркер уже работает.</b>\nПовторный запуск{job} поставлен в очередь и начнётся сразу после завершения."
         if data.get('ok'):
-            return "✅ <b>Воркер запущен!</b>\nРезультат придет в чат после завершения."
+            return f"✅ <b>Воркер запущен{job}!</b>\nРезультат придет в чат после завершения."
         else:
-            return f"❌ <b>Ошибка запуска:</b> {data.get('error')}\n(API Port: {API_PORT}, Sent Token Len: {len(params.get('token',''))})"
+            return f"❌ <b>Ошибка запуска:</b> {data.get('error')}\n(API Port: {API_PORT}, Sent Token Len: {log_len})"
     except requests.exceptions.Timeout:
         return f"❌ <b>Таймаут:</b> Сервер не ответил вовремя (30с)."
     except Exception as e:
@@ -177,12 +183,7 @@ def handle_callback(cb: Dict[str, Any]) -> None:
                 return
                 
             conn = db.get_connection()
-            count = 0
-            for item in items:
-                sku = item['sku']
-                conn.execute("DELETE FROM items_latest WHERE sku = ?", (sku,))
-                conn.execute("DELETE FROM item_snapshots WHERE sku = ?", (sku,))
-                count += 1
+            count = db.delete_items(conn, [item['sku'] for item in items])
             conn.commit()
             conn.close()
             
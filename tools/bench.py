@@ -0,0 +1,277 @@
+"""Benchmark suite on a synthetic catalog (see gen_catalog.py); everything runs in a temp dir.
+
+Scenarios: full / incremental / no-op worker.run() ingest from a file:// feed, re-pricing after a
+rate change, FTS trigger cost (legacy vs name-aware), /api/search variants, each report
+(cold = caches cleared, warm = memoized) and item history. Results are JSON so runs
+can be compared across commits:
+
+    python tools/bench.py --skus 20000 --out bench_after.json
+    python tools/bench.py --skus 20000 --compare bench_before.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import sqlite3
+import tempfile
+import statistics
+import subprocess
+from typing import Callable, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import config  # noqa: E402  (loads .env first, bench paths below must win)
+import gen_catalog  # noqa: E402
+
+FIXED_RATES = "USD=90,EUR=100"
+FTS_BENCH_SKUS = 10000
+
+SEARCH_VARIANTS = {
+    "search_default": "/api/search",
+    "search_text": "/api/search?q=картридж+hp",
+    "search_sku": "/api/search?q=SKU0000123",
+    "search_filter": "/api/search?our_price=>1000&min_sup_supplier=OCS",
+    "search_sort_name_p5": "/api/search?sort_by=name&sort_asc=true&page=5&limit=100",
+}
+REPORT_URLS = {
+    "report_spread": "/reports/spread",
+    "report_markup": "/reports/markup",
+    "report_changes": "/reports/changes?days=30&threshold=10",
+}
+
+# items_latest -> items_search triggers before the name-aware/rowid-keyed version (db.FTS_TRIGGERS)
+LEGACY_FTS_TRIGGERS = (
+    """CREATE TRIGGER items_latest_ai AFTER INSERT ON items_latest BEGIN
+        INSERT INTO items_search(sku, name) VALUES (new.sku, COALESCE(new.name, '')); END;""",
+    """CREATE TRIGGER items_latest_ad AFTER DELETE ON items_latest BEGIN
+        DELETE FROM items_search WHERE sku = old.sku; END;""",
+    """CREATE TRIGGER items_latest_au AFTER UPDATE ON items_latest BEGIN
+        DELETE FROM items_search WHERE sku = old.sku;
+        INSERT INTO items_search(sku, name) VALUES (new.sku, COALESCE(new.name, '')); END;""",
+)
+
+def _setup_env(workdir: str) -> str:
+    feed = os.path.join(workdir, "feed.json")
+    os.environ.update({
+        "PRICE_DB_PATH": os.path.join(workdir, "bench.db"),
+        "PRICE_LOG_PATH": os.path.join(workdir, "bench.log"),
+        "PRICE_STATUS_PATH": os.path.join(workdir, "worker_status.json"),
+        "PRICE_METRICS_DIR": os.path.join(workdir, "metrics"),
+        "PRICE_LOCAL_DATA_FILE": os.path.join(workdir, "last_catalog_download.json"),
+        "PRICE_WORKER_LOCK": os.path.join(workdir, "worker.lock"),
+        "PRICE_JSON_URL": f"file://{feed}",
+        "PRICE_FIXED_RATES": FIXED_RATES,
+        "TG_SILENT": "1",
+    })
+    os.environ.setdefault("FLASK_SECRET_KEY", "bench")
+    return feed
+
+def _summary(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+    return {
+        "n": len(ordered),
+        "min_ms": round(ordered[0] * 1000, 2),
+        "median_ms": round(statistics.median(ordered) * 1000, 2),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2),
+    }
+
+def _measure(fn: Callable[[], None], repeat: int, before: Callable[[], None] = None) -> Dict[str, float]:
+    samples = []
+    for _ in range(repeat):
+        if before:
+            before()
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return _summary(samples)
+
+def bench_fts_triggers(workdir: str, args, triggers, label: str) -> Dict:
+    """Upserts a churn-sized batch (prices only, plus 1% renames) through the given FTS triggers.
+
+    Capped at FTS_BENCH_SKUS: the legacy trigger deletes by the unindexed sku column, i.e. a
+    full FTS scan per updated row, so it grows quadratically.
+    """
+    import random
+    import db
+    import worker
+    path = os.path.join(workdir, f"fts_{label}.db")
+    conn = sqlite3.connect(path)
+    conn.isolation_level = None
+    cols = ", ".join(db.ITEM_COLUMNS)
+    conn.execute(f"CREATE TABLE items_latest ({cols.replace('sku,', 'sku TEXT PRIMARY KEY,', 1)})")
+    conn.execute("CREATE VIRTUAL TABLE items_search USING fts5(sku UNINDEXED, name)")
+    for ddl in triggers:
+        conn.execute(ddl)
+    rows = [(p["sku"], p["name"], p["price"], p["quantity"], 0, 0, p["price"], 1, "OCS", "[]", 0, 0, i)
+            for i, p in enumerate(gen_catalog.iter_products(min(args.skus, FTS_BENCH_SKUS), 1, seed=args.seed))]
+    conn.execute("BEGIN")
+    conn.executemany(f"INSERT INTO items_latest ({cols}) VALUES ({', '.join('?' * len(db.ITEM_COLUMNS))})", rows)
+    conn.execute("COMMIT")
+
+    rnd = random.Random(args.seed)
+    batch = []
+    for row in rnd.sample(rows, int(len(rows) * args.churn)):
+        row = list(row)
+        row[2] = round(row[2] * 1.1, 2)
+        if rnd.random() < 0.01 / max(args.churn, 0.01):
+            row[1] = row[1] + " new"
+        batch.append(row)
+    t0 = time.perf_counter()
+    conn.execute("BEGIN")
+    conn.executemany(worker.ITEM_UPSERT_SQL, batch)
+    conn.execute("COMMIT")
+    wall = time.perf_counter() - t0
+    indexed = conn.execute("SELECT COUNT(*) FROM items_search").fetchone()[0]
+    conn.close()
+    return {"wall_ms": round(wall * 1000, 1), "rows": len(batch), "indexed": indexed}
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+def run_bench(args) -> Dict:
+    workdir = tempfile.mkdtemp(prefix="priceweb_bench_")
+    feed = _setup_env(workdir)
+    results: Dict[str, Dict] = {}
+    try:
+        import db
+        import worker
+        import reports
+
+        def gen(generation: int) -> None:
+            gen_catalog.write_feed(feed, gen_catalog.iter_products(
+                args.skus, args.suppliers, args.currencies.split(","), args.churn, generation, args.seed))
+
+        def ingest(name: str) -> None:
+            t0 = time.perf_counter()
+            worker.run()
+            wall = time.perf_counter() - t0
+            conn = db.get_connection()
+            try:
+                run = db.get_worker_runs(conn, 1)[0]
+            finally:
+                conn.close()
+            results[name] = {
+                "wall_ms": round(wall * 1000, 1),
+                "status": run["status"],
+                "items": run["total"],
+                "inserted": run["inserted"],
+                "changed": run["changed"],
+                "rss_mb": run["rss_mb"],
+                "stages": {k: {"wall_ms": round(v.get("wall", 0) * 1000, 1), "cpu_ms": round(v.get("cpu", 0) * 1000, 1)}
+                           for k, v in run["stages"].items()},
+            }
+
+        t0 = time.perf_counter()
+        gen(0)
+        results["generate_feed"] = {"wall_ms": round((time.perf_counter() - t0) * 1000, 1),
+                                    "bytes": os.path.getsize(feed)}
+        ingest("ingest_full")
+        gen(1)
+        os.utime(feed)  # New mtime even if generation 1 happens to be written within the same tick
+        ingest("ingest_incremental")
+        ingest("ingest_noop")
+        worker.FIXED_RATES = "USD=95,EUR=105"  # Same feed, moved rates: SQL re-pricing only
+        ingest("reprice_rates")
+
+        results["fts_update_legacy"] = bench_fts_triggers(workdir, args, LEGACY_FTS_TRIGGERS, "legacy")
+        results["fts_update_name_aware"] = bench_fts_triggers(workdir, args, db.FTS_TRIGGERS, "name_aware")
+
+        from app import app, limiter, response_cache
+        app.config["TESTING"] = True
+        app.config["LOGIN_DISABLED"] = True
+        limiter.enabled = False
+
+        def clear_caches() -> None:
+            response_cache.clear()
+            reports.result_cache.clear()
+
+        conn = db.get_connection()
+        try:
+            conn.execute("DELETE FROM report_cache")  # Cold numbers must not come from the worker's warm-up
+            conn.commit()
+            sample_sku = conn.execute("SELECT sku FROM item_snapshots GROUP BY sku HAVING COUNT(*) > 1 LIMIT 1").fetchone()
+        finally:
+            conn.close()
+
+        with app.test_client() as client:
+            def getter(url: str) -> Callable[[], None]:
+                def fn() -> None:
+                    resp = client.get(url)
+                    if resp.status_code != 200:
+                        raise RuntimeError(f"{url} -> {resp.status_code}")
+                    resp.get_data()
+                return fn
+
+            urls = dict(SEARCH_VARIANTS)
+            urls.update(REPORT_URLS)
+            if sample_sku:
+                urls["history"] = f"/ui/history?sku={sample_sku[0]}&days=30"
+            for name, url in urls.items():
+                results[f"{name}_cold"] = _measure(getter(url), args.repeat, before=clear_caches)
+                results[f"{name}_warm"] = _measure(getter(url), args.repeat)
+    finally:
+        if args.keep:
+            print(f"Bench data kept in {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "ts": int(time.time()),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "params": {"skus": args.skus, "suppliers": args.suppliers, "currencies": args.currencies,
+                       "churn": args.churn, "seed": args.seed, "repeat": args.repeat},
+        },
+        "results": results,
+    }
+
+def _headline_ms(entry: Dict) -> float:
+    return entry.get("median_ms", entry.get("wall_ms", 0.0))
+
+def compare(old: Dict, new: Dict) -> str:
+    lines = [f"{'scenario':<32} {'before':>10} {'after':>10} {'change':>8}"]
+    for name, entry in new["results"].items():
+        if name not in old["results"]:
+            continue
+        before, after = _headline_ms(old["results"][name]), _headline_ms(entry)
+        change = f"{(after - before) / before * 100:+.1f}%" if before else "n/a"
+        lines.append(f"{name:<32} {before:>10.1f} {after:>10.1f} {change:>8}")
+    return "\n".join(lines)
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="PriceWeb benchmark suite")
+    parser.add_argument("--skus", type=int, default=20000)
+    parser.add_argument("--suppliers", type=int, default=5)
+    parser.add_argument("--currencies", default="RUB,USD,EUR")
+    parser.add_argument("--churn", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=5, help="Samples per web scenario")
+    parser.add_argument("--out", help="Write JSON results to this file (default: stdout)")
+    parser.add_argument("--compare", help="Previous JSON results to diff against")
+    parser.add_argument("--keep", action="store_true", help="Keep the temp dir with DB/feed/log")
+    args = parser.parse_args(argv)
+
+    data = run_bench(args)
+    text = json.dumps(data, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            print(compare(json.load(f), data), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
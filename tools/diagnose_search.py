@@ -22,11 +22,10 @@ def diagnose():
         main_count = conn.execute("SELECT count(*) FROM items_latest").fetchone()[0]
         print(f"Main table count: {main_count}")
         
-        print("Repopulating index (Full rebuild)...")
-        conn.execute("INSERT INTO items_search(rowid, sku, name) SELECT rowid, sku, name FROM items_latest")
+        print("Repopulating index (offline bulk rebuild)...")
+        fts_count = db.rebuild_search_index(conn)
         conn.commit()
         
-        fts_count = conn.execute("SELECT count(*) FROM items_search").fetchone()[0]
         print(f"FTS index rebuilt. New count: {fts_count}")
 
         print("\n--- 🔍 SEARCH FINAL TEST ---")
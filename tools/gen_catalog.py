@@ -0,0 +1,108 @@
+"""Deterministic synthetic feed generator in the catalog.item.products shape.
+
+Same arguments -> byte-identical file, so benchmark runs are comparable across commits.
+Generation N applies N rounds of churn (price/qty changes, removed and new SKUs) to generation 0.
+
+    python tools/gen_catalog.py --skus 50000 --suppliers 6 --out /tmp/feed.json
+    python tools/gen_catalog.py --skus 50000 --suppliers 6 --generation 1 --churn 0.1 --out /tmp/feed.json
+"""
+import os
+import sys
+import json
+import random
+import argparse
+from typing import Dict, Iterator, List, Sequence
+
+SUPPLIER_NAMES = ["Мой склад", "OCS", "Merlion", "Treolan", "Marvel", "Netlab", "Elko", "Resource", "Digis", "Logic"]
+WORDS = ["Картридж", "Тонер", "Барабан", "HP", "Canon", "Kyocera", "Xerox", "Brother", "Samsung", "Ricoh",
+         "черный", "цветной", "оригинальный", "совместимый", "CF226A", "TK-1170", "CE285A", "MLT-D111S"]
+
+def _base_product(seed: int, i: int, suppliers: int, currencies: Sequence[str]) -> Dict:
+    rnd = random.Random(seed * 1000003 + i)
+    base_price = round(rnd.uniform(300, 50000), 2)
+    name = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(3, 6)))
+    sups = []
+    for name_idx in rnd.sample(range(len(SUPPLIER_NAMES)), min(suppliers, len(SUPPLIER_NAMES))):
+        currency = rnd.choice(currencies)
+        rate = {"USD": 90.0, "EUR": 100.0}.get(currency, 1.0)
+        sups.append({
+            "name": SUPPLIER_NAMES[name_idx],
+            "product": {
+                "sku": f"{SUPPLIER_NAMES[name_idx][:3].upper()}-{i}",
+                "name": name,
+                "price": round(base_price * rnd.uniform(0.7, 1.3) / rate, 2),
+                "quantity": rnd.choice([0, 0, 1, 2, 5, 10, 50]),
+                "currency": currency,
+            },
+        })
+    return {
+        "sku": f"SKU{i:08d}",
+        "name": name,
+        "price": base_price,
+        "quantity": rnd.choice([0, 1, 3, 10]),
+        "suppliers": sups,
+    }
+
+def _churn(p: Dict, rnd: random.Random) -> None:
+    p["price"] = round(p["price"] * rnd.uniform(0.6, 1.5), 2)
+    for s in p["suppliers"]:
+        if rnd.random() < 0.5:
+            s["product"]["price"] = round(s["product"]["price"] * rnd.uniform(0.8, 1.25), 2)
+            s["product"]["quantity"] = rnd.choice([0, 1, 2, 5, 10])
+
+def iter_products(skus: int, suppliers: int = 5, currencies: Sequence[str] = ("RUB", "USD", "EUR"),
+                  churn: float = 0.1, generation: int = 0, seed: int = 42) -> Iterator[Dict]:
+    """Products of the given generation; each round of churn changes ~churn of the SKUs,
+    drops ~churn/10 of them and appends as many new ones."""
+    removed = set()
+    changed: Dict[int, List[int]] = {}
+    total = skus
+    for g in range(1, generation + 1):
+        rnd = random.Random(seed * 7919 + g)
+        n_changed = int(skus * churn)
+        for i in rnd.sample(range(total), min(n_changed, total)):
+            changed.setdefault(i, []).append(g)
+        n_removed = int(skus * churn / 10)
+        removed.update(rnd.sample(range(total), min(n_removed, total)))
+        total += n_removed
+
+    for i in range(total):
+        if i in removed:
+            continue
+        p = _base_product(seed, i, suppliers, currencies)
+        for g in changed.get(i, ()):
+            _churn(p, random.Random(seed * 104729 + g * 1000003 + i))
+        yield p
+
+def write_feed(path: str, products: Iterator[Dict]) -> int:
+    """Streams products into {"catalog": {"item": {"products": [...]}}} without holding them in memory."""
+    count = 0
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write('{"catalog": {"item": {"products": [')
+        for p in products:
+            if count:
+                f.write(",")
+            f.write(json.dumps(p, ensure_ascii=False))
+            count += 1
+        f.write("]}}}")
+    os.replace(tmp, path)
+    return count
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Generate a synthetic supplier feed")
+    parser.add_argument("--skus", type=int, default=10000)
+    parser.add_argument("--suppliers", type=int, default=5, help="Suppliers per SKU")
+    parser.add_argument("--currencies", default="RUB,USD,EUR")
+    parser.add_argument("--churn", type=float, default=0.1, help="Share of SKUs changed per generation")
+    parser.add_argument("--generation", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", required=True)
+    args = parser.parse_args(argv)
+
+    count = write_feed(args.out, iter_products(
+        args.skus, args.suppliers, args.currencies.split(","), args.churn, args.generation, args.seed))
+    print(f"Wrote {count} products to {args.out} ({os.path.getsize(args.out) / 1024 / 1024:.1f} MB)", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
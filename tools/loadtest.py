@@ -0,0 +1,263 @@
+"""Load test: seeded synthetic DB + app:app under gunicorn + concurrent traffic (and worker writes).
+
+Everything lives in a temp dir; gunicorn serves create_app() (app:app with login disabled) and
+the rate limiter is off unless --limiter is given. Prints per-route p50/p95/p99 latency and throughput as JSON:
+
+    python tools/loadtest.py --skus 50000 --concurrency 16 --duration 60 --out load.json
+    python tools/loadtest.py --skus 50000 --write-interval 15   # worker.py runs while traffic flows
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import gen_catalog  # noqa: E402
+
+SEARCH_WORDS = ["картридж", "тонер", "hp", "canon", "kyocera", "cf226a", "черный", "барабан"]
+SUPPLIERS = [s for s in gen_catalog.SUPPLIER_NAMES if s != "Мой склад"]
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def _percentile(ordered: List[float], pct: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+class Traffic:
+    """Weighted mix of routes with randomized parameters (so not everything is a cache hit)."""
+
+    def __init__(self, skus: int, seed: int):
+        self.skus = skus
+        self.rnd = random.Random(seed)
+        self.mix = [
+            ("search", 50, self.search),
+            ("search_filter", 10, self.search_filter),
+            ("report_spread", 10, self.spread),
+            ("report_markup", 10, self.markup),
+            ("report_changes", 5, self.changes),
+            ("history", 15, self.history),
+        ]
+        self.total_weight = sum(w for _, w, _ in self.mix)
+
+    def pick(self) -> Tuple[str, str]:
+        x = self.rnd.uniform(0, self.total_weight)
+        for name, weight, fn in self.mix:
+            x -= weight
+            if x <= 0:
+                return name, fn()
+        return self.mix[0][0], self.mix[0][2]()
+
+    def search(self) -> str:
+        q = " ".join(self.rnd.sample(SEARCH_WORDS, self.rnd.randint(1, 2)))
+        return f"/api/search?q={q}&page={self.rnd.randint(1, 3)}"
+
+    def search_filter(self) -> str:
+        return f"/api/search?our_price=>{self.rnd.choice([500, 1000, 5000])}&min_sup_supplier={self.rnd.choice(SUPPLIERS)}"
+
+    def spread(self) -> str:
+        return f"/reports/spread?threshold={self.rnd.choice([10, 20, 30])}&page={self.rnd.randint(1, 3)}"
+
+    def markup(self) -> str:
+        return f"/reports/markup?markup_pct={self.rnd.choice([5, 10, 15])}&page={self.rnd.randint(1, 3)}"
+
+    def changes(self) -> str:
+        return f"/reports/changes?days={self.rnd.choice([1, 7, 30])}&threshold={self.rnd.choice([10, 30])}"
+
+    def history(self) -> str:
+        return f"/ui/history?sku=SKU{self.rnd.randrange(self.skus):08d}&days=30"
+
+def _client(base: str, traffic: Traffic, deadline: float, out: List[Tuple[str, float, int]], lock: threading.Lock) -> None:
+    session = requests.Session()
+    local = []
+    while time.time() < deadline:
+        with lock:
+            route, url = traffic.pick()
+        t0 = time.perf_counter()
+        try:
+            resp = session.get(base + url, timeout=60)
+            resp.content
+            status = resp.status_code
+        except requests.RequestException:
+            status = 0
+        local.append((route, time.perf_counter() - t0, status))
+    with lock:
+        out.extend(local)
+
+def _writer(env: Dict[str, str], feed: str, args, stop: threading.Event, runs: List[Dict]) -> None:
+    """Regenerates the feed with the next churn generation and runs worker.py, every write_interval s."""
+    generation = 1
+    while not stop.wait(args.write_interval):
+        gen_catalog.write_feed(feed, gen_catalog.iter_products(
+            args.skus, args.suppliers, churn=args.churn, generation=generation, seed=args.seed))
+        t0 = time.perf_counter()
+        proc = subprocess.run([sys.executable, "worker.py"], cwd=ROOT, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        runs.append({"generation": generation, "wall_s": round(time.perf_counter() - t0, 2), "exit_code": proc.returncode})
+        generation += 1
+
+def _wait_ready(base: str, proc: subprocess.Popen, timeout: float = 60) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with code {proc.returncode}")
+        try:
+            if requests.get(base + "/health", timeout=2).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.3)
+    raise RuntimeError("gunicorn did not become ready")
+
+def summarize(samples: List[Tuple[str, float, int]], duration: float) -> Dict[str, Dict]:
+    by_route: Dict[str, List[Tuple[float, int]]] = {}
+    for route, latency, status in samples:
+        by_route.setdefault(route, []).append((latency, status))
+    by_route["ALL"] = [(latency, status) for _, latency, status in samples]
+
+    out = {}
+    for route, items in sorted(by_route.items()):
+        ordered = sorted(latency for latency, _ in items)
+        out[route] = {
+            "requests": len(items),
+            "errors": sum(1 for _, status in items if status != 200),
+            "rps": round(len(items) / duration, 1) if duration else 0.0,
+            "p50_ms": round(_percentile(ordered, 50) * 1000, 1),
+            "p95_ms": round(_percentile(ordered, 95) * 1000, 1),
+            "p99_ms": round(_percentile(ordered, 99) * 1000, 1),
+            "max_ms": round(ordered[-1] * 1000, 1) if ordered else 0.0,
+        }
+    return out
+
+def create_app():
+    """gunicorn entry point for the load test: app:app with login disabled."""
+    from app import app
+    app.config["LOGIN_DISABLED"] = True
+    return app
+
+def run_load(args) -> Dict:
+    workdir = tempfile.mkdtemp(prefix="priceweb_load_")
+    feed = os.path.join(workdir, "feed.json")
+    port = args.port or _free_port()
+    base = f"http://127.0.0.1:{port}"
+    env = dict(os.environ)
+    env.update({
+        "PRICE_DB_PATH": os.path.join(workdir, "load.db"),
+        "PRICE_LOG_PATH": os.path.join(workdir, "load.log"),
+        "PRICE_STATUS_PATH": os.path.join(workdir, "worker_status.json"),
+        "PRICE_METRICS_DIR": os.path.join(workdir, "metrics"),
+        "PRICE_LOCAL_DATA_FILE": os.path.join(workdir, "last_catalog_download.json"),
+        "PRICE_WORKER_LOCK": os.path.join(workdir, "worker.lock"),
+        "PRICE_JSON_URL": f"file://{feed}",
+        "PRICE_FIXED_RATES": "USD=90,EUR=100",
+        "RATELIMIT_ENABLED": "1" if args.limiter else "0",
+        "TG_SILENT": "1",
+    })
+    env.setdefault("FLASK_SECRET_KEY", "loadtest")
+
+    gunicorn: Optional[subprocess.Popen] = None
+    try:
+        print(f"Seeding {args.skus} SKUs in {workdir}...", file=sys.stderr)
+        gen_catalog.write_feed(feed, gen_catalog.iter_products(
+            args.skus, args.suppliers, churn=args.churn, generation=0, seed=args.seed))
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, "worker.py"], cwd=ROOT, env=env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        seed_s = time.perf_counter() - t0
+
+        gunicorn = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "--workers", str(args.workers), "--bind", f"127.0.0.1:{port}",
+             "--timeout", "120", "--log-level", "warning",
+             "--pythonpath", os.path.join(ROOT, "tools"), "loadtest:create_app()"],
+            cwd=ROOT, env=env)
+        _wait_ready(base, gunicorn)
+
+        samples: List[Tuple[str, float, int]] = []
+        worker_runs: List[Dict] = []
+        lock = threading.Lock()
+        stop = threading.Event()
+        traffic = Traffic(args.skus, args.seed)
+        writer = None
+        if args.write_interval:
+            writer = threading.Thread(target=_writer, args=(env, feed, args, stop, worker_runs), daemon=True)
+            writer.start()
+
+        print(f"Running {args.concurrency} clients for {args.duration}s against {base}...", file=sys.stderr)
+        started = time.time()
+        deadline = started + args.duration
+        clients = [threading.Thread(target=_client, args=(base, traffic, deadline, samples, lock))
+                   for _ in range(args.concurrency)]
+        for t in clients:
+            t.start()
+        for t in clients:
+            t.join()
+        elapsed = time.time() - started
+        stop.set()
+        if writer:
+            writer.join()
+
+        return {
+            "meta": {
+                "ts": int(started),
+                "params": {"skus": args.skus, "suppliers": args.suppliers, "workers": args.workers,
+                           "concurrency": args.concurrency, "duration": args.duration,
+                           "write_interval": args.write_interval, "limiter": bool(args.limiter), "seed": args.seed},
+                "seed_ingest_s": round(seed_s, 2),
+            },
+            "routes": summarize(samples, elapsed),
+            "worker_runs": worker_runs,
+        }
+    finally:
+        if gunicorn and gunicorn.poll() is None:
+            gunicorn.terminate()
+            try:
+                gunicorn.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                gunicorn.kill()
+        if args.keep:
+            print(f"Load test data kept in {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="PriceWeb load test under gunicorn")
+    parser.add_argument("--skus", type=int, default=20000)
+    parser.add_argument("--suppliers", type=int, default=5)
+    parser.add_argument("--churn", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=3, help="gunicorn workers (production uses 3)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent HTTP clients")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of traffic")
+    parser.add_argument("--write-interval", type=float, default=0,
+                        help="Run worker.py on a churned feed every N seconds during the test (0 = off)")
+    parser.add_argument("--limiter", action="store_true", help="Keep the rate limiter enabled")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--out", help="Write JSON results to this file (default: stdout)")
+    parser.add_argument("--keep", action="store_true", help="Keep the temp dir with DB/feed/logs")
+    args = parser.parse_args(argv)
+
+    data = run_load(args)
+    text = json.dumps(data, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
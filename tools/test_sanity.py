@@ -1,10 +1,32 @@
 import unittest
 import os
+import sys
+import subprocess
+import shutil
+import tempfile
 import sqlite3
 import json
+import time
+
+# app.py creates the schema at import and loggers write from then on: point the DB and the log
+# at a temp dir before importing anything, so a test run never touches data/
+_TEST_DIR = tempfile.mkdtemp(prefix="priceweb_test_")
+os.environ["PRICE_DB_PATH"] = os.path.join(_TEST_DIR, "priceweb.db")
+os.environ["PRICE_LOG_PATH"] = os.path.join(_TEST_DIR, "cron_log.log")
+
+import app as app_module
 from app import app
 import db
+import reports
 import worker
+import jobs
+import feedpoll
+import notify
+from progress import ProgressReporter
+from cache import LRUCache
+import logutil
+import sqlprofile
+import workerlock
 
 class TestPriceWebSanity(unittest.TestCase):
     @classmethod
@@ -14,6 +36,8 @@ class TestPriceWebSanity(unittest.TestCase):
         os.environ["PRICE_DB_PATH"] = cls.test_db
         db.DB_PATH = cls.test_db
         db.ensure_schema()
+        cls.metrics_dir = tempfile.mkdtemp()
+        os.environ["PRICE_METRICS_DIR"] = cls.metrics_dir
 
     @classmethod
     def tearDownClass(cls):
@@ -24,6 +48,8 @@ class TestPriceWebSanity(unittest.TestCase):
             os.remove(cls.test_db + "-wal")
         if os.path.exists(cls.test_db + "-shm"):
             os.remove(cls.test_db + "-shm")
+        shutil.rmtree(cls.metrics_dir, ignore_errors=True)
+        shutil.rmtree(_TEST_DIR, ignore_errors=True)
 
     def test_db_connection(self):
         """Test database connection and basic schema."""
@@ -100,5 +126,865 @@ class TestPriceWebSanity(unittest.TestCase):
             data = json.loads(response.data)
             self.assertIn('items', data)
 
+    def test_conditional_get(self):
+        """Repeated requests with a matching ETag get 304 until the data version changes."""
+        app.config['TESTING'] = True
+        app.config['LOGIN_DISABLED'] = True
+        with app.test_client() as client:
+            first = client.get('/api/search?q=test&limit=5')
+            self.assertEqual(first.status_code, 200)
+            etag = first.headers.get('ETag')
+            self.assertTrue(etag)
+
+            # Argument order and empty values do not change the key
+            again = client.get('/api/search?limit=5&q=test&our_price=', headers={'If-None-Match': etag})
+            self.assertEqual(again.status_code, 304)
+
+            conn = db.get_connection()
+            db.mark_data_edited(conn)
+            db.set_meta_value(conn, 'last_reload_ts', '1')
+            conn.commit()
+            conn.close()
+
+            after = client.get('/api/search?q=test&limit=5', headers={'If-None-Match': etag})
+            self.assertEqual(after.status_code, 200)
+            self.assertNotEqual(after.headers.get('ETag'), etag)
+
+            # "Last N days" views also change when their window moves on, with the same data
+            old_window_start = reports.window_start
+            try:
+                reports.window_start = lambda now=None: 1_700_000_000
+                first = client.get('/reports/changes')
+                etag = first.headers.get('ETag')
+                self.assertEqual(client.get('/reports/changes', headers={'If-None-Match': etag}).status_code, 304)
+                reports.window_start = lambda now=None: 1_700_003_600
+                later = client.get('/reports/changes', headers={'If-None-Match': etag})
+                self.assertEqual(later.status_code, 200)
+                self.assertNotEqual(later.headers.get('ETag'), etag)
+            finally:
+                reports.window_start = old_window_start
+
+    def test_lru_cache_eviction(self):
+        """LRU cache evicts least recently used entries by count and by byte budget."""
+        cache = LRUCache(max_entries=2, max_bytes=100)
+        cache.put('a', 1, size=40)
+        cache.put('b', 2, size=40)
+        self.assertEqual(cache.get('a'), 1)  # 'a' becomes most recent
+        cache.put('c', 3, size=40)           # over budget -> evict 'b'
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+        cache.put('big', 'x', size=500)      # larger than the whole budget, not stored
+        self.assertIsNone(cache.get('big'))
+        st = cache.stats()
+        self.assertEqual(st['evictions'], 1)
+        self.assertEqual(st['hits'], 2)
+        self.assertEqual(st['misses'], 2)
+
+    def test_reports_warmup(self):
+        """Default reports precomputed by the worker are served for the matching data version."""
+        conn = db.get_connection()
+        try:
+            sups = [
+                {"supplier": "A", "price": 100.0, "qty": 1},
+                {"supplier": "B", "price": 200.0, "qty": 1},
+            ]
+            conn.execute(
+                "INSERT INTO items_latest(sku, name, our_price, our_qty, min_sup_price, suppliers_json) VALUES (?, ?, ?, ?, ?, ?)",
+                ('WARM-1', 'Warm item', 50.0, 1, 100.0, json.dumps(sups))
+            )
+            db.mark_data_edited(conn)
+            conn.commit()
+
+            version = db.get_data_version(conn)
+            counts = reports.warm_reports(conn, version)
+            conn.commit()
+            self.assertEqual(counts['spread'], 1)
+            self.assertEqual(reports.load_precomputed(conn, 'suppliers', version), ['A', 'B'])
+            self.assertIsNone(reports.load_precomputed(conn, 'spread', 'other-version'))
+
+            reports.result_cache.clear()
+            spread = reports.get_spread(conn, version, exclude_set=(), **reports.SPREAD_DEFAULTS)
+            self.assertEqual(spread[0]['sku'], 'WARM-1')
+            self.assertEqual(spread[0]['spread_pct'], 100.0)
+
+            # The page adds supplier stats to copies of the rows, never to the cached ones
+            app.config['TESTING'] = True
+            app.config['LOGIN_DISABLED'] = True
+            with app.test_client() as client:
+                self.assertEqual(client.get('/reports/markup').status_code, 200)
+            markup = reports.get_markup(conn, version, exclude_set=(), **reports.MARKUP_DEFAULTS)
+            self.assertTrue(markup)
+            self.assertNotIn('sup_stats', markup[0])
+        finally:
+            conn.execute("DELETE FROM items_latest WHERE sku = 'WARM-1'")
+            conn.commit()
+            conn.close()
+
+    def test_exports(self):
+        """Search and report exports stream CSV/XLSX without the 500-row page cap."""
+        app.config['TESTING'] = True
+        app.config['LOGIN_DISABLED'] = True
+        with app.test_client() as client:
+            response = client.get('/api/search/export?q=test&limit=100000&format=csv')
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('text/csv', response.content_type)
+            self.assertTrue(response.data.decode('utf-8-sig').startswith('sku;name;'))
+
+            response = client.get('/reports/spread/export?format=xlsx')
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.data.startswith(b'PK'))
+
+    def test_bulk_ndjson(self):
+        """Bulk endpoint streams one JSON object per line with suppliers decoded."""
+        app.config['TESTING'] = True
+        app.config['LOGIN_DISABLED'] = True
+        conn = db.get_connection()
+        conn.execute(
+            "INSERT INTO items_latest(sku, name, suppliers_json, updated_at) VALUES ('BULK-1', 'Bulk', ?, 500)",
+            (json.dumps([{"supplier": "A", "price": 1.0}]),)
+        )
+        conn.commit()
+        try:
+            with app.test_client() as client:
+                response = client.get('/api/bulk?since=499&gzip=0')
+                self.assertEqual(response.status_code, 200)
+                lines = response.data.decode('utf-8').splitlines()
+                self.assertEqual(len(lines), 1)
+                item = json.loads(lines[0])
+                self.assertEqual(item['sku'], 'BULK-1')
+                self.assertEqual(item['suppliers'][0]['supplier'], 'A')
+
+                # q=0 refuses gzip
+                response = client.get('/api/bulk?since=499', headers={'Accept-Encoding': 'gzip;q=0'})
+                self.assertNotIn('Content-Encoding', response.headers)
+                self.assertEqual(len(response.data.splitlines()), 1)
+
+                # Rows committed while the body streams are not mixed into it
+                response = client.get('/api/bulk?since=499&gzip=0', buffered=False)
+                conn.execute(
+                    "INSERT INTO items_latest(sku, name, suppliers_json, updated_at) VALUES ('BULK-2', 'Bulk', '[]', 501)")
+                conn.commit()
+                lines = b"".join(response.response).decode('utf-8').splitlines()
+                response.close()
+                self.assertEqual([json.loads(line)['sku'] for line in lines], ['BULK-1'])
+        finally:
+            conn.execute("DELETE FROM items_latest WHERE sku IN ('BULK-1', 'BULK-2')")
+            conn.commit()
+            conn.close()
+
+    def test_delta_feed(self):
+        """Worker assigns change_seq to upserts; deletions show up as tombstones."""
+        app.config['TESTING'] = True
+        app.config['LOGIN_DISABLED'] = True
+        rates = {"USD": 90.0, "EUR": 100.0, "RUB": 1.0}
+        conn = db.get_connection()
+        conn.isolation_level = None
+        try:
+            start = db.get_change_seq(conn)
+            stats = worker.StatsHelper()
+            stats.change_seq = start
+            conn.execute("BEGIN")
+            cur = conn.cursor()
+            for i in range(3):
+                worker.process_item_loop({'sku': f'DELTA-{i}', 'name': 'Delta', 'price': 10 + i}, rates, 100, {}, cur, cur, stats)
+            db.set_meta_value(conn, 'change_seq', str(stats.change_seq))
+            conn.execute("COMMIT")
+            self.assertEqual(stats.change_seq, start + 3)
+
+            with app.test_client() as client:
+                data = client.get(f'/api/changes?since={start}&limit=2').get_json()
+                self.assertEqual([i['sku'] for i in data['items']], ['DELTA-0', 'DELTA-1'])
+                self.assertTrue(data['has_more'])
+
+                db.delete_items(conn, ['DELTA-2'])
+                data = client.get(f"/api/changes?since={data['next_since']}").get_json()
+                self.assertEqual(data['items'], [])
+                self.assertEqual([d['sku'] for d in data['deleted']], ['DELTA-2'])
+                self.assertFalse(data['has_more'])
+        finally:
+            db.delete_items(conn, ['DELTA-0', 'DELTA-1'])
+            conn.close()
+
+    def test_delete_items_sequence_under_concurrent_commit(self):
+        """A worker commit that lands during a deletion can never move change_seq backwards."""
+        conn = db.get_connection()
+        conn.execute("INSERT INTO items_latest (sku, name) VALUES ('SEQ-1', 'Seq')")
+        conn.commit()
+        start = db.get_change_seq(conn)
+        original = db.get_change_seq
+        worker_commit = {}
+
+        def get_change_seq_then_worker_commits(c):
+            seq = original(c)
+            # The worker tries to commit 5 sequence numbers right after the deletion read the counter
+            other = db.get_connection(timeout=0.2)
+            try:
+                other.execute("UPDATE meta SET v = CAST(v AS INTEGER) + 5 WHERE k = 'change_seq'")
+                other.commit()
+                worker_commit["done"] = True
+            except sqlite3.OperationalError:
+                worker_commit["done"] = False  # Blocked by the deletion's write lock
+            finally:
+                other.close()
+            return seq
+
+        db.get_change_seq = get_change_seq_then_worker_commits
+        try:
+            db.delete_items(conn, ['SEQ-1'])
+        finally:
+            db.get_change_seq = original
+        try:
+            self.assertFalse(worker_commit["done"])
+            tomb = conn.execute("SELECT change_seq FROM item_tombstones WHERE sku = 'SEQ-1'").fetchone()[0]
+            self.assertEqual((tomb, db.get_change_seq(conn)), (start + 1, start + 1))
+            # The worker retries after the deletion committed and continues from there
+            conn.execute("UPDATE meta SET v = CAST(v AS INTEGER) + 5 WHERE k = 'change_seq'")
+            conn.commit()
+            self.assertEqual(db.get_change_seq(conn), start + 6)
+        finally:
+            conn.execute("DELETE FROM item_tombstones WHERE sku = 'SEQ-1'")
+            conn.commit()
+            conn.close()
+
+    def test_events_stream(self):
+        """SSE endpoint reports worker progress and the current data version; streams are capped."""
+        app.config['TESTING'] = True
+        app.config['LOGIN_DISABLED'] = True
+        status_path = "test_worker_status.json"
+        os.environ["PRICE_STATUS_PATH"] = status_path
+        old_max = app_module.SSE_MAX_SECONDS
+        app_module.SSE_MAX_SECONDS = 1
+        try:
+            reporter = ProgressReporter()
+            reporter.stage("process", "Processing items...")
+            reporter.update(processed=1000)
+
+            with app.test_client() as client:
+                response = client.get('/api/events')
+                body = response.data.decode('utf-8')
+                response.close()  # What the WSGI server does at the end of the stream
+                self.assertTrue(body.startswith('retry: 3000'))
+                self.assertIn('event: progress', body)
+                self.assertIn('"processed": 1000', body)
+                self.assertIn('event: version', body)
+
+                # Slots are released when a stream closes; with none left the client is sent away
+                taken = 0
+                while app_module._sse_slots.acquire(blocking=False):
+                    taken += 1
+                self.assertEqual(taken, app_module.SSE_MAX_STREAMS)
+                try:
+                    body = client.get('/api/events').data.decode('utf-8')
+                    self.assertEqual(body, 'retry: 30000\n\n')
+                finally:
+                    for _ in range(taken):
+                        app_module._sse_slots.release()
+        finally:
+            app_module.SSE_MAX_SECONDS = old_max
+            os.environ.pop("PRICE_STATUS_PATH", None)
+            if os.path.exists(status_path):
+                os.remove(status_path)
+
+    def test_job_progress_polling(self):
+        """/api/jobs/<id> of a running job carries the worker's live progress."""
+        app.config['TESTING'] = True
+        app.config['LOGIN_DISABLED'] = True
+        status_path = "test_worker_status.json"
+        os.environ["PRICE_STATUS_PATH"] = status_path
+        conn = db.get_connection()
+        try:
+            job_id, _ = jobs.enqueue(conn, "reload", "test")
+            jobs.claim_next(conn)
+            reporter = ProgressReporter()
+            reporter.stage("process", "Processing items...")
+            reporter.update(processed=1000)
+
+            with app.test_client() as client:
+                job = client.get(f'/api/jobs/{job_id}').get_json()['job']
+                self.assertEqual(job['status'], 'running')
+                self.assertEqual(job['progress']['processed'], 1000)
+                self.assertEqual(job['progress']['stage'], 'process')
+                jobs.finish(conn, job_id, jobs.DONE, result={"state": "done"})
+                job = client.get(f'/api/jobs/{job_id}').get_json()['job']
+                self.assertNotIn('progress', job)
+        finally:
+            conn.execute("DELETE FROM jobs")
+            conn.commit()
+            conn.close()
+            os.environ.pop("PRICE_STATUS_PATH", None)
+            if os.path.exists(status_path):
+                os.remove(status_path)
+
+    def test_log_tail_and_rotation(self):
+        """Tail reads only the requested lines; rotation compresses and truncates the log."""
+        log_path = "test_cron_log.log"
+        try:
+            with open(log_path, "w", encoding="utf-8") as f:
+                for i in range(5000):
+                    f.write(f"line {i}\n")
+            tail = logutil.tail_lines(log_path, 3, block_size=16)
+            self.assertEqual(tail, ["line 4997\n", "line 4998\n", "line 4999\n"])
+            self.assertEqual(len(logutil.tail_lines(log_path, 10000)), 5000)
+
+            self.assertFalse(logutil.rotate_log(log_path, max_bytes=10 ** 9))
+            self.assertTrue(logutil.rotate_log(log_path, max_bytes=1024, backups=2))
+            self.assertEqual(os.path.getsize(log_path), 0)
+            self.assertTrue(os.path.exists(log_path + ".1.gz"))
+
+            # A line another process appends while the old content is compressed is kept
+            with open(log_path, "w", encoding="utf-8") as f:
+                f.write("old\n" * 1000)
+            old_compress = logutil._compress_prefix
+
+            def compress_with_concurrent_write(src, dst_path, size):
+                with open(log_path, "a", encoding="utf-8") as f:
+                    f.write("written meanwhile\n")
+                old_compress(src, dst_path, size)
+
+            logutil._compress_prefix = compress_with_concurrent_write
+            try:
+                self.assertTrue(logutil.rotate_log(log_path, max_bytes=1024, backups=2))
+            finally:
+                logutil._compress_prefix = old_compress
+            with open(log_path, encoding="utf-8") as f:
+                self.assertEqual(f.read(), "written meanwhile\n")
+            self.assertTrue(os.path.exists(log_path + ".2.gz"))
+            import gzip
+            with gzip.open(log_path + ".1.gz", "rt", encoding="utf-8") as f:
+                self.assertEqual(f.read(), "old\n" * 1000)
+
+            # backups=0: no compressed copy is kept or shifted
+            with open(log_path, "w", encoding="utf-8") as f:
+                f.write("old\n" * 1000)
+            self.assertTrue(logutil.rotate_log(log_path, max_bytes=1024, backups=0))
+            self.assertEqual(os.path.getsize(log_path), 0)
+            with gzip.open(log_path + ".1.gz", "rt", encoding="utf-8") as f:
+                self.assertEqual(f.read(), "old\n" * 1000)  # Untouched
+        finally:
+            for path in (log_path, log_path + ".1.gz", log_path + ".2.gz"):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def test_json_log_format(self):
+        """Log records become JSON lines with fields; viewers render them back as text."""
+        import logging
+        record = logging.LogRecord("priceweb.worker", logging.INFO, __file__, 1, "Processed %d items...", (1000,), None)
+        record.fields = {"stage": "process", "processed": 1000}
+        entry = json.loads(logutil.JsonFormatter().format(record))
+        self.assertEqual(entry["src"], "worker")
+        self.assertEqual(entry["msg"], "Processed 1000 items...")
+        self.assertEqual(entry["stage"], "process")
+        self.assertEqual(entry["processed"], 1000)
+
+        line = json.dumps(entry) + "\n"
+        self.assertTrue(logutil.format_line(line).endswith("] Processed 1000 items...\n"))
+        self.assertEqual(logutil.format_line("[old] plain line\n"), "[old] plain line\n")
+
+        # The log file is resolved when the first record is written, not when the handler is made
+        handler = logutil._ConfigFileHandler()
+        log_path = os.path.join(self.metrics_dir, "late.log")
+        old_log_path = os.environ["PRICE_LOG_PATH"]
+        os.environ["PRICE_LOG_PATH"] = log_path
+        try:
+            handler.setFormatter(logutil.JsonFormatter())
+            handler.emit(record)
+            handler.close()
+            with open(log_path, encoding="utf-8") as f:
+                self.assertEqual(json.loads(f.read())["msg"], "Processed 1000 items...")
+        finally:
+            os.environ["PRICE_LOG_PATH"] = old_log_path
+
+    def test_worker_run_history(self):
+        """Stage timings recorded by the reporter are persisted and exposed via the API."""
+        app.config['TESTING'] = True
+        app.config['LOGIN_DISABLED'] = True
+        # Burn some CPU first: the run must not be charged for it
+        deadline = time.process_time() + 0.2
+        while time.process_time() < deadline:
+            pass
+        reporter = ProgressReporter(path="test_worker_status.json")
+        try:
+            reporter.stage("process")
+            reporter.update(processed=500, rates={"rates": {"USD": 90.0}, "source": "cache", "fetched_at": 1})
+            reporter.finish("done", inserted=500)
+            self.assertEqual(reporter.status["stages"]["process"]["items"], 500)
+            self.assertIn("cpu", reporter.status["stages"]["process"])
+            self.assertLess(reporter.status["cpu"], 0.2)
+
+            conn = db.get_connection()
+            db.record_worker_run(conn, reporter.status)
+            conn.commit()
+            conn.close()
+
+            with app.test_client() as client:
+                runs = client.get('/api/worker/runs?limit=1').get_json()['runs']
+            self.assertEqual(runs[0]['status'], 'done')
+            self.assertEqual(runs[0]['inserted'], 500)
+            self.assertIn('process', runs[0]['stages'])
+            self.assertEqual(runs[0]['rates']['rates']['USD'], 90.0)
+        finally:
+            if os.path.exists("test_worker_status.json"):
+                os.remove("test_worker_status.json")
+
+    def test_metrics_endpoint(self):
+        """/metrics merges the dumps of all processes (gunicorn workers) into one exposition."""
+        metrics_dir = self.metrics_dir
+        other_path = os.path.join(metrics_dir, "metrics_1.json")
+        try:
+            # Dump of another worker process
+            other = {"pid": 1, "ts": 0, "histograms": {}, "counters": {
+                "priceweb_http_requests_total": {json.dumps([["method", "GET"], ["route", "/health"], ["status", "200"]]): 5}}}
+            with open(other_path, "w") as f:
+                json.dump(other, f)
+
+            with app.test_client() as client:
+                client.get('/health')
+                resp = client.get('/metrics')
+            self.assertEqual(resp.status_code, 200)
+            text = resp.get_data(as_text=True)
+            self.assertIn('priceweb_http_requests_total{method="GET",route="/health",status="200"} 6', text)
+            self.assertIn('priceweb_http_request_duration_seconds_bucket{method="GET",route="/health",le="+Inf"}', text)
+            self.assertIn('priceweb_cache_hits_total{cache="reports"}', text)
+        finally:
+            os.remove(other_path)
+
+    def test_sql_profiler(self):
+        """Profiled connections aggregate statements by normalized shape for the admin endpoint."""
+        self.assertEqual(
+            sqlprofile.normalize("SELECT * FROM t WHERE a = 'x''y' AND b IN (1, 2,3)  LIMIT 20"),
+            "SELECT * FROM t WHERE a = ? AND b IN (?, ...) LIMIT ?")
+
+        conn = sqlite3.connect(self.test_db, factory=sqlprofile.ProfiledConnection)
+        conn.execute("SELECT COUNT(*) FROM items_latest WHERE sku = 'no-such-sku'").fetchone()
+        conn.close()
+
+        app.config['TESTING'] = True
+        app.config['LOGIN_DISABLED'] = True
+        with app.test_client() as client:
+            data = client.get('/api/admin/slow-queries?limit=200').get_json()
+        statements = {q["statement"]: q for q in data["queries"]}
+        self.assertIn("SELECT COUNT(*) FROM items_latest WHERE sku = ?", statements)
+        self.assertGreaterEqual(statements["SELECT COUNT(*) FROM items_latest WHERE sku = ?"]["count"], 1)
+
+    def test_catalog_generator_and_local_feed(self):
+        """Synthetic feeds are deterministic and file:// feeds are re-read only when they change."""
+        import gen_catalog
+        first = list(gen_catalog.iter_products(50, suppliers=3, churn=0.2, generation=1))
+        self.assertEqual(first, list(gen_catalog.iter_products(50, suppliers=3, churn=0.2, generation=1)))
+        self.assertNotEqual(first, list(gen_catalog.iter_products(50, suppliers=3, churn=0.2, generation=0)))
+
+        feed = "test_feed.json"
+        old_url, old_local = worker.JSON_URL, worker.LOCAL_DATA_FILE
+        worker.JSON_URL, worker.LOCAL_DATA_FILE = f"file://{os.path.abspath(feed)}", "test_feed_copy.json"
+        conn = db.get_connection()
+        try:
+            self.assertEqual(gen_catalog.write_feed(feed, iter(first)), len(first))
+            changed, etag, _ = worker.download_if_needed(conn)
+            self.assertTrue(changed)
+            db.set_meta_value(conn, 'last_etag', etag)
+            changed, etag2, _ = worker.download_if_needed(conn)
+            self.assertFalse(changed)
+            self.assertEqual(etag, etag2)
+            conn.rollback()
+        finally:
+            conn.close()
+            worker.JSON_URL, worker.LOCAL_DATA_FILE = old_url, old_local
+            for path in (feed, "test_feed_copy.json"):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def test_staged_ingest_apply(self):
+        """Diff written to the staging DB lands in the main tables (with FTS) in one apply step."""
+        rates = {"USD": 90.0, "EUR": 100.0, "RUB": 1.0}
+        staging_path = "test_priceweb.db.staging"
+        conn = db.get_connection()
+        conn.isolation_level = None
+        try:
+            stats = worker.StatsHelper()
+            stats.change_seq = db.get_change_seq(conn)
+            staging = db.open_staging(staging_path)
+            cur = staging.cursor()
+            worker.process_item_loop({'sku': 'STAGED-1', 'name': 'Staged widget', 'price': 10}, rates, 100, {}, cur, cur, stats)
+            staging.commit()
+            staging.close()
+            self.assertIsNone(conn.execute("SELECT 1 FROM items_latest WHERE sku = 'STAGED-1'").fetchone())
+
+            conn.execute("ATTACH DATABASE ? AS staging", (staging_path,))
+            conn.execute("BEGIN IMMEDIATE")
+            self.assertEqual(db.apply_staged_changes(conn, seq_offset=5), 1)
+            conn.execute("COMMIT")
+            conn.execute("DETACH DATABASE staging")
+
+            row = conn.execute("SELECT our_price, change_seq FROM items_latest WHERE sku = 'STAGED-1'").fetchone()
+            self.assertEqual(row['our_price'], 10)
+            self.assertEqual(row['change_seq'], stats.change_seq + 5)
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM item_snapshots WHERE sku = 'STAGED-1'").fetchone()[0], 1)
+            self.assertEqual(conn.execute("SELECT sku FROM items_search WHERE items_search MATCH 'widget'").fetchone()[0], 'STAGED-1')
+        finally:
+            db.delete_items(conn, ['STAGED-1'])
+            conn.close()
+            if os.path.exists(staging_path):
+                os.remove(staging_path)
+
+    def test_fts_name_aware_triggers(self):
+        """Price-only updates leave items_search alone; renames and deletes are keyed by rowid."""
+        conn = db.get_connection()
+        try:
+            conn.execute("INSERT INTO items_latest(sku, name, our_price) VALUES ('FTS-1', 'Alpha cartridge', 1)")
+            conn.commit()
+            fts_rowid = conn.execute("SELECT rowid FROM items_search WHERE items_search MATCH 'alpha'").fetchone()[0]
+            self.assertEqual(fts_rowid, conn.execute("SELECT rowid FROM items_latest WHERE sku = 'FTS-1'").fetchone()[0])
+
+            conn.execute("UPDATE items_latest SET our_price = 2, name = 'Alpha cartridge' WHERE sku = 'FTS-1'")
+            changes_before = conn.total_changes
+            conn.execute("UPDATE items_latest SET our_price = 3 WHERE sku = 'FTS-1'")
+            self.assertEqual(conn.total_changes - changes_before, 1)  # No trigger writes
+
+            conn.execute("UPDATE items_latest SET name = 'Beta toner' WHERE sku = 'FTS-1'")
+            self.assertIsNone(conn.execute("SELECT 1 FROM items_search WHERE items_search MATCH 'alpha'").fetchone())
+            self.assertEqual(conn.execute("SELECT sku FROM items_search WHERE items_search MATCH 'beta'").fetchone()[0], 'FTS-1')
+            self.assertTrue(db.search_index_in_sync(conn))
+        finally:
+            conn.execute("DELETE FROM items_latest WHERE sku = 'FTS-1'")
+            conn.commit()
+            self.assertIsNone(conn.execute("SELECT 1 FROM items_search WHERE items_search MATCH 'beta'").fetchone())
+            conn.close()
+
+    def test_exchange_rate_cache(self):
+        """Rates come from the meta cache within the TTL and fall back to the last known good ones."""
+        live = {"USD": 80.0, "EUR": 95.0, "RUB": 1.0}
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            if live is None:
+                raise ConnectionError("offline")
+            return dict(live)
+
+        old_fetch, old_fixed, old_ttl = worker.get_exchange_rates, worker.FIXED_RATES, worker.RATES_TTL
+        worker.get_exchange_rates, worker.FIXED_RATES = fetch, ""
+        try:
+            self.assertEqual(worker.resolve_exchange_rates()["source"], "api")
+            cached = worker.resolve_exchange_rates()
+            self.assertEqual((cached["source"], cached["rates"]["USD"], len(calls)), ("cache", 80.0, 1))
+
+            worker.RATES_TTL = 0
+            live = None
+            stale = worker.resolve_exchange_rates()
+            self.assertEqual((stale["source"], stale["rates"]["EUR"]), ("stale", 95.0))
+
+            conn = db.get_connection()
+            conn.execute("DELETE FROM meta WHERE k = 'exchange_rates'")
+            conn.commit()
+            conn.close()
+            with self.assertRaises(RuntimeError):
+                worker.resolve_exchange_rates()
+        finally:
+            worker.get_exchange_rates, worker.FIXED_RATES, worker.RATES_TTL = old_fetch, old_fixed, old_ttl
+            conn = db.get_connection()
+            conn.execute("DELETE FROM meta WHERE k = 'exchange_rates'")
+            conn.commit()
+            conn.close()
+
+    def test_reprice_items(self):
+        """SQL re-pricing gives the same row a fresh ingest at the new rates would store."""
+        product = {'sku': 'FX-1', 'name': 'Rate sensitive', 'price': 5000, 'suppliers': [
+            {'name': 'USD Supplier', 'product': {'price': 50, 'quantity': 3, 'currency': 'USD'}},
+            {'name': 'RUB Supplier', 'product': {'price': 4700, 'quantity': 1, 'currency': 'RUB'}},
+            {'name': 'Мой склад', 'product': {'price': 40, 'quantity': 2, 'currency': 'EUR'}},
+        ]}
+        old_rates = {"USD": 90.0, "EUR": 100.0, "RUB": 1.0}
+        new_rates = {"USD": 97.5, "EUR": 100.0, "RUB": 1.0}
+        conn = db.get_connection()
+        conn.isolation_level = None
+        try:
+            stats = worker.StatsHelper()
+            stats.change_seq = db.get_change_seq(conn)
+            cur = conn.cursor()
+            worker.process_item_loop(product, old_rates, 100, {}, cur, cur, stats)
+            self.assertEqual(conn.execute("SELECT min_sup_supplier FROM items_latest WHERE sku = 'FX-1'").fetchone()[0], 'USD Supplier')
+
+            conn.execute("BEGIN")
+            self.assertEqual(db.reprice_items(conn, new_rates, ["USD"], 200), 1)
+            conn.execute("COMMIT")
+
+            expected = worker.process_single_product(product, new_rates)
+            row = conn.execute("SELECT * FROM items_latest WHERE sku = 'FX-1'").fetchone()
+            self.assertEqual(row['min_sup_price'], expected['min_sup_price'])  # 4700 RUB now beats 50 USD
+            self.assertEqual(row['min_sup_supplier'], 'RUB Supplier')
+            self.assertEqual(row['my_sklad_price'], expected['my_sklad_price'])
+            self.assertEqual(row['suppliers_json'], json.dumps(expected['suppliers'], ensure_ascii=False))
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM item_snapshots WHERE sku = 'FX-1' AND ts = 200").fetchone()[0], 1)
+        finally:
+            db.delete_items(conn, ['FX-1'])
+            self.assertIsNone(conn.execute("SELECT 1 FROM item_supplier_prices WHERE sku = 'FX-1'").fetchone())
+            conn.close()
+
+    def test_worker_lock_coalesces_runs(self):
+        """flock keeps a second process out; triggers during a run collapse into one more run."""
+        old_paths = workerlock.LOCK_FILE, workerlock.RERUN_FILE
+        workerlock.LOCK_FILE = os.path.join(self.metrics_dir, "worker.lock")
+        workerlock.RERUN_FILE = workerlock.LOCK_FILE + ".rerun"
+        old_run_once = worker._run_once
+        runs = []
+
+        def fake_run_once(source=None):
+            runs.append(source)
+            if len(runs) == 1:
+                # Three triggers while the first run is in progress
+                for _ in range(3):
+                    workerlock.request_rerun("test")
+
+        try:
+            self.assertTrue(workerlock.acquire())
+            probe = subprocess.run(
+                [sys.executable, "-c", "import workerlock; print(workerlock.acquire(), workerlock.is_running())"],
+                env=dict(os.environ, PRICE_WORKER_LOCK=workerlock.LOCK_FILE), capture_output=True, text=True)
+            self.assertEqual(probe.stdout.split(), ["False", "True"])
+            workerlock.release()
+            self.assertFalse(workerlock.is_running())
+
+            worker._run_once = fake_run_once
+            worker.run()
+            self.assertEqual(runs, ["worker.py", "rerun"])
+            self.assertFalse(workerlock.rerun_pending())
+            self.assertFalse(workerlock.is_running())
+
+            app.config['TESTING'] = True
+            app.config['LOGIN_DISABLED'] = True
+            workerlock.write_heartbeat({"pid": 1, "state": "running", "stage": "process"})
+            with app.test_client() as client:
+                st = client.get('/api/worker/status').get_json()
+            self.assertFalse(st['running'])
+            self.assertEqual(st['heartbeat']['stage'], 'process')
+        finally:
+            worker._run_once = old_run_once
+            workerlock.release()
+            workerlock.LOCK_FILE, workerlock.RERUN_FILE = old_paths
+
+    def test_jobs_queue(self):
+        """Reload requests coalesce into one queued job; the drain consumer runs it and records the result."""
+        old_paths = workerlock.LOCK_FILE, workerlock.RERUN_FILE, workerlock.CONSUMER_LOCK_FILE
+        workerlock.LOCK_FILE = os.path.join(self.metrics_dir, "jobs_worker.lock")
+        workerlock.RERUN_FILE = workerlock.LOCK_FILE + ".rerun"
+        workerlock.CONSUMER_LOCK_FILE = workerlock.LOCK_FILE + ".consumer"
+        old_run_once = worker._run_once
+        runs = []
+
+        def fake_run_once(source=None):
+            runs.append(source)
+            return {"state": "done", "processed": 5, "inserted": 2, "changed": 1, "duration": 0.1}
+
+        conn = db.get_connection()
+        try:
+            first, coalesced = jobs.enqueue(conn, "reload", "test")
+            self.assertFalse(coalesced)
+            again, coalesced = jobs.enqueue(conn, "reload", "test")
+            self.assertEqual((again, coalesced), (first, True))
+            self.assertEqual(jobs.get(conn, first)["requests"], 2)
+
+            worker._run_once = fake_run_once
+            worker.serve(drain=True)
+            self.assertEqual(runs, ["test"])
+            job = jobs.get(conn, first)
+            self.assertEqual(job["status"], jobs.DONE)
+            self.assertEqual(job["result"]["inserted"], 2)
+            self.assertFalse(workerlock.consumer_running())
+
+            app.config['TESTING'] = True
+            app.config['LOGIN_DISABLED'] = True
+            with app.test_client() as client:
+                self.assertEqual(client.get(f'/api/jobs/{first}').get_json()['job']['status'], 'done')
+                self.assertIn(first, [j['id'] for j in client.get('/api/jobs').get_json()['jobs']])
+                self.assertEqual(client.get('/api/jobs/999999').status_code, 404)
+        finally:
+            worker._run_once = old_run_once
+            conn.execute("DELETE FROM jobs")
+            conn.commit()
+            conn.close()
+            workerlock.LOCK_FILE, workerlock.RERUN_FILE, workerlock.CONSUMER_LOCK_FILE = old_paths
+
+    def test_warm_index(self):
+        """The daemon reuses its items index only while change_seq matches; retries back off."""
+        conn = db.get_connection()
+        old_index = worker._warm_index
+        try:
+            seq = db.get_change_seq(conn)
+            index = {"WARM-1": ("cached",)}
+            worker._warm_index = (seq, index)
+            self.assertIs(worker._load_existing(conn)[1], index)
+            self.assertIsNone(worker._warm_index)  # Taken; a failed run leaves nothing stale behind
+            worker._warm_index = (seq - 1, index)
+            self.assertNotIn("WARM-1", worker._load_existing(conn)[1])
+        finally:
+            worker._warm_index = old_index
+            conn.close()
+        old = worker.SCHEDULE_INTERVAL, worker.RETRY_MIN
+        worker.SCHEDULE_INTERVAL, worker.RETRY_MIN = 3600, 60
+        try:
+            self.assertEqual([worker._retry_delay(n) for n in range(0, 8, 2)], [3600, 120, 480, 1920])
+            self.assertEqual(worker._retry_delay(10), 3600)
+        finally:
+            worker.SCHEDULE_INTERVAL, worker.RETRY_MIN = old
+
+    def test_adaptive_polling(self):
+        """A regular publish cadence is learned: sleep until the window, poll often in it, back off when late."""
+        day, hour = 86400, 3600
+        history = [1_700_000_000 + i * day + jitter for i, jitter in enumerate((0, 60, 0, -60, 0, 0))]
+        expected = history[-1] + day
+        self.assertEqual(feedpoll.next_delay(history[:2], expected, hour), hour)  # Too little history
+        self.assertEqual(feedpoll.next_delay(history, expected - 3 * day // 4, hour), feedpoll.POLL_MAX)
+        self.assertEqual(feedpoll.next_delay(history, expected - hour, hour), hour - feedpoll.POLL_MIN)
+        self.assertEqual(feedpoll.next_delay(history, expected, hour), feedpoll.POLL_MIN)
+        self.assertEqual(feedpoll.next_delay(history, expected + 3 * hour, hour), hour)
+        irregular = [1_700_000_000, 1_700_000_000 + hour, 1_700_000_000 + day, 1_700_000_000 + 3 * day]
+        self.assertEqual(feedpoll.next_delay(irregular, 1_700_000_000 + 3 * day + 600, hour), hour)
+
+        self.assertEqual(feedpoll.change_time("Tue, 14 Nov 2023 22:13:20 GMT", 1_800_000_000), 1_700_000_000)
+        self.assertEqual(feedpoll.change_time("garbage", 123), 123)
+        conn = db.get_connection()
+        try:
+            for ts in (5, 5, 3, 9):
+                feedpoll.record_change(conn, ts)
+            self.assertEqual(feedpoll.load_history(conn), [5, 9])
+        finally:
+            conn.execute("DELETE FROM meta WHERE k = ?", (feedpoll.HISTORY_KEY,))
+            conn.commit()
+            conn.close()
+
+    def test_notify_queue(self):
+        """send() only queues; the sender merges adjacent messages and waits out a 429."""
+        posts = []
+
+        class FakeResponse:
+            status_code = 200
+
+            def __init__(self, data):
+                self.data = data
+
+            def json(self):
+                return self.data
+
+        class FakeSession:
+            def post(self, url, json=None, timeout=None):
+                posts.append(json)
+                if json["text"] == "slow":
+                    raise notify.requests.ReadTimeout("read timed out")
+                if json["text"] == "unreachable" and len(posts) == 1:
+                    raise notify.requests.ConnectionError("connection refused")
+                if len(posts) == 1:
+                    return FakeResponse({"ok": False, "error_code": 429, "parameters": {"retry_after": 0}})
+                return FakeResponse({"ok": True})
+
+        old = notify._session, notify.MIN_INTERVAL
+        old_env = {k: os.environ.get(k) for k in ("TG_BOT_TOKEN", "TG_CHAT_ID", "TG_SILENT")}
+        notify._session, notify.MIN_INTERVAL = FakeSession(), 0
+        os.environ.update(TG_BOT_TOKEN="t", TG_CHAT_ID="1", TG_SILENT="0")
+        try:
+            self.assertEqual(notify.api_call("t", "sendMessage", {"text": "x"}), {"ok": True})
+            self.assertEqual(len(posts), 2)  # 429 with retry_after, then sent
+
+            del posts[:]
+            self.assertEqual(notify.api_call("t", "sendMessage", {"text": "unreachable"}, attempts=2), {"ok": True})
+            self.assertEqual(len(posts), 2)  # Connection error: nothing was sent, so it is retried
+            del posts[:]
+            self.assertFalse(notify.api_call("t", "sendMessage", {"text": "slow"})["ok"])
+            self.assertEqual(len(posts), 1)  # Read timeout: may have been delivered, not resent
+
+            msg = lambda text, **extra: ("t", "sendMessage", dict(chat_id="1", text=text, **extra), None)
+            merged = notify._coalesce([msg("a"), msg("b"), msg("c", reply_markup={}),
+                                       msg("d" * notify.MAX_MESSAGE_LEN), msg("e"),
+                                       ("t", "sendDocument", {"chat_id": "1"}, ("f", "f.csv.gz", False)), msg("g")])
+            self.assertEqual([p.get("text", "doc")[:4] for _, _, p, _ in merged], ["a\n\nb", "c", "dddd", "e", "doc", "g"])
+
+            notify.send("queued")
+            self.assertTrue(notify.flush(5))
+            self.assertEqual(posts[-1]["text"], "queued")
+        finally:
+            notify._session, notify.MIN_INTERVAL = old
+            for k, v in old_env.items():
+                if v is None:
+                    os.environ.pop(k, None)
+                else:
+                    os.environ[k] = v
+
+    def test_price_change_digest(self):
+        """Sharp changes are stored per run, paginated under the size limit by impact, and exported as .csv.gz."""
+        import gzip
+        ts = 1_700_000_000
+        conn = db.get_connection()
+        try:
+            for i in range(300):
+                conn.execute("INSERT INTO price_alerts (ts, sku, kind, old_price, new_price, diff_pct) VALUES (?, ?, ?, ?, ?, ?)",
+                             (ts, f"DIGEST-{i}", "our_price", 100.0, 140.0 + i, 40.0 + i))
+            conn.execute("INSERT INTO price_alerts (ts, sku, kind, old_price, new_price, diff_pct) VALUES (?, 'DIGEST-M', 'min_price', 100, 50, -50)",
+                         (ts,))
+            conn.commit()
+            self.assertEqual(db.count_price_alerts(conn, ts), {"our_price": 300, "min_price": 1})
+
+            rows = db.iter_price_alerts(conn, ts, "our_price")
+            pages = notify.build_digest("Header", (notify._price_change_line(r) for r in rows), 300,
+                                        more="and {n} more", max_messages=3)
+            self.assertEqual(len(pages), 3)
+            self.assertTrue(all(len(p) <= notify.MAX_MESSAGE_LEN for p in pages))
+            self.assertIn("(DIGEST-299)", pages[0].split("\n")[2])  # Largest change first
+            self.assertRegex(pages[-1], r"and \d+ more$")
+
+            path = os.path.join(self.metrics_dir, "alerts.csv.gz")
+            self.assertEqual(worker.write_price_alerts_csv(conn, ts, path), 301)
+            with gzip.open(path, "rt", encoding="utf-8-sig") as f:
+                lines = f.read().splitlines()
+            self.assertEqual(len(lines), 302)
+            self.assertTrue(lines[1].startswith("DIGEST-299;"))
+            self.assertTrue(lines[1].endswith(";100,0;439,0;339,0"))  # Decimal comma for ru-RU Excel
+
+            # The CSV holds both kinds: its caption counts them both, not just the digest's
+            sent, documents = [], []
+            old_send = notify.send, notify.send_document
+            notify.send = lambda text, **kw: sent.append(text)
+            notify.send_document = lambda path, filename, caption="", remove=False: documents.append(caption)
+            try:
+                notify.notify_price_changes(db.iter_price_alerts(conn, ts, "our_price"), 300, document=path,
+                                            document_total=301)
+            finally:
+                notify.send, notify.send_document = old_send
+            self.assertEqual(documents, ["Резкие изменения цен: 301 шт. (наша цена: 300, мин. цена поставщиков: 1)"])
+        finally:
+            conn.execute("DELETE FROM price_alerts WHERE ts = ?", (ts,))
+            conn.commit()
+            conn.close()
+
+        parts = notify.split_message("<pre>" + "\n".join("x" * 50 for _ in range(200)) + "</pre>", limit=1000)
+        self.assertGreater(len(parts), 1)
+        for part in parts:
+            self.assertLessEqual(len(part), 1000)
+            self.assertEqual(part.count("<pre>"), part.count("</pre>"))
+
+    def test_bulk_load(self):
+        """Bulk load restores the secondary indexes and FTS triggers and indexes every loaded item."""
+        feed = os.path.join(self.metrics_dir, "bulk_feed.json")
+        with open(feed, "w", encoding="utf-8") as f:
+            json.dump({"catalog": {"item": {"products": [
+                {"sku": f"BULK-{i}", "name": f"Bulk gizmo {i}", "price": 10 + i} for i in range(7)]}}}, f)
+        rates = {"USD": 90.0, "EUR": 100.0, "RUB": 1.0}
+        old_feed, old_batch = worker.LOCAL_DATA_FILE, worker.BULK_BATCH_SIZE
+        worker.LOCAL_DATA_FILE, worker.BULK_BATCH_SIZE = feed, 3  # Exercise full and partial batches
+        conn = db.get_connection()
+        conn.isolation_level = None
+        try:
+            stats = worker.StatsHelper()
+            progress = ProgressReporter(os.path.join(self.metrics_dir, "bulk_status.json"))
+            worker.ingest_bulk(conn, rates, 100, {}, stats, progress, None, None)
+            self.assertEqual(stats.inserted, 7)
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM items_search WHERE items_search MATCH 'gizmo'").fetchone()[0], 7)
+            self.assertTrue(db.search_index_in_sync(conn))
+            names = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('index', 'trigger')")}
+            self.assertTrue(set(db.SECONDARY_INDEXES) <= names)
+            self.assertTrue({'items_latest_ai', 'items_latest_ad', 'items_latest_au'} <= names)
+        finally:
+            worker.LOCAL_DATA_FILE, worker.BULK_BATCH_SIZE = old_feed, old_batch
+            db.delete_items(conn, [f"BULK-{i}" for i in range(7)])
+            conn.close()
+
 if __name__ == '__main__':
     unittest.main()
@@ -3,56 +3,165 @@ from dotenv import load_dotenv
 load_dotenv()
 import json
 import time
+import shutil
+import tempfile
 import requests
+from concurrent.futures import ThreadPoolExecutor
 import ijson
 import db
 import notify
+import reports
+import export
+from progress import ProgressReporter
 import config
+import logutil
+import workerlock
+import jobs
+import feedpoll
 
 JSON_URL = os.environ.get("PRICE_JSON_URL", "https://app.price-matrix.ru/WebApi/SummaryExportLatestGet/v2-202010181100-IWYHBWQFVQEMXNPVUNRAULOGYTDTUMMSUEPYBCIWMPYUMVYQLP")
 SNAPSHOT_RETENTION_DAYS = int(os.environ.get("SNAPSHOT_RETENTION_DAYS", "15"))
-LOCAL_DATA_FILE = "data/last_catalog_download.json"
+# "staging" (default): build the diff in a side DB and apply it in one short transaction;
+# "direct": process the feed inside one long write transaction on the main DB
+INGEST_MODE = os.environ.get("WORKER_INGEST_MODE", "staging")
+# Bulk load (triggers/secondary indexes off, batched inserts, indexes + FTS built at the end):
+# "auto" (default) when items_latest is empty, "1" for every run (e.g. after a schema rebuild), "0" never
+BULK_LOAD = os.environ.get("WORKER_BULK_LOAD", "auto")
+BULK_CACHE_MB = int(os.environ.get("WORKER_BULK_CACHE_MB", "256"))
+BULK_BATCH_SIZE = 5000
+# Relative change of our/min supplier price that makes it into the Telegram digest
+SHARP_CHANGE_PCT = 30.0
+# VACUUM only when at least this share of the file is free pages (it blocks the app while it runs)
+VACUUM_MIN_FREE_RATIO = float(os.environ.get("VACUUM_MIN_FREE_RATIO", "0.2"))
+LOCAL_DATA_FILE = os.environ.get("PRICE_LOCAL_DATA_FILE", "data/last_catalog_download.json")
+RATES_URL = os.environ.get("EXCHANGE_RATES_URL", "https://open.er-api.com/v6/latest/USD")
+# Cached rates in meta are reused for this long; past it they are only a fallback if the fetch fails
+RATES_TTL = int(os.environ.get("EXCHANGE_RATES_TTL_SECONDS", "21600"))
+# "USD=90,EUR=100": pin the rates (offline imports, benchmarks); never touches the network or the cache
+FIXED_RATES = os.environ.get("PRICE_FIXED_RATES", "")
+# Re-price stored RUB prices without a feed change once a rate moved at least this much (relative)
+REPRICE_MIN_CHANGE = float(os.environ.get("REPRICE_MIN_RATE_CHANGE", "0.005"))
+# How often `worker.py --daemon` looks for queued jobs (see jobs.py)
+JOB_POLL_INTERVAL = float(os.environ.get("WORKER_JOB_POLL_SECONDS", "1"))
+# `worker.py --daemon` polls the feed itself this often (0: only queued jobs); after a failed run
+# it retries after WORKER_RETRY_SECONDS, doubling per consecutive failure up to the interval
+SCHEDULE_INTERVAL = int(os.environ.get("WORKER_SCHEDULE_SECONDS", "3600"))
+# "1" (default): poll around the publish times learned from the feed history (feedpoll.py)
+# instead of every SCHEDULE_INTERVAL
+ADAPTIVE_POLLING = os.environ.get("WORKER_ADAPTIVE_POLLING", "1") == "1"
+# Job source of the daemon's own polls: on an unchanged feed they stay silent in Telegram
+SCHEDULE_SOURCE = "schedule"
+RETRY_MIN = int(os.environ.get("WORKER_RETRY_SECONDS", "60"))
 
-LOG_PATH = config.get_log_path()
 
-def log_with_timestamp(message):
-    """Print message with timestamp in Moscow timezone and write to log file."""
+logger = logutil.get_logger("worker")
+# Set by run(): log lines carry the current stage and elapsed run time
+_active_progress = None
+# Kept across runs of one process (the daemon): keep-alive connection for the conditional GETs,
+# schema already checked, and the items_latest index of the last successful run with the
+# change_seq it matches (_load_existing)
+_http = requests.Session()
+_schema_ready = False
+_keep_warm_index = False
+_warm_index = None
+
+def log_with_timestamp(message, **fields):
+    """Logs a message (JSON line in the log file) with the current stage and elapsed time."""
+    if _active_progress is not None:
+        fields.setdefault("stage", _active_progress.status.get("stage"))
+        fields.setdefault("elapsed", round(time.time() - _active_progress.started_at, 3))
+    logutil.log_event(logger, message, **fields)
+
+def get_exchange_rates():
+    """Fetches current exchange rates (USD, EUR -> RUB). Raises if the API has no usable RUB rate."""
+    resp = requests.get(RATES_URL, timeout=10)
+    resp.raise_for_status()
+    data = resp.json().get("rates", {})
+    usd_rub = float(data.get("RUB") or 0)
+    eur_usd = float(data.get("EUR") or 0)
+    if usd_rub <= 0 or eur_usd <= 0:
+        raise ValueError(f"Exchange rate API returned no USD/RUB or EUR/USD rate: {sorted(data)[:10]}")
+    # EUR through the USD cross rate
+    return {"USD": usd_rub, "EUR": usd_rub / eur_usd, "RUB": 1.0}
+
+def _parse_fixed_rates(spec):
+    rates = {"RUB": 1.0}
+    for part in spec.split(","):
+        code, _, value = part.partition("=")
+        rates[code.strip().upper()] = float(value)
+    return rates
+
+def load_cached_rates(conn):
+    """Last successfully fetched rates from meta: {"rates": {...}, "fetched_at": ts} or None."""
+    raw = db.get_meta_value(conn, 'exchange_rates')
+    if not raw:
+        return None
     try:
-        import pytz
-        from datetime import datetime
-        tz = pytz.timezone('Europe/Moscow')
-        timestamp = datetime.now(tz).strftime('%Y-%m-%d %H:%M:%S')
-    except (ImportError, KeyError):
-        # Fallback if pytz is not available
-        timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
-    
-    log_msg = f"[{timestamp}] {message}"
-    print(log_msg)
-    
+        cached = json.loads(raw)
+        return cached if cached.get("rates") else None
+    except (ValueError, AttributeError):
+        return None
+
+def resolve_exchange_rates():
+    """Rates for this run: fresh cache, else the API (result cached), else the last known good ones.
+
+    Returns {"rates", "source" (fixed/cache/api/stale), "fetched_at"}. There are no hardcoded
+    defaults: with neither the API nor a cached value the run fails rather than storing
+    prices converted at made-up rates. Uses its own connection (runs on the prefetch thread).
+    """
+    now = int(time.time())
+    if FIXED_RATES:
+        return {"rates": _parse_fixed_rates(FIXED_RATES), "source": "fixed", "fetched_at": now}
+
+    conn = db.get_connection()
     try:
-        with open(LOG_PATH, "a", encoding="utf-8") as f:
-            f.write(log_msg + "\n")
-    except Exception as e:
-        print(f"Failed to write to log file: {e}")
+        cached = load_cached_rates(conn)
+        if cached and now - cached.get("fetched_at", 0) < RATES_TTL:
+            return {"rates": cached["rates"], "source": "cache", "fetched_at": cached["fetched_at"]}
+        try:
+            rates = get_exchange_rates()
+        except Exception as e:
+            if not cached:
+                raise RuntimeError(f"Could not fetch exchange rates and none are cached: {e}") from e
+            age_h = (now - cached.get("fetched_at", 0)) / 3600
+            log_with_timestamp(f"Warning: Could not fetch exchange rates: {e}. "
+                               f"Using last known good rates from {age_h:.1f}h ago.", rates=cached["rates"])
+            return {"rates": cached["rates"], "source": "stale", "fetched_at": cached.get("fetched_at", 0)}
+        db.set_meta_value(conn, 'exchange_rates', json.dumps({"rates": rates, "fetched_at": now}))
+        conn.commit()
+        return {"rates": rates, "source": "api", "fetched_at": now}
+    finally:
+        conn.close()
 
-def get_exchange_rates():
-    """Fetches current exchange rates (USD, EUR -> RUB) with fallbacks."""
-    rates = {"USD": 92.0, "EUR": 100.0, "RUB": 1.0}
+def reprice_if_needed(conn, rates, ts):
+    """Re-converts stored prices (SQL, no feed parsing) for currencies whose rate moved by at
+    least REPRICE_MIN_CHANGE since the prices were computed. Returns the number of repriced items."""
     try:
-        # Using a reliable public API
-        resp = requests.get("https://open.er-api.com/v6/latest/USD", timeout=10)
-        if resp.ok:
-            data = resp.json()
-            usd_rub = data.get("rates", {}).get("RUB")
-            if usd_rub:
-                rates["USD"] = usd_rub
-                # Get EUR through USD cross rate
-                eur_usd = data.get("rates", {}).get("EUR")
-                if eur_usd:
-                    rates["EUR"] = usd_rub / eur_usd
-    except Exception as e:
-        log_with_timestamp(f"Warning: Could not fetch real-time exchange rates: {e}. Using default values.")
-    return rates
+        applied = json.loads(db.get_meta_value(conn, 'applied_rates') or "null")
+    except ValueError:
+        applied = None
+    if not applied:
+        return 0  # Baseline unknown until the next ingest records it
+    moved = sorted(c for c, rate in rates.items()
+                   if applied.get(c) and abs(rate / applied[c] - 1) >= REPRICE_MIN_CHANGE)
+    if not moved:
+        log_with_timestamp(f"Exchange rates within {REPRICE_MIN_CHANGE:.1%} of the applied ones, no re-pricing")
+        return 0
+
+    new_applied = dict(applied)
+    new_applied.update({c: rates[c] for c in moved})
+    changes = ", ".join(f"{c} {applied[c]:.4f} -> {rates[c]:.4f}" for c in moved)
+    log_with_timestamp(f"Re-pricing items for {changes}...")
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        repriced = db.reprice_items(conn, new_applied, moved, ts)
+        db.set_meta_value(conn, 'applied_rates', json.dumps(new_applied))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    log_with_timestamp(f"Re-priced {repriced} items ({changes})", repriced=repriced, currencies=moved)
+    return repriced
 
 def download_if_needed(conn):
     """Downloads the JSON file only if it has changed, using ETag/Last-Modified."""
@@ -64,10 +173,13 @@ def download_if_needed(conn):
     if mtime: headers['If-Modified-Since'] = mtime
     
     # Ensure dir exists
-    os.makedirs(os.path.dirname(LOCAL_DATA_FILE), exist_ok=True)
+    os.makedirs(os.path.dirname(LOCAL_DATA_FILE) or ".", exist_ok=True)
     
+    if JSON_URL.startswith("file://"):
+        return _copy_local_feed(JSON_URL[len("file://"):], etag)
+
     log_with_timestamp(f"Checking for updates from URL: {JSON_URL}")
-    with requests.get(JSON_URL, headers=headers, stream=True, timeout=300) as resp:
+    with _http.get(JSON_URL, headers=headers, stream=True, timeout=300) as resp:
         if resp.status_code == 304:
             log_with_timestamp("Server returned 304 Not Modified. Using cached file.")
             return False, etag, mtime
@@ -107,6 +219,24 @@ def download_if_needed(conn):
         log_with_timestamp(f"Download complete. Size: {os.path.getsize(LOCAL_DATA_FILE) / 1024 / 1024:.1f} MB")
         return True, new_etag, new_mtime
 
+def _copy_local_feed(src, etag):
+    """file:// feeds (benchmarks, manual imports): size+mtime act as the ETag."""
+    st = os.stat(src)
+    new_etag = f'"{st.st_size}-{st.st_mtime_ns}"'
+    if etag == new_etag and os.path.exists(LOCAL_DATA_FILE):
+        log_with_timestamp("Local feed unchanged. Using cached file.")
+        return False, etag, None
+    tmp_file = f"{LOCAL_DATA_FILE}.tmp.{os.getpid()}"
+    try:
+        shutil.copyfile(src, tmp_file)
+        os.replace(tmp_file, LOCAL_DATA_FILE)
+    except Exception:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+    log_with_timestamp(f"Copied local feed {src}. Size: {st.st_size / 1024 / 1024:.1f} MB")
+    return True, new_etag, None
+
 def process_single_product(p, rates):
     """Parses a single product dictionary and returns the item record with prices in RUB."""
     sku = str(p.get('sku', '')).strip()
@@ -162,7 +292,8 @@ def process_single_product(p, rates):
         sup_sku = s_prod.get('sku', '')
         sup_prod_name = s_prod.get('name', '')
         
-        if s_name.lower() == "мой склад":
+        own = db.is_own_supplier(s_name)
+        if own:
             my_sklad_price = price_rub
             my_sklad_qty = qty
             
@@ -176,7 +307,7 @@ def process_single_product(p, rates):
             "product_name": sup_prod_name
         })
         
-        if s_name.lower() != "мой склад" and price_rub > 0 and qty > 0:
+        if not own and price_rub > 0 and qty > 0:
             if min_p_rub is None or price_rub < min_p_rub:
                 min_p_rub = price_rub
                 min_q = qty
@@ -198,6 +329,7 @@ def process_single_product(p, rates):
 def rotate_snapshots(conn, now_ts):
     cutoff = now_ts - SNAPSHOT_RETENTION_DAYS * 86400
     conn.execute("DELETE FROM item_snapshots WHERE ts < ?", (cutoff,))
+    conn.execute("DELETE FROM price_alerts WHERE ts < ?", (cutoff,))
 
 def vacuum_db():
     # VACUUM must run on a clean connection without any open transactions.
@@ -208,7 +340,6 @@ def vacuum_db():
             
             # Simple check for disk space if possible
             try:
-                import shutil
                 total, used, free = shutil.disk_usage(os.path.dirname(os.path.abspath(db_path)) or ".")
                 if free < (db_size * 1.5):
                     log_with_timestamp(f"Skipping VACUUM: insufficient free space ({free/(1024*1024):.1f}MB free, need ~{db_size*1.5/(1024*1024):.1f}MB)")
@@ -216,16 +347,55 @@ def vacuum_db():
             except OSError:
                 pass
 
-        # Give a small moment for other connections to truly finalize
-        time.sleep(0.5)
         conn = db.get_connection()
-        conn.isolation_level = None  # Autocommit mode
-        log_with_timestamp("Reclaiming storage space (VACUUM)...")
-        conn.execute("VACUUM")
-        conn.close()
+        try:
+            free_ratio = db.get_free_page_ratio(conn)
+            if free_ratio < VACUUM_MIN_FREE_RATIO:
+                log_with_timestamp(f"Skipping VACUUM: only {free_ratio:.0%} of the file is free pages")
+                return
+            # Give a small moment for other connections to truly finalize
+            time.sleep(0.5)
+            conn.isolation_level = None  # Autocommit mode
+            log_with_timestamp(f"Reclaiming storage space (VACUUM, {free_ratio:.0%} free pages)...")
+            conn.execute("VACUUM")
+            if not db.search_index_in_sync(conn):
+                log_with_timestamp("VACUUM renumbered rowids; rebuilding search index...")
+                conn.execute("BEGIN")
+                db.rebuild_search_index(conn)
+                conn.execute("COMMIT")
+        finally:
+            conn.close()
     except Exception as e:
         log_with_timestamp(f"Warning: VACUUM failed: {e}")
 
+def warm_report_cache():
+    """Precomputes default-parameter reports so the first page view after a commit is instant."""
+    t_warm = time.time()
+    conn = db.get_connection()
+    try:
+        version = db.get_data_version(conn)
+        counts = reports.warm_reports(conn, version)
+        conn.commit()
+        log_with_timestamp(f"Reports warmed for version {version} in {time.time() - t_warm:.1f}s: {counts}")
+    except Exception as e:
+        # The web tier falls back to computing on demand
+        log_with_timestamp(f"Warning: report warm-up failed: {e}")
+    finally:
+        conn.close()
+
+def save_run_history(progress):
+    """Persists the finished run (status, counters, per-stage timings) to worker_runs."""
+    log_with_timestamp(f"Stage timings: {progress.stage_summary()}", stages=progress.status["stages"])
+    try:
+        conn = db.get_connection()
+        try:
+            db.record_worker_run(conn, progress.status)
+            conn.commit()
+        finally:
+            conn.close()
+    except Exception as e:
+        log_with_timestamp(f"Warning: could not save run history: {e}")
+
 class StatsHelper:
     def __init__(self):
         self.total_count = 0
@@ -233,13 +403,40 @@ class StatsHelper:
         self.changed = 0
         self.snap_added = 0
         self.new_item_names = []
-        self.sharp_changes = []
+        # Sharp changes written to price_alerts in this run, by kind
+        self.sharp_changes = {"our_price": 0, "min_price": 0}
         self.seen_skus = set()
+        # Last change_seq handed out; set from meta at the start of the transaction
+        self.change_seq = 0
+        # Optional ProgressReporter for live progress (/api/jobs/<id>)
+        self.progress = None
+
+    def next_seq(self):
+        self.change_seq += 1
+        return self.change_seq
+
+ITEM_UPSERT_SQL = f"""
+    INSERT INTO items_latest ({", ".join(db.ITEM_COLUMNS)})
+    VALUES ({", ".join("?" * len(db.ITEM_COLUMNS))})
+    ON CONFLICT(sku) DO UPDATE SET
+    {", ".join(f"{c}=excluded.{c}" for c in db.ITEM_COLUMNS if c not in ("sku", "created_at"))}
+"""
+PRICE_ALERT_INSERT_SQL = f"""
+    INSERT INTO price_alerts ({", ".join(db.PRICE_ALERT_COLUMNS)})
+    VALUES ({", ".join("?" * len(db.PRICE_ALERT_COLUMNS))})
+"""
+SUPPLIER_PRICE_INSERT_SQL = f"""
+    INSERT OR REPLACE INTO item_supplier_prices ({", ".join(db.SUPPLIER_PRICE_COLUMNS)})
+    VALUES ({", ".join("?" * len(db.SUPPLIER_PRICE_COLUMNS))})
+"""
 
 def process_item_loop(p, rates, ts, existing, cur_upsert, cur_snap, stats):
     stats.total_count += 1
     if stats.total_count % 1000 == 0:
-        log_with_timestamp(f"Processed {stats.total_count} items...")
+        log_with_timestamp(f"Processed {stats.total_count} items...", processed=stats.total_count,
+                           inserted=stats.inserted, changed=stats.changed)
+        if stats.progress:
+            stats.progress.update(processed=stats.total_count, message=f"Processed {stats.total_count} items...")
 
     it = process_single_product(p, rates)
     if not it:
@@ -262,6 +459,8 @@ def process_item_loop(p, rates, ts, existing, cur_upsert, cur_snap, stats):
     is_changed = (prev[:9] != curr_vals) if not is_new else True
     
     if is_new or is_changed:
+        # Same shape as db.load_existing_latest, so the daemon can diff the next run against it
+        existing[sku] = curr_vals + (ts if is_new else prev[9],)
         cur_snap.execute("""
             INSERT INTO item_snapshots 
             (sku, ts, our_price, our_qty, my_sklad_price, my_sklad_qty, 
@@ -274,138 +473,411 @@ def process_item_loop(p, rates, ts, existing, cur_upsert, cur_snap, stats):
             it['min_sup_price'], it['min_sup_qty'], it['min_sup_supplier']
         ))
         stats.snap_added += 1
-    
+
+        # One upsert for both cases: works against the main DB (direct mode) and the empty
+        # staging DB alike; ON CONFLICT DO UPDATE (not REPLACE) keeps created_at and fires the UPDATE trigger
+        cur_upsert.execute(ITEM_UPSERT_SQL, (
+            sku, it['name'], it['our_price'], it['our_qty'],
+            it['my_sklad_price'], it['my_sklad_qty'],
+            it['min_sup_price'], it['min_sup_qty'], it['min_sup_supplier'],
+            supp_json, ts, ts, stats.next_seq()))
+        # Original prices/currencies for SQL re-pricing when only the exchange rates move.
+        # Rows are replaced by (sku, pos) and only the surplus is deleted, so the two statements
+        # touch disjoint rows and BatchWriter may run them in any order
+        cur_upsert.executemany(SUPPLIER_PRICE_INSERT_SQL, db.supplier_price_rows(sku, it['suppliers']))
+        if not is_new:
+            cur_upsert.execute("DELETE FROM item_supplier_prices WHERE sku = ? AND pos >= ?",
+                               (sku, len(it['suppliers'])))
+
     if is_new:
-        cur_upsert.execute("""
-            INSERT INTO items_latest 
-            (sku, name, our_price, our_qty, my_sklad_price, my_sklad_qty,
-             min_sup_price, min_sup_qty, min_sup_supplier, suppliers_json, updated_at, created_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (sku, it['name'], it['our_price'], it['our_qty'],
-              it['my_sklad_price'], it['my_sklad_qty'],
-              it['min_sup_price'], it['min_sup_qty'], it['min_sup_supplier'],
-              supp_json, ts, ts))
+        # A SKU that was deleted earlier and came back is no longer a tombstone
+        cur_upsert.execute("DELETE FROM item_tombstones WHERE sku = ?", (sku,))
         stats.inserted += 1
         if len(stats.new_item_names) < 10:
             stats.new_item_names.append(it['name'])
     elif is_changed:
-        cur_upsert.execute("""
-            UPDATE items_latest SET
-            name=?, our_price=?, our_qty=?, 
-            my_sklad_price=?, my_sklad_qty=?,
-            min_sup_price=?, min_sup_qty=?, min_sup_supplier=?,
-            suppliers_json=?, updated_at=?
-            WHERE sku=?
-        """, (it['name'], it['our_price'], it['our_qty'],
-              it['my_sklad_price'], it['my_sklad_qty'],
-              it['min_sup_price'], it['min_sup_qty'], it['min_sup_supplier'],
-              supp_json, ts, sku))
         stats.changed += 1
-        
-        # Check for sharp price changes (only if not new)
+        # Sharp price changes go to price_alerts (digest + CSV after the run, see send_price_alerts)
+        # prev: (name, suppliers_json, our_price, our_qty, my_sklad_price, my_sklad_qty, min_sup_price, ...)
+        for kind, old, new in (("min_price", prev[6], it['min_sup_price']), ("our_price", prev[2], it['our_price'])):
+            try:
+                old, new = float(old or 0), float(new or 0)
+            except (TypeError, ValueError):
+                continue
+            if old > 0 and new > 0:
+                diff_pct = (new - old) / old * 100.0
+                if abs(diff_pct) >= SHARP_CHANGE_PCT:
+                    cur_snap.execute(PRICE_ALERT_INSERT_SQL, (ts, sku, kind, old, new, diff_pct))
+                    stats.sharp_changes[kind] += 1
+
+PRICE_ALERT_CSV_COLUMNS = ("SKU", "Название", "Цена", "Было", "Стало", "Изменение, %")
+PRICE_ALERT_KINDS = {"our_price": "Наша цена", "min_price": "Мин. цена поставщика"}
+
+def write_price_alerts_csv(conn, ts, path):
+    """Streams the run's sharp changes (all kinds, largest first) into a gzip'ed CSV; returns the row count."""
+    count = 0
+    def rows():
+        nonlocal count
+        for r in db.iter_price_alerts(conn, ts):
+            count += 1
+            yield (r["sku"], r["name"], PRICE_ALERT_KINDS.get(r["kind"], r["kind"]),
+                   r["old_price"], r["new_price"], round(r["diff_pct"], 1))
+    with open(path, "wb") as f:
+        for chunk in export.iter_gzip(export.iter_csv(PRICE_ALERT_CSV_COLUMNS, rows())):
+            f.write(chunk)
+    return count
+
+def send_price_alerts(ts, total):
+    """Telegram digest of the run's sharp 'our price' changes plus the full list (all kinds) as .csv.gz."""
+    try:
+        conn = db.get_connection()
         try:
-            # Check min_sup_price
-            # existing tuple: (name, suppliers_json, our_price, our_qty, my_sklad_price, my_sklad_qty, min_sup_price, min_sup_qty, min_sup_supplier)
-            # indices:         0     1               2          3        4               5             6              7            8
-            
-            old_min = float(prev[6] if prev[6] is not None else 0) 
-            new_min = float(it['min_sup_price'] if it['min_sup_price'] is not None else 0)
-            
-            if old_min > 0 and new_min > 0:
-                diff_pct = (new_min - old_min) / old_min * 100.0
-                if abs(diff_pct) >= 30.0:
-                    stats.sharp_changes.append({
-                        "name": it['name'],
-                        "sku": sku,
-                        "old_price": old_min,
-                        "new_price": new_min,
-                        "diff_pct": diff_pct,
-                        "type": "min_price"
-                    })
-                    
-            # Check our_price
-            old_our = float(prev[2] if prev[2] is not None else 0)
-            new_our = float(it['our_price'] if it['our_price'] is not None else 0)
-            
-            if old_our > 0 and new_our > 0:
-                 diff_pct_our = (new_our - old_our) / old_our * 100.0
-                 if abs(diff_pct_our) >= 30.0:
-                      # Avoid duplicates if min_price already added? No, track separately if needed.
-                      # But let's prioritize min_price if both changed, or just add both.
-                      # Actually, let's just add it if it wasn't already added for min_price
-                      # or better, just treat them as separate events if needed.
-                      # For simplicity and to avoid spam, we'll just add it to the list.
-                      stats.sharp_changes.append({
-                        "name": it['name'],
-                        "sku": sku,
-                        "old_price": old_our,
-                        "new_price": new_our,
-                        "diff_pct": diff_pct_our,
-                        "type": "our_price"
-                    })
-        except Exception as e:
-            # Don't fail the worker for this
-            pass
-WORKER_LOCK_FILE = "data/worker.lock"
-
-def acquire_lock():
-    """Acquire a file lock to prevent concurrent worker runs."""
-    lock_dir = os.path.dirname(WORKER_LOCK_FILE)
-    if lock_dir and not os.path.exists(lock_dir):
-        os.makedirs(lock_dir, exist_ok=True)
-    
-    # Check if lock file exists and is recent (within 30 minutes)
-    if os.path.exists(WORKER_LOCK_FILE):
+            fd, path = tempfile.mkstemp(prefix="price_changes_", suffix=".csv.gz")
+            os.close(fd)
+            document_total = write_price_alerts_csv(conn, ts, path)
+            notify.notify_price_changes(db.iter_price_alerts(conn, ts, "our_price"), total, document=path,
+                                        filename=f"price_changes_{time.strftime('%Y%m%d_%H%M', time.localtime(ts))}.csv.gz",
+                                        document_total=document_total)
+        finally:
+            conn.close()
+    except Exception as e:
+        log_with_timestamp(f"Failed to send price change digest: {e}")
+
+def _load_existing(conn):
+    """Returns (change_seq, items_latest index) to diff the feed against.
+
+    The daemon reuses the index left by its previous run (updated in place by process_item_loop)
+    as long as change_seq shows that nobody else (deletions, re-pricing) touched the items since.
+    """
+    global _warm_index
+    seq = db.get_change_seq(conn)
+    cached, _warm_index = _warm_index, None
+    if cached is not None and cached[0] == seq:
+        log_with_timestamp(f"Reusing the in-memory index of {len(cached[1])} items.")
+        return seq, cached[1]
+    log_with_timestamp("Loading existing data for comparison...")
+    return seq, db.load_existing_latest(conn)
+
+def _process_feed(rates, ts, existing, cur_upsert, cur_snap, stats):
+    log_with_timestamp(f"Processing items from {LOCAL_DATA_FILE}...")
+    if not os.path.exists(LOCAL_DATA_FILE):
+        raise FileNotFoundError(f"Local data file {LOCAL_DATA_FILE} missing after download attempt.")
+    with open(LOCAL_DATA_FILE, 'rb') as f:
+        for p in ijson.items(f, 'catalog.item.products.item'):
+            process_item_loop(p, rates, ts, existing, cur_upsert, cur_snap, stats)
+    if stats.progress:
+        stats.progress.update(processed=stats.total_count)
+
+def _write_run_meta(conn, ts, change_seq, new_etag, new_mtime, rates):
+    log_with_timestamp("Updating meta...")
+    db.set_meta_value(conn, 'last_reload_ts', str(ts))
+    # Rates the stored RUB prices are converted at (baseline for reprice_if_needed)
+    db.set_meta_value(conn, 'applied_rates', json.dumps(rates))
+    db.set_meta_value(conn, 'change_seq', str(change_seq))
+    if new_etag: db.set_meta_value(conn, 'last_etag', new_etag)
+    if new_mtime: db.set_meta_value(conn, 'last_modified', new_mtime)
+    # Store that we processed this specific version successfully
+    if new_etag: db.set_meta_value(conn, 'proc_etag', new_etag)
+    if new_mtime: db.set_meta_value(conn, 'proc_mtime', new_mtime)
+
+def ingest_direct(conn, rates, ts, existing, stats, progress, new_etag, new_mtime):
+    """Legacy mode: the whole feed is processed inside one write transaction on the main DB."""
+    log_with_timestamp("Starting transaction...")
+    conn.execute("BEGIN TRANSACTION")
+    stats.change_seq = db.get_change_seq(conn)
+    cur_upsert = conn.cursor()
+    cur_snap = conn.cursor()
+
+    progress.stage("process", "Processing items...")
+    _process_feed(rates, ts, existing, cur_upsert, cur_snap, stats)
+
+    progress.stage("rotate", "Rotating snapshots...")
+    log_with_timestamp("Rotating snapshots...")
+    rotate_snapshots(conn, ts)
+    _write_run_meta(conn, ts, stats.change_seq, new_etag, new_mtime, rates)
+
+    progress.stage("commit", "Committing transaction...")
+    log_with_timestamp("Committing transaction...")
+    conn.execute("COMMIT")
+    cur_upsert.close()
+    cur_snap.close()
+
+def ingest_staged(conn, rates, ts, existing, stats, progress, new_etag, new_mtime):
+    """Default mode: the diff against `existing` is written to a scratch DB without touching the
+    main one, then applied in a single short transaction. Readers and other writers only ever
+    wait for the apply step, and a failed run leaves nothing behind in the main DB."""
+    staging_path = db.get_staging_path()
+    start_seq = db.get_change_seq(conn)
+    stats.change_seq = start_seq
+
+    progress.stage("process", "Processing items (staging)...")
+    staging = db.open_staging(staging_path)
+    try:
+        staging.execute("BEGIN")
+        cur = staging.cursor()
+        _process_feed(rates, ts, existing, cur, cur, stats)
+        staging.execute("COMMIT")
+        cur.close()
+    finally:
+        staging.close()
+
+    progress.stage("apply", "Applying changes...")
+    log_with_timestamp(f"Applying {stats.inserted} new / {stats.changed} changed items from staging...")
+    conn.execute("ATTACH DATABASE ? AS staging", (staging_path,))
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Sequence numbers handed out by others (e.g. deletions from the bot) while we were parsing
+            seq_offset = db.get_change_seq(conn) - start_seq
+            db.apply_staged_changes(conn, seq_offset)
+            rotate_snapshots(conn, ts)
+            _write_run_meta(conn, ts, stats.change_seq + seq_offset, new_etag, new_mtime, rates)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.execute("DETACH DATABASE staging")
+        for suffix in ("", "-journal"):
+            if os.path.exists(staging_path + suffix):
+                os.remove(staging_path + suffix)
+
+class BatchWriter:
+    """Cursor stand-in for process_item_loop: buffers execute() calls per statement
+    and sends them with executemany() every `batch_size` rows."""
+
+    def __init__(self, conn, batch_size=None):
+        self.conn = conn
+        self.batch_size = batch_size or BULK_BATCH_SIZE
+        self.pending = {}
+
+    def execute(self, sql, params=()):
+        rows = self.pending.setdefault(sql, [])
+        rows.append(params)
+        if len(rows) >= self.batch_size:
+            self.flush()
+
+    def executemany(self, sql, seq_of_params):
+        rows = self.pending.setdefault(sql, [])
+        rows.extend(seq_of_params)
+        if len(rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        for sql, rows in self.pending.items():
+            if rows:
+                self.conn.executemany(sql, rows)
+                rows.clear()
+
+def ingest_bulk(conn, rates, ts, existing, stats, progress, new_etag, new_mtime):
+    """First import / rebuild: one transaction with the FTS triggers and secondary indexes dropped,
+    batched inserts, then indexes and items_search built in one pass each. A failure rolls back
+    the DDL too, so the schema is never left without its indexes."""
+    timings = {}
+    # synchronous=OFF only for this transaction; the checkpoint below syncs it under NORMAL
+    conn.execute(f"PRAGMA cache_size=-{BULK_CACHE_MB * 1024}")
+    conn.execute("PRAGMA synchronous=OFF")
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            stats.change_seq = db.get_change_seq(conn)
+            db.drop_search_triggers(conn)
+            db.drop_secondary_indexes(conn)
+
+            progress.stage("bulk_load", "Bulk loading items...")
+            t = time.perf_counter()
+            writer = BatchWriter(conn)
+            _process_feed(rates, ts, existing, writer, writer, stats)
+            writer.flush()
+            timings["load_s"] = time.perf_counter() - t
+
+            progress.stage("bulk_indexes", "Building indexes...")
+            log_with_timestamp("Building indexes...")
+            t = time.perf_counter()
+            db.create_secondary_indexes(conn)
+            timings["indexes_s"] = time.perf_counter() - t
+
+            progress.stage("bulk_fts", "Building search index...")
+            log_with_timestamp("Building search index...")
+            t = time.perf_counter()
+            db.rebuild_search_index(conn)
+            db.create_search_triggers(conn)
+            timings["fts_s"] = time.perf_counter() - t
+
+            rotate_snapshots(conn, ts)
+            _write_run_meta(conn, ts, stats.change_seq, new_etag, new_mtime, rates)
+
+            progress.stage("commit", "Committing transaction...")
+            t = time.perf_counter()
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA cache_size=-2000")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    timings["commit_s"] = time.perf_counter() - t
+    timings = {k: round(v, 2) for k, v in timings.items()}
+    log_with_timestamp(
+        f"Bulk load of {stats.total_count} items: load {timings['load_s']}s, indexes {timings['indexes_s']}s, "
+        f"FTS {timings['fts_s']}s, commit {timings['commit_s']}s", **timings)
+
+def run(wait=False, source="worker.py"):
+    """Runs the worker unless one is already running, in which case one more run is queued.
+
+    Triggers that arrive while a run is in progress (schedule, /api/reload, the bot) collapse into
+    a single follow-up run, started as soon as the current one finishes. With wait=True (job
+    consumer) a busy lock is waited for instead. `source` is who asked for the first run (see
+    _run_once). Returns the status of the first run, None if the run was only queued.
+    """
+    first = None
+    while True:
+        if not workerlock.acquire():
+            if wait:
+                time.sleep(JOB_POLL_INTERVAL)
+                continue
+            workerlock.request_rerun("worker.py")
+            log_with_timestamp("Worker is already running; queued one more run after it.")
+            return first
         try:
-            mtime = os.path.getmtime(WORKER_LOCK_FILE)
-            if time.time() - mtime < 1800:  # 30 minutes
-                log_with_timestamp("Worker is already running (lock file exists). Exiting.")
-                return False
+            while True:
+                # Requests made before this run started are served by it
+                workerlock.take_rerun_request()
+                status = _run_once(source)
+                if first is None:
+                    first = status
+                # Follow-up runs were asked for by someone waiting on a result
+                source = "rerun"
+                if not workerlock.rerun_pending():
+                    break
+                log_with_timestamp("Run requested while working; starting one more.")
+        finally:
+            workerlock.release()
+        # A request that came in between the last check and the release
+        if not workerlock.rerun_pending():
+            return first
+
+def _job_result(status):
+    if not status:
+        return None
+    return {k: status.get(k) for k in ("state", "processed", "inserted", "changed", "duration", "message")}
+
+def _retry_delay(failures):
+    if not failures:
+        return SCHEDULE_INTERVAL
+    delay = RETRY_MIN * 2 ** (failures - 1)
+    return min(delay, SCHEDULE_INTERVAL) if SCHEDULE_INTERVAL else delay
+
+def serve(drain=False):
+    """Consumes the jobs queue: forever (`--daemon`, the systemd service) or until it is empty (`--drain`).
+
+    The web app only enqueues a job; the daemon, already started and with its imports done,
+    picks it up within JOB_POLL_INTERVAL. Without a daemon the app starts a `--drain` process.
+    The daemon also does the polling of the removed priceweb-worker.timer: it queues a run every
+    SCHEDULE_INTERVAL, or around the expected publish times once feedpoll has learned them (a 304
+    from the feed is one request), backs off after failures, and keeps the items index in memory
+    between runs.
+    """
+    global _keep_warm_index, _schema_ready
+    if not workerlock.acquire_consumer():
+        log_with_timestamp("Another process consumes the jobs queue; exiting.")
+        return
+    _keep_warm_index = not drain
+    db.ensure_schema()
+    _schema_ready = True
+    conn = db.get_connection()
+    try:
+        orphaned = jobs.fail_orphaned(conn)
+        if orphaned:
+            log_with_timestamp(f"Marked {orphaned} job(s) left running by a dead consumer as failed.")
+        failures = 0
+        next_run = time.time()  # First feed check right after start
+        while True:
+            job = jobs.claim_next(conn)
+            if job is None:
+                if not drain:
+                    if SCHEDULE_INTERVAL and time.time() >= next_run:
+                        jobs.enqueue(conn, "reload", SCHEDULE_SOURCE)
+                        continue
+                    time.sleep(JOB_POLL_INTERVAL)
+                    continue
+                workerlock.release_consumer()
+                # A job enqueued just before the release saw a consumer and started none
+                if not jobs.pending(conn) or not workerlock.acquire_consumer():
+                    return
+                continue
+            log_with_timestamp(f"Job {job['id']} ({job['kind']}, {job['requests']} request(s)) started.",
+                               job_id=job["id"], source=job["source"])
+            try:
+                status = run(wait=True, source=job["source"])
+            except Exception as e:
+                jobs.finish(conn, job["id"], jobs.FAILED, error=str(e))
+                failures += 1
             else:
-                # Lock is stale, remove it
-                os.remove(WORKER_LOCK_FILE)
-        except OSError:
-            pass
-    
-    # Create lock file
+                jobs.finish(conn, job["id"], jobs.DONE, result=_job_result(status))
+                failures = 0
+            jobs.prune(conn)
+            # Any finished run, scheduled or not, is a fresh feed check
+            now = time.time()
+            if failures:
+                delay = _retry_delay(failures)
+                log_with_timestamp(f"Run failed ({failures} in a row); next attempt in {delay}s.")
+            elif ADAPTIVE_POLLING and SCHEDULE_INTERVAL:
+                delay = feedpoll.next_delay(feedpoll.load_history(conn), now, SCHEDULE_INTERVAL)
+            else:
+                delay = SCHEDULE_INTERVAL
+            next_run = now + delay
+            if SCHEDULE_INTERVAL:
+                db.set_meta_value(conn, feedpoll.NEXT_POLL_KEY, str(int(next_run)))
+                conn.commit()
+    finally:
+        conn.close()
+        workerlock.release_consumer()
+
+def _heartbeat_payload(progress):
+    st = progress.status
+    return {"pid": st.get("pid"), "host": st.get("host"), "state": st.get("state"), "stage": st.get("stage"),
+            "processed": st.get("processed", 0), "started_at": st.get("started_at")}
+
+def _run_once(source="worker.py"):
     try:
-        with open(WORKER_LOCK_FILE, 'w') as f:
-            f.write(str(os.getpid()))
-        return True
+        log_path = config.get_log_path()
+        if logutil.rotate_log(log_path):
+            log_with_timestamp(f"Log rotated: previous content compressed to {log_path}.1.gz")
     except OSError as e:
-        log_with_timestamp(f"Could not create lock file: {e}")
-        return False
+        log_with_timestamp(f"Warning: log rotation failed: {e}")
 
-def release_lock():
-    """Release the file lock."""
-    try:
-        if os.path.exists(WORKER_LOCK_FILE):
-            os.remove(WORKER_LOCK_FILE)
-    except OSError:
-        pass
-
-def run():
-    # Check for concurrent worker run
-    if not acquire_lock():
-        return
-    
+    global _active_progress, _schema_ready, _warm_index
+    progress = ProgressReporter()
+    _active_progress = progress
+    heartbeat = workerlock.Heartbeat(lambda: _heartbeat_payload(progress)).start()
     try:
         host = os.uname().nodename
-        notify.notify_start(host)
+        progress.update(host=host)
         t0 = time.time()
-        
-        rates = get_exchange_rates()
-        log_with_timestamp(f"Current Rates: {rates}")
+        quiet = source == SCHEDULE_SOURCE
+        if not quiet:
+            notify.notify_start(host)
         
         stats_helper = StatsHelper()
+        stats_helper.progress = progress
         ts = int(time.time())
 
-        db.ensure_schema()
+        if not _schema_ready:
+            db.ensure_schema()
+            _schema_ready = True
+        # Rates are fetched (or taken from the meta cache) while the feed downloads
+        rates_pool = ThreadPoolExecutor(max_workers=1)
+        rates_future = rates_pool.submit(resolve_exchange_rates)
         conn = db.get_connection()
         conn.isolation_level = None # Autocommit mode for explicit transactions
         try:
             # Step 1: Download
+            progress.stage("download", "Checking for feed updates...")
             changed, new_etag, new_mtime = download_if_needed(conn)
+            if changed:
+                feedpoll.record_change(conn, feedpoll.change_time(new_mtime, ts))
             
             # Check if we even need to process
             last_processed_etag = db.get_meta_value(conn, 'proc_etag')
@@ -413,63 +885,71 @@ def run():
             
             if not changed and last_processed_etag == new_etag and last_processed_mtime == new_mtime:
                 log_with_timestamp("File is identical and was already processed successfully. Skipping loop.")
-                
-                # Still prepare stats for notification
-                final_stats = {"total": 0, "status": "skipped (no changes)", "duration": time.time() - t0}
+
+                # The feed did not change, but the exchange rates may have
+                repriced = 0
                 try:
-                    db_st = db.get_db_status()
-                    final_stats["items_db"] = db_st.get("items_db", 0)
-                    db_path = db_st.get("db_path", "priceweb.db")
-                    if os.path.exists(db_path):
-                        final_stats["db_size_mb"] = os.path.getsize(db_path) / (1024 * 1024)
-                except (OSError, KeyError):
-                    pass
+                    rates_info = rates_future.result()
+                except Exception as e:
+                    log_with_timestamp(f"Warning: no exchange rates, skipping re-pricing: {e}")
+                else:
+                    progress.update(rates=rates_info)
+                    progress.stage("reprice", "Re-pricing for new exchange rates...")
+                    repriced = reprice_if_needed(conn, rates_info["rates"], ts)
+                    if repriced:
+                        progress.stage("warm_reports", "Precomputing default reports...")
+                        warm_report_cache()
                 
-                notify.notify_success(final_stats)
-                return
+                progress.finish("skipped", changed=repriced,
+                                message=f"No changes in feed, {repriced} items re-priced" if repriced else "No changes in feed")
+                save_run_history(progress)
+                # An unchanged feed is the common case of a scheduled poll: Telegram only hears
+                # about it when something was re-priced. Manual runs always get their report.
+                if repriced or not quiet:
+                    final_stats = {"total": 0, "status": "skipped (no changes)", "duration": time.time() - t0,
+                                   "changed": repriced}
+                    try:
+                        db_st = db.get_db_status()
+                        final_stats["items_db"] = db_st.get("items_db", 0)
+                        db_path = db_st.get("db_path", "priceweb.db")
+                        if os.path.exists(db_path):
+                            final_stats["db_size_mb"] = os.path.getsize(db_path) / (1024 * 1024)
+                    except (OSError, KeyError):
+                        pass
+                    final_stats["stages"] = progress.status["stages"]
+                    notify.notify_success(final_stats)
+                return progress.status
 
-            log_with_timestamp("Loading existing data for comparison...")
-            existing = db.load_existing_latest(conn)
-            
-            log_with_timestamp("Starting transaction...")
-            conn.execute("BEGIN TRANSACTION")
-            cur_upsert = conn.cursor()
-            cur_snap = conn.cursor()
-
-            log_with_timestamp(f"Processing items from {LOCAL_DATA_FILE}...")
-            if not os.path.exists(LOCAL_DATA_FILE):
-                raise FileNotFoundError(f"Local data file {LOCAL_DATA_FILE} missing after download attempt.")
-                
-            with open(LOCAL_DATA_FILE, 'r', encoding='utf-8') as f:
-                objects = ijson.items(f, 'catalog.item.products.item')
-                for p in objects:
-                    process_item_loop(p, rates, ts, existing, cur_upsert, cur_snap, stats_helper)
+            if quiet:
+                notify.notify_start(host)
+            progress.stage("rates", "Waiting for exchange rates...")
+            rates_info = rates_future.result()
+            rates = rates_info["rates"]
+            progress.update(rates=rates_info)
+            log_with_timestamp(f"Current Rates ({rates_info['source']}): {rates}", **rates_info)
 
-            log_with_timestamp("Rotating snapshots...")
-            rotate_snapshots(conn, ts)
-            
-            log_with_timestamp("Updating meta...")
-            db.set_meta_value(conn, 'last_reload_ts', str(ts))
-            if new_etag: db.set_meta_value(conn, 'last_etag', new_etag)
-            if new_mtime: db.set_meta_value(conn, 'last_modified', new_mtime)
-            # Store that we processed this specific version successfully
-            if new_etag: db.set_meta_value(conn, 'proc_etag', new_etag)
-            if new_mtime: db.set_meta_value(conn, 'proc_mtime', new_mtime)
-            
-            log_with_timestamp("Committing transaction...")
-            conn.execute("COMMIT")
+            progress.stage("load_existing", "Loading existing data...")
+            seq_before, existing = _load_existing(conn)
             
-            # Explicitly close cursors
-            cur_upsert.close()
-            cur_snap.close()
+            if BULK_LOAD == "1" or (BULK_LOAD == "auto" and not existing):
+                ingest_bulk(conn, rates, ts, existing, stats_helper, progress, new_etag, new_mtime)
+            elif INGEST_MODE == "direct":
+                ingest_direct(conn, rates, ts, existing, stats_helper, progress, new_etag, new_mtime)
+            else:
+                ingest_staged(conn, rates, ts, existing, stats_helper, progress, new_etag, new_mtime)
+            # One sequence number per new/changed item: anything more was handed out by someone else
+            if _keep_warm_index and db.get_change_seq(conn) == seq_before + stats_helper.inserted + stats_helper.changed:
+                _warm_index = (db.get_change_seq(conn), existing)
             conn.close()
-            
-            if 'f' in locals():
-                f.close()
+
+            progress.stage("warm_reports", "Precomputing default reports...")
+            log_with_timestamp("Precomputing default reports...")
+            warm_report_cache()
 
             # Run vacuum ONLY if something actually changed and we have a clean status
             # This prevents infinite loops of vacuum failing on a full disk when nothing is even happening
             if stats_helper.inserted > 0 or stats_helper.changed > 0 or stats_helper.snap_added > 0:
+                progress.stage("vacuum", "Reclaiming storage space...")
                 vacuum_db()
 
             stats = {
@@ -491,17 +971,21 @@ def run():
             except OSError:
                 pass
 
+            progress.finish("done", processed=stats_helper.total_count,
+                            inserted=stats_helper.inserted, changed=stats_helper.changed,
+                            snapshots_added=stats_helper.snap_added,
+                            message=f"Done: {stats_helper.inserted} new, {stats_helper.changed} changed")
+            save_run_history(progress)
+            stats["stages"] = progress.status["stages"]
             notify.notify_success(stats)
             
-            # Notify about sharp price changes
-            if stats_helper.sharp_changes:
-                # Filter for Telegram: ONLY "our_price" changes
-                tg_changes = [c for c in stats_helper.sharp_changes if c['type'] == 'our_price']
-                if tg_changes:
-                    log_with_timestamp(f"Found {len(tg_changes)} sharp 'Our Price' changes. Sending notification...")
-                    notify.notify_price_changes(tg_changes)
-                else:
-                    log_with_timestamp(f"Found {len(stats_helper.sharp_changes)} total changes, but none were 'Our Price'. Skipping TG notification.")
+            # Notify about sharp price changes (Telegram: ONLY "our_price" changes)
+            sharp = stats_helper.sharp_changes
+            if sharp["our_price"]:
+                log_with_timestamp(f"Found {sharp['our_price']} sharp 'Our Price' changes. Sending notification...")
+                send_price_alerts(ts, sharp["our_price"])
+            elif sharp["min_price"]:
+                log_with_timestamp(f"Found {sharp['min_price']} sharp min price changes, but none were 'Our Price'. Skipping TG notification.")
 
             # Check for missing items (deleted from feed)
             if existing: # Only check if we had existing items
@@ -525,20 +1009,36 @@ def run():
                     except Exception as e:
                         log_with_timestamp(f"Failed to save missing items: {e}")
                 
-            log_with_timestamp(json.dumps(stats))
+            log_with_timestamp(
+                f"Run finished: {stats['inserted']} inserted, {stats['changed']} changed, "
+                f"{stats['total']} total in {stats['duration']:.1f}s", **stats)
 
         finally:
             conn.close()
+            rates_pool.shutdown(wait=True)
+        return progress.status
 
     except Exception as e:
         import traceback
         err_msg = traceback.format_exc()
         log_with_timestamp(f"Worker crashed:\n{err_msg}")
         last_part = err_msg[-200:] if len(err_msg) > 200 else err_msg
+        progress.finish("failed", message=str(e), error=last_part)
+        save_run_history(progress)
         notify.notify_fail(f"Worker Error:\n{str(e)}\n\nTraceback summary:\n{last_part}")
         raise
     finally:
-        release_lock()
+        _active_progress = None
+        heartbeat.stop()
 
 if __name__ == "__main__":
-    run()
+    import argparse
+    parser = argparse.ArgumentParser(description="PriceWeb data worker")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--daemon", action="store_true", help="Stay running and consume the jobs queue")
+    mode.add_argument("--drain", action="store_true", help="Run the queued jobs, then exit")
+    args = parser.parse_args()
+    if args.daemon or args.drain:
+        serve(drain=args.drain)
+    else:
+        run()
@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import fcntl
+import sqlite3
+import threading
+from typing import Any, Callable, Dict
+
+import db
+
+# Single-worker lock, coalesced run requests and a heartbeat for worker.py.
+# The lock is a kernel advisory lock (flock) on LOCK_FILE: it is released by the kernel when
+# the process dies, so there is no staleness timeout to tune. A trigger that finds the lock
+# taken drops a request file instead; the running worker does one more run when it finishes,
+# however many requests piled up meanwhile.
+
+LOCK_FILE = os.environ.get("PRICE_WORKER_LOCK", "data/worker.lock")
+RERUN_FILE = f"{LOCK_FILE}.rerun"
+HEARTBEAT_INTERVAL = float(os.environ.get("WORKER_HEARTBEAT_SECONDS", "10"))
+
+# Held by the long-lived job consumer (worker.py --daemon / --drain), see jobs.py
+CONSUMER_LOCK_FILE = f"{LOCK_FILE}.consumer"
+
+_fds: Dict[str, int] = {}
+
+def _acquire(path: str) -> bool:
+    if path in _fds:
+        return True
+    lock_dir = os.path.dirname(path)
+    if lock_dir:
+        os.makedirs(lock_dir, exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return False
+    # Owner PID for humans (lsof/cat); the lock itself is the flock, not the content
+    os.ftruncate(fd, 0)
+    os.write(fd, str(os.getpid()).encode())
+    _fds[path] = fd
+    return True
+
+def _release(path: str) -> None:
+    fd = _fds.pop(path, None)
+    if fd is None:
+        return
+    # The file stays: unlinking it would let a waiter lock a file nobody else opens
+    fcntl.flock(fd, fcntl.LOCK_UN)
+    os.close(fd)
+
+def _is_held(path: str) -> bool:
+    if path in _fds:
+        return True
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return False
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+    except OSError:
+        return True
+    else:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        return False
+    finally:
+        os.close(fd)
+
+def acquire() -> bool:
+    """Takes the worker lock without waiting; False if another process holds it."""
+    return _acquire(LOCK_FILE)
+
+def release() -> None:
+    _release(LOCK_FILE)
+
+def is_running() -> bool:
+    """True if some process (this one included) holds the worker lock."""
+    return _is_held(LOCK_FILE)
+
+def acquire_consumer() -> bool:
+    """Only one process consumes the jobs queue."""
+    return _acquire(CONSUMER_LOCK_FILE)
+
+def release_consumer() -> None:
+    _release(CONSUMER_LOCK_FILE)
+
+def consumer_running() -> bool:
+    return _is_held(CONSUMER_LOCK_FILE)
+
+def request_rerun(source: str = "") -> None:
+    """Asks the running worker for one more run after the current one (idempotent)."""
+    tmp = f"{RERUN_FILE}.tmp.{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"ts": int(time.time()), "source": source, "pid": os.getpid()}, f)
+    os.replace(tmp, RERUN_FILE)
+
+def rerun_pending() -> bool:
+    return os.path.exists(RERUN_FILE)
+
+def take_rerun_request() -> bool:
+    """Clears a pending request; True if there was one."""
+    try:
+        os.remove(RERUN_FILE)
+        return True
+    except FileNotFoundError:
+        return False
+
+def write_heartbeat(payload: Dict[str, Any]) -> bool:
+    """Stores the heartbeat in meta; best effort (skipped while another writer holds the DB)."""
+    try:
+        conn = db.get_connection(timeout=1)
+    except sqlite3.Error:
+        return False
+    try:
+        db.set_meta_value(conn, 'worker_heartbeat', json.dumps(dict(payload, updated_at=int(time.time()))))
+        conn.commit()
+        return True
+    except sqlite3.Error:
+        return False
+    finally:
+        conn.close()
+
+def status(conn: sqlite3.Connection) -> Dict[str, Any]:
+    """Last heartbeat plus whether the lock is held right now and a run is queued.
+
+    A heartbeat with state "running" while the lock is free means the worker died mid-run.
+    """
+    try:
+        heartbeat = json.loads(db.get_meta_value(conn, 'worker_heartbeat') or "null")
+    except ValueError:
+        heartbeat = None
+    return {"running": is_running(), "rerun_pending": rerun_pending(), "consumer_running": consumer_running(),
+            "heartbeat": heartbeat}
+
+class Heartbeat:
+    """Background thread writing `payload_fn()` to meta every HEARTBEAT_INTERVAL seconds."""
+
+    def __init__(self, payload_fn: Callable[[], Dict[str, Any]], interval: float = HEARTBEAT_INTERVAL):
+        self.payload_fn = payload_fn
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="worker-heartbeat", daemon=True)
+
+    def start(self) -> "Heartbeat":
+        self._thread.start()
+        return self
+
+    def _loop(self) -> None:
+        while True:
+            write_heartbeat(self.payload_fn())
+            if self._stop.wait(self.interval):
+                return
+
+    def stop(self) -> None:
+        """Stops the thread and writes the final state."""
+        self._stop.set()
+        self._thread.join(timeout=5)
+        write_heartbeat(self.payload_fn())